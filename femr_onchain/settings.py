@@ -76,6 +76,8 @@ AUTHENTICATION_BACKENDS = [
 ]
 
 MIDDLEWARE = [
+    "main.middleware.MetricsMiddleware",
+    "main.middleware.QueryBudgetMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "whitenoise.middleware.WhiteNoiseMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
@@ -86,6 +88,7 @@ MIDDLEWARE = [
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
     "axes.middleware.AxesMiddleware",
     "session_security.middleware.SessionSecurityMiddleware",
+    "main.middleware.CurrentCampaignMiddleware",
     "main.middleware.TimezoneMiddleware",
     "main.middleware.CampaignActivityCheckMiddleware",
     "main.middleware.ClinicMessageMiddleware",
@@ -93,9 +96,22 @@ MIDDLEWARE = [
     "django_user_agents.middleware.UserAgentMiddleware",
 ]
 
-if os.environ.get("SILK_OFF", None) is None:
+# Silk writes a profile of every intercepted request to the database, so it's
+# only enabled on request. Day to day timings come from main.instrumentation.
+if os.environ.get("SILK_ON", None) is not None:
     MIDDLEWARE += ["silk.middleware.SilkyMiddleware"]
 
+# Requests whose path matches one of these patterns skip the campaign activity
+# check and the unread message count, neither of which they use.
+MIDDLEWARE_FAST_PATH_URLS = [
+    r"^/healthcheck/$",
+    r"^/metrics$",
+    r"^/api/",
+    r"^/api-auth/",
+    r"^/[\w-]+-autocomplete/$",
+    r"^/session_security/",
+]
+
 ROOT_URLCONF = "femr_onchain.urls"
 
 TEMPLATES = [
@@ -229,6 +245,10 @@ LOGGING = {
             "class": "logging.StreamHandler",
             "formatter": "django.server",
         },
+        "instrumentation": {
+            "level": "INFO",
+            "class": "logging.StreamHandler",
+        },
         "mail_admins": {
             "level": "ERROR",
             "filters": ["require_debug_false"],
@@ -245,6 +265,16 @@ LOGGING = {
             "level": "INFO",
             "propagate": False,
         },
+        "femr.instrumentation": {
+            "handlers": ["instrumentation"],
+            "level": "INFO",
+            "propagate": False,
+        },
+        "femr.query_budget": {
+            "handlers": ["instrumentation"],
+            "level": "WARNING",
+            "propagate": False,
+        },
     },
 }
 
@@ -281,7 +311,9 @@ SESSION_COOKIE_AGE = 900
 SESSION_SECURITY_EXPIRE_AFTER = 900
 SESSION_SECURITY_WARN_AFTER = 840
 SESSION_EXPIRE_AT_BROWSER_CLOSE = True
-SESSION_SAVE_EVERY_REQUEST = True
+# session_security still saves the session on every request it doesn't treat as
+# passive, so this only spares the write on passive ones (its activity pings).
+SESSION_SAVE_EVERY_REQUEST = False
 
 if "aws_access_key_id" in os.environ:
     AWS_ACCESS_KEY_ID = os.environ.get("aws_access_key_id")
@@ -321,5 +353,56 @@ SILKY_INTERCEPT_PERCENT = 50
 SILKY_MAX_RECORDED_REQUESTS = 10**3
 SILKY_MAX_RECORDED_REQUESTS_CHECK_PERCENT = 10
 
+# Fraction of calls timed for each instrumented span. Small helpers that run
+# many times per request are sampled so that timing them stays cheap.
+INSTRUMENTATION_DEFAULT_SAMPLE_RATE = float(
+    os.environ.get("INSTRUMENTATION_SAMPLE_RATE", 1.0)
+)
+INSTRUMENTATION_SAMPLE_RATES = {
+    "get-latest-timestamp": 0.01,
+    "check-admin-permission": 0.01,
+    "check-browser": 0.01,
+    "history_view_imperial": 0.1,
+    "new-vitals-imperial": 0.1,
+    "new_diagnosis_imperial": 0.1,
+    "update-form-initial-imperial": 0.1,
+    "new_treatment_imperial": 0.1,
+    "aux-form-imperial": 0.1,
+    "cached-encounter-cells": 0.01,
+    "export-column-widths": 0.1,
+    "build-title-row": 0.1,
+}
+INSTRUMENTATION_EXPORTERS = [
+    "main.instrumentation.PrometheusExporter",
+]
+if os.environ.get("INSTRUMENTATION_JSON_LOGS", None) is not None:
+    INSTRUMENTATION_EXPORTERS += ["main.instrumentation.JsonLogExporter"]
+
+# The most queries one request to each view should run, by URL name. Requests
+# over budget are logged to femr.query_budget, and tests can assert them with
+# main.query_budget.assert_query_budget.
+QUERY_BUDGETS = {
+    "main:healthcheck": 0,
+    "main:metrics": 1,
+    # The patient lists show at most a page of 10 patients, each costing a
+    # query for open encounters and one for campaigns.
+    "main:patient_list_view": 35,
+    "main:filter_patient_list_view": 35,
+    "main:search_patient_list_view": 35,
+    "main:csv_export_list": 15,
+    "main:encounter_edit_form_view": 30,
+}
+QUERY_BUDGET_DEFAULT = int(os.environ.get("QUERY_BUDGET_DEFAULT", 100))
+
+# /metrics is closed unless configured. With METRICS_TOKEN set, it only answers
+# requests carrying the token as a bearer token. Without one, it answers
+# requests made straight to the app, not through nginx, from METRICS_ALLOWED_IPS,
+# or anyone at all if METRICS_PUBLIC is set.
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN")
+METRICS_ALLOWED_IPS = [
+    ip for ip in os.environ.get("METRICS_ALLOWED_IPS", "").split(",") if ip
+]
+METRICS_PUBLIC = os.environ.get("METRICS_PUBLIC", None) is not None
+
 CELERY_BROKER_URL = "redis://redis:6379"
 CELERY_RESULT_BACKEND = "redis://redis:6379"
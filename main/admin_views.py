@@ -1,8 +1,6 @@
 """
 View functions for administrative actions.
 """
-import itertools
-import operator
 import os
 from datetime import datetime, timedelta
 
@@ -31,8 +29,11 @@ from main.models import (
     fEMRUser,
     AuditEntry,
     DatabaseChangeLog,
-    Campaign,
 )
+from main.pagination import KeysetPaginator
+from main.user_groups import in_group
+
+LOG_PAGE_SIZE = 50
 
 
 @is_admin
@@ -53,12 +54,8 @@ def admin_home(request):
 @is_authenticated
 def list_users_view(request):
     try:
-        active_users = Campaign.objects.get(
-            name=request.user.current_campaign
-        ).femruser_set.filter(is_active=True)
-        inactive_users = Campaign.objects.get(
-            name=request.user.current_campaign
-        ).femruser_set.filter(is_active=False)
+        active_users = request.campaign.femruser_set.filter(is_active=True)
+        inactive_users = request.campaign.femruser_set.filter(is_active=False)
     except ObjectDoesNotExist:
         active_users = []
         inactive_users = []
@@ -78,9 +75,7 @@ def list_users_view(request):
 @is_authenticated
 def filter_users_view(request):
     try:
-        data = Campaign.objects.get(
-            name=request.user.current_campaign
-        ).femruser_set.filter(is_active=True)
+        data = request.campaign.femruser_set.filter(is_active=True)
     except ObjectDoesNotExist:
         data = ""
     return render(
@@ -94,9 +89,7 @@ def filter_users_view(request):
 @is_authenticated
 def search_users_view(request):
     try:
-        data = Campaign.objects.get(
-            name=request.user.current_campaign
-        ).femruser_set.filter(is_active=True)
+        data = request.campaign.femruser_set.filter(is_active=True)
     except ObjectDoesNotExist:
         data = ""
     return render(
@@ -107,11 +100,7 @@ def search_users_view(request):
 
 
 def __create_user_view_get(request):
-    form = (
-        fEMRAdminUserForm()
-        if request.user.groups.filter(name="fEMR Admin").exists()
-        else UserForm()
-    )
+    form = fEMRAdminUserForm() if in_group(request.user, "fEMR Admin") else UserForm()
     return render(
         request,
         "admin/user_create_form.html",
@@ -122,7 +111,7 @@ def __create_user_view_get(request):
 def __create_user_view_post(request):
     form = (
         fEMRAdminUserForm(request.POST)
-        if request.user.groups.filter(name="fEMR Admin").exists()
+        if in_group(request.user, "fEMR Admin")
         else UserForm(request.POST)
     )
     if form.is_valid():
@@ -151,7 +140,7 @@ def __create_user_view_post(request):
             instance=str(item),
             ip=get_client_ip(request),
             username=request.user.username,
-            campaign=Campaign.objects.get(name=request.user.current_campaign),
+            campaign=request.campaign,
         )
         return_response = render(request, "admin/user_edit_confirmed.html")
     else:
@@ -180,7 +169,7 @@ def update_user_view(request, user_id=None):
     if request.method == "POST":
         form = (
             fEMRAdminUserUpdateForm(request.POST or None, instance=user)
-            if request.user.groups.filter(name="fEMR Admin").exists()
+            if in_group(request.user, "fEMR Admin")
             else UserUpdateForm(request.user, request.POST or None, instance=user)
         )
         if form.is_valid():
@@ -192,7 +181,7 @@ def update_user_view(request, user_id=None):
                 instance=str(item),
                 ip=get_client_ip(request),
                 username=request.user.username,
-                campaign=Campaign.objects.get(name=request.user.current_campaign),
+                campaign=request.campaign,
             )
             return_response = render(request, "admin/user_edit_confirmed.html")
         else:
@@ -209,7 +198,7 @@ def update_user_view(request, user_id=None):
     else:
         form = (
             fEMRAdminUserUpdateForm(instance=user)
-            if request.user.groups.filter(name="fEMR Admin").exists()
+            if in_group(request.user, "fEMR Admin")
             else UserUpdateForm(request.user, instance=user)
         )
         return_response = render(
@@ -242,7 +231,7 @@ def update_user_password_view(request, user_id=None):
                 instance=str(item),
                 ip=get_client_ip(request),
                 username=request.user.username,
-                campaign=Campaign.objects.get(name=request.user.current_campaign),
+                campaign=request.campaign,
             )
             return_response = render(request, "admin/user_edit_confirmed.html")
         else:
@@ -287,165 +276,87 @@ def unlock_user_view(request, user_id=None):
 def get_audit_logs_view(request):
     try:
         data = AuditEntry.objects.filter(
-            Q(campaign=Campaign.objects.get(name=request.user.current_campaign))
-            | Q(action="user_login_failed")
+            Q(campaign=request.campaign) | Q(action="user_login_failed")
         ).order_by("-timestamp")
     except ObjectDoesNotExist:
-        data = ""
+        data = []
     return render(
         request,
         "admin/audit_log_list.html",
         {
             "user": request.user,
             "selected": 6,
-            "log": data,
+            "log": KeysetPaginator(data, LOG_PAGE_SIZE).get_page(
+                request.GET.get("after"), request.GET.get("before")
+            ),
             "page_name": "Login Log",
         },
     )
 
 
-def __filter_audit_logs_process(request):
+def __log_filter(request):
+    """
+    The timestamp condition of the log filter chosen on a log page, or None if
+    the choice is unknown. A day or range that doesn't parse matches nothing.
+    """
+    choice = request.GET["filter_list"]
     try:
-        logs = AuditEntry.objects.all()
-        campaign = Campaign.objects.get(name=request.user.current_campaign)
-        if request.GET["filter_list"] == "1":
+        if choice == "1":
             now = timezone.make_aware(datetime.today(), timezone.get_default_timezone())
             now = now.astimezone(timezone.get_current_timezone())
-            data = set(
-                list(
-                    itertools.chain(
-                        logs.filter(timestamp__date=now)
-                        .order_by("-timestamp")
-                        .filter(Q(campaign=campaign) | Q(action="user_login_failed")),
-                        logs.filter(timestamp__date=now)
-                        .filter(Q(campaign=campaign) | Q(action="user_login_failed"))
-                        .order_by("-timestamp"),
-                    )
-                )
-            )
-            selected = 1
-        elif request.GET["filter_list"] == "2":
-            timestamp_from = timezone.now() - timedelta(days=7)
+            condition = Q(timestamp__date=now)
+        elif choice in ("2", "3"):
             timestamp_to = timezone.now()
-            data = set(
-                list(
-                    itertools.chain(
-                        logs.filter(
-                            timestamp__gte=timestamp_from, timestamp__lt=timestamp_to
-                        )
-                        .filter(Q(campaign=campaign) | Q(action="user_login_failed"))
-                        .order_by("-timestamp"),
-                        logs.filter(
-                            timestamp__gte=timestamp_from,
-                            timestamp__lt=timestamp_to,
-                        )
-                        .filter(Q(campaign=campaign) | Q(action="user_login_failed"))
-                        .order_by("-timestamp"),
-                    )
-                )
-            )
-            selected = 2
-        elif request.GET["filter_list"] == "3":
-            timestamp_from = timezone.now() - timedelta(days=30)
-            timestamp_to = timezone.now()
-            data = set(
-                list(
-                    itertools.chain(
-                        logs.filter(
-                            timestamp__gte=timestamp_from, timestamp__lt=timestamp_to
-                        )
-                        .filter(Q(campaign=campaign) | Q(action="user_login_failed"))
-                        .order_by("-timestamp"),
-                        logs.filter(
-                            timestamp__gte=timestamp_from,
-                            timestamp__lt=timestamp_to,
-                        )
-                        .filter(Q(campaign=campaign) | Q(action="user_login_failed"))
-                        .order_by("-timestamp"),
-                    )
-                )
+            timestamp_from = timestamp_to - timedelta(days=7 if choice == "2" else 30)
+            condition = Q(timestamp__gte=timestamp_from, timestamp__lt=timestamp_to)
+        elif choice == "4":
+            timestamp_from = datetime.strptime(
+                request.GET["date_filter_day"], "%Y-%m-%d"
+            ).replace(hour=0, minute=0, second=0, microsecond=0)
+            timestamp_to = datetime.strptime(
+                request.GET["date_filter_day"], "%Y-%m-%d"
+            ).replace(hour=23, minute=59, second=59, microsecond=0)
+            condition = Q(timestamp__gte=timestamp_from, timestamp__lt=timestamp_to)
+        elif choice == "5":
+            timestamp_from = datetime.strptime(
+                request.GET["date_filter_start"], "%Y-%m-%d"
             )
-            selected = 3
-        elif request.GET["filter_list"] == "4":
-            try:
-                timestamp_from = datetime.strptime(
-                    request.GET["date_filter_day"], "%Y-%m-%d"
-                ).replace(hour=0, minute=0, second=0, microsecond=0)
-                timestamp_to = datetime.strptime(
-                    request.GET["date_filter_day"], "%Y-%m-%d"
-                ).replace(hour=23, minute=59, second=59, microsecond=0)
-                data = set(
-                    list(
-                        itertools.chain(
-                            logs.filter(
-                                timestamp__gte=timestamp_from,
-                                timestamp__lt=timestamp_to,
-                            )
-                            .filter(
-                                Q(campaign=campaign) | Q(action="user_login_failed")
-                            )
-                            .order_by("-timestamp"),
-                            logs.filter(
-                                timestamp__gte=timestamp_from,
-                                timestamp__lt=timestamp_to,
-                            )
-                            .filter(campaign=campaign)
-                            .order_by("-timestamp"),
-                        )
-                    )
-                )
-            except ValueError:
-                data = []
-            selected = 4
-        elif request.GET["filter_list"] == "5":
-            try:
-                timestamp_from = datetime.strptime(
-                    request.GET["date_filter_start"], "%Y-%m-%d"
-                )
-                timestamp_to = datetime.strptime(
-                    request.GET["date_filter_end"], "%Y-%m-%d"
-                ) + timedelta(days=1)
-                data = set(
-                    list(
-                        itertools.chain(
-                            logs.filter(
-                                timestamp__gte=timestamp_from,
-                                timestamp__lt=timestamp_to,
-                            )
-                            .filter(
-                                Q(campaign=campaign) | Q(action="user_login_failed")
-                            )
-                            .order_by("-timestamp"),
-                            logs.filter(
-                                timestamp__gte=timestamp_from,
-                                timestamp__lt=timestamp_to,
-                            )
-                            .filter(campaign=campaign)
-                            .order_by("-timestamp"),
-                        )
-                    )
-                )
-            except ValueError:
-                data = []
-            selected = 5
+            timestamp_to = datetime.strptime(
+                request.GET["date_filter_end"], "%Y-%m-%d"
+            ) + timedelta(days=1)
+            condition = Q(timestamp__gte=timestamp_from, timestamp__lt=timestamp_to)
+        elif choice == "6":
+            condition = Q()
+        else:
+            condition = None
+    except ValueError:
+        condition = Q(pk__in=[])
+    return condition
+
+
+def __filter_audit_logs_process(request):
+    condition = __log_filter(request)
+    try:
+        if condition is None:
+            data = AuditEntry.objects.none()
         elif request.GET["filter_list"] == "6":
-            try:
-                data = logs.filter(campaign=campaign).order_by("-timestamp")
-            except ValueError:
-                data = []
-            selected = 6
+            data = AuditEntry.objects.filter(campaign=request.campaign)
         else:
-            data = []
+            data = AuditEntry.objects.filter(condition).filter(
+                Q(campaign=request.campaign) | Q(action="user_login_failed")
+            )
+        data = data.order_by("-timestamp")
     except ObjectDoesNotExist:
         data = []
-    data = sorted(data, key=operator.attrgetter("timestamp"), reverse=True)
     return render(
         request,
         "admin/audit_log_list.html",
         {
             "user": request.user,
-            "selected": selected,
-            "log": data,
+            "selected": int(request.GET["filter_list"]),
+            "log": KeysetPaginator(data, LOG_PAGE_SIZE).get_page(
+                request.GET.get("after"), request.GET.get("before")
+            ),
             "page_name": "Login Log",
             "filter_day": request.GET["date_filter_day"],
             "filter_start": request.GET["date_filter_start"],
@@ -465,15 +376,20 @@ def filter_audit_logs_view(request):
 def search_audit_logs_view(request):
     try:
         data = AuditEntry.objects.filter(
-            Q(campaign=Campaign.objects.get(name=request.user.current_campaign))
-            | Q(action="user_login_failed")
-        )
+            Q(campaign=request.campaign) | Q(action="user_login_failed")
+        ).order_by("-timestamp")
     except ObjectDoesNotExist:
-        data = ""
+        data = []
     return render(
         request,
         "admin/audit_log_list.html",
-        {"user": request.user, "list_view": data, "page_name": "Login Log"},
+        {
+            "user": request.user,
+            "log": KeysetPaginator(data, LOG_PAGE_SIZE).get_page(
+                request.GET.get("after"), request.GET.get("before")
+            ),
+            "page_name": "Login Log",
+        },
     )
 
 
@@ -483,11 +399,7 @@ def export_audit_logs_view(request):
     return render(
         request,
         "export/audit_logfile.html",
-        {
-            "log": AuditEntry.objects.filter(
-                campaign=Campaign.objects.get(name=request.user.current_campaign)
-            )
-        },
+        {"log": AuditEntry.objects.filter(campaign=request.campaign)},
     )
 
 
@@ -497,7 +409,7 @@ def get_database_logs_view(request):
         excludemodels = ["Campaign", "Instance"]
         data = (
             DatabaseChangeLog.objects.exclude(model__in=excludemodels)
-            .filter(campaign=Campaign.objects.get(name=request.user.current_campaign))
+            .filter(campaign=request.campaign)
             .order_by("-timestamp")
         )
     except ObjectDoesNotExist:
@@ -508,7 +420,9 @@ def get_database_logs_view(request):
         {
             "user": request.user,
             "selected": 6,
-            "list_view": data,
+            "list_view": KeysetPaginator(data, LOG_PAGE_SIZE).get_page(
+                request.GET.get("after"), request.GET.get("before")
+            ),
             "page_name": "Patient Change Log",
         },
     )
@@ -516,178 +430,28 @@ def get_database_logs_view(request):
 
 def __filter_database_logs_check(request):
     excludemodels = ["Campaign", "Instance"]
+    condition = __log_filter(request)
     try:
-        logs = DatabaseChangeLog.objects.all().iterator()
-        if request.GET["filter_list"] == "1":
-            now = timezone.make_aware(datetime.today(), timezone.get_default_timezone())
-            now = now.astimezone(timezone.get_current_timezone())
-            data = set(
-                list(
-                    itertools.chain(
-                        logs.exclude(model__in=excludemodels)
-                        .filter(timestamp__date=now)
-                        .filter(
-                            campaign=Campaign.objects.get(
-                                name=request.user.current_campaign
-                            )
-                        ),
-                        logs.exclude(model__in=excludemodels)
-                        .filter(timestamp__date=now)
-                        .filter(
-                            campaign=Campaign.objects.get(
-                                name=request.user.current_campaign
-                            )
-                        ),
-                    )
-                )
-            )
-        elif request.GET["filter_list"] == "2":
-            timestamp_from = timezone.now() - timedelta(days=7)
-            timestamp_to = timezone.now()
-            data = set(
-                list(
-                    itertools.chain(
-                        logs.exclude(model__in=excludemodels)
-                        .filter(
-                            timestamp__gte=timestamp_from, timestamp__lt=timestamp_to
-                        )
-                        .filter(
-                            campaign=Campaign.objects.get(
-                                name=request.user.current_campaign
-                            )
-                        ),
-                        logs.exclude(model__in=excludemodels)
-                        .filter(
-                            timestamp__gte=timestamp_from,
-                            timestamp__lt=timestamp_to,
-                        )
-                        .filter(
-                            campaign=Campaign.objects.get(
-                                name=request.user.current_campaign
-                            )
-                        ),
-                    )
-                )
-            )
-        elif request.GET["filter_list"] == "3":
-            timestamp_from = timezone.now() - timedelta(days=30)
-            timestamp_to = timezone.now()
-            data = set(
-                list(
-                    itertools.chain(
-                        logs.exclude(model__in=excludemodels)
-                        .filter(
-                            timestamp__gte=timestamp_from, timestamp__lt=timestamp_to
-                        )
-                        .filter(
-                            campaign=Campaign.objects.get(
-                                name=request.user.current_campaign
-                            )
-                        ),
-                        logs.exclude(model__in=excludemodels)
-                        .filter(
-                            timestamp__gte=timestamp_from,
-                            timestamp__lt=timestamp_to,
-                        )
-                        .filter(
-                            campaign=Campaign.objects.get(
-                                name=request.user.current_campaign
-                            )
-                        ),
-                    )
-                )
-            )
-        elif request.GET["filter_list"] == "4":
-            try:
-                timestamp_from = datetime.strptime(
-                    request.GET["date_filter_day"], "%Y-%m-%d"
-                ).replace(hour=0, minute=0, second=0, microsecond=0)
-                timestamp_to = datetime.strptime(
-                    request.GET["date_filter_day"], "%Y-%m-%d"
-                ).replace(hour=23, minute=59, second=59, microsecond=0)
-                data = set(
-                    list(
-                        itertools.chain(
-                            logs.exclude(model__in=excludemodels)
-                            .filter(
-                                timestamp__gte=timestamp_from,
-                                timestamp__lt=timestamp_to,
-                            )
-                            .filter(
-                                campaign=Campaign.objects.get(
-                                    name=request.user.current_campaign
-                                )
-                            ),
-                            logs.exclude(model__in=excludemodels)
-                            .filter(
-                                timestamp__gte=timestamp_from,
-                                timestamp__lt=timestamp_to,
-                            )
-                            .filter(
-                                campaign=Campaign.objects.get(
-                                    name=request.user.current_campaign
-                                )
-                            ),
-                        )
-                    )
-                )
-            except ValueError:
-                data = []
-        elif request.GET["filter_list"] == "5":
-            try:
-                timestamp_from = datetime.strptime(
-                    request.GET["date_filter_start"], "%Y-%m-%d"
-                )
-                timestamp_to = datetime.strptime(
-                    request.GET["date_filter_end"], "%Y-%m-%d"
-                ) + timedelta(days=1)
-                data = set(
-                    list(
-                        itertools.chain(
-                            logs.exclude(model__in=excludemodels)
-                            .filter(
-                                timestamp__gte=timestamp_from,
-                                timestamp__lt=timestamp_to,
-                            )
-                            .filter(
-                                campaign=Campaign.objects.get(
-                                    name=request.user.current_campaign
-                                )
-                            ),
-                            logs.exclude(model__in=excludemodels)
-                            .filter(
-                                timestamp__gte=timestamp_from,
-                                timestamp__lt=timestamp_to,
-                            )
-                            .filter(
-                                campaign=Campaign.objects.get(
-                                    name=request.user.current_campaign
-                                )
-                            ),
-                        )
-                    )
-                )
-            except ValueError:
-                data = []
-        elif request.GET["filter_list"] == "6":
-            try:
-                data = logs.exclude(model__in=excludemodels).filter(
-                    campaign=Campaign.objects.get(name=request.user.current_campaign)
-                )
-            except ValueError:
-                data = []
+        if condition is None:
+            data = DatabaseChangeLog.objects.none()
         else:
-            data = []
+            data = (
+                DatabaseChangeLog.objects.exclude(model__in=excludemodels)
+                .filter(condition)
+                .filter(campaign=request.campaign)
+                .order_by("-timestamp")
+            )
     except ObjectDoesNotExist:
         data = []
-    data = sorted(data, key=operator.attrgetter("timestamp"), reverse=True)
     return render(
         request,
         "admin/database_log_list.html",
         {
             "user": request.user,
             "selected": int(request.GET["filter_list"]),
-            "list_view": data,
+            "list_view": KeysetPaginator(data, LOG_PAGE_SIZE).get_page(
+                request.GET.get("after"), request.GET.get("before")
+            ),
             "page_name": "Patient Change Log",
             "filter_day": request.GET["date_filter_day"],
             "filter_start": request.GET["date_filter_start"],
@@ -706,17 +470,21 @@ def filter_database_logs_view(request):
 def search_database_logs_view(request):
     try:
         excludemodels = ["Campaign", "Instance"]
-        data = DatabaseChangeLog.objects.exclude(model__in=excludemodels).filter(
-            campaign=Campaign.objects.get(name=request.user.current_campaign)
+        data = (
+            DatabaseChangeLog.objects.exclude(model__in=excludemodels)
+            .filter(campaign=request.campaign)
+            .order_by("-timestamp")
         )
     except ObjectDoesNotExist:
-        data = ""
+        data = []
     return render(
         request,
         "admin/database_log_list.html",
         {
             "user": request.user,
-            "list_view": data,
+            "list_view": KeysetPaginator(data, LOG_PAGE_SIZE).get_page(
+                request.GET.get("after"), request.GET.get("before")
+            ),
             "page_name": "Patient Change Log",
         },
     )
@@ -730,7 +498,7 @@ def export_database_logs_view(request):
         "export/data_logfile.html",
         {
             "log": DatabaseChangeLog.objects.exclude(model__in=excludemodels).filter(
-                campaign=Campaign.objects.get(name=request.user.current_campaign)
+                campaign=request.campaign
             )
         },
     )
@@ -750,7 +518,7 @@ def add_users_to_campaign(request):
 @is_authenticated
 def add_user_to_campaign(request, user_id=None):
     user = fEMRUser.objects.get(pk=user_id)
-    user.campaigns.add(Campaign.objects.get(name=request.user.current_campaign))
+    user.campaigns.add(request.campaign)
     user.save()
     return render(
         request,
@@ -763,7 +531,7 @@ def add_user_to_campaign(request, user_id=None):
 @is_authenticated
 def cut_user_from_campaign(request, user_id=None):
     user = fEMRUser.objects.get(pk=user_id)
-    user.campaigns.remove(Campaign.objects.get(name=request.user.current_campaign))
+    user.campaigns.remove(request.campaign)
     user.save()
     return render(
         request,
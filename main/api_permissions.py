@@ -1,21 +1,23 @@
 from rest_framework import permissions
 
+from main.user_groups import in_group
+
 
 class IsfEMRAdmin(permissions.BasePermission):
     def has_object_permission(self, request, view, obj):
-        return request.user.groups.filter(name="fEMR Admin").exists()
+        return in_group(request.user, "fEMR Admin")
 
 
 class IsAdmin(permissions.BasePermission):
     def has_object_permission(self, request, view, obj):
-        return request.user.groups.filter(name="Admin").exists()
+        return in_group(request.user, "Admin")
 
 
 class IsManager(permissions.BasePermission):
     def has_object_permission(self, request, view, obj):
-        return request.user.groups.filter(name="Manager").exists()
+        return in_group(request.user, "Manager")
 
 
 class IsAPIAllowed(permissions.BasePermission):
     def has_object_permission(self, request, view, obj):
-        return request.user.groups.filter(name="API Allowed").exists()
+        return in_group(request.user, "API Allowed")
@@ -14,7 +14,6 @@ from django.core.exceptions import MultipleObjectsReturned
 from django.db import IntegrityError, DataError
 from django.shortcuts import redirect, render
 from django.utils import timezone
-from silk.profiling.profiler import silk_profile
 
 from main.background_tasks import (
     check_browser,
@@ -22,10 +21,12 @@ from main.background_tasks import (
 from main.decorators import is_admin, is_authenticated
 from main.femr_admin_views import get_client_ip
 from main.forms import RegisterForm, LoginForm
+from main.instrumentation import instrument
 from main.models import AuditEntry, UserSession, fEMRUser
+from main.user_groups import in_group
 
 
-@silk_profile("register_post")
+@instrument("register_post")
 def __register_post(request):
     form = RegisterForm(request.POST)
     error = ""
@@ -66,7 +67,7 @@ def __register_post(request):
     return return_response
 
 
-@silk_profile("registration")
+@instrument("registration")
 def register(request):
     """
     Allows new user registration.
@@ -85,7 +86,7 @@ def register(request):
     return return_response
 
 
-@silk_profile("thank-you-for-registering")
+@instrument("thank-you-for-registering")
 def thank_you_for_registering(request):
     """
     Registration success return_response.
@@ -96,7 +97,7 @@ def thank_you_for_registering(request):
     return render(request, "auth/thank_you_for_registering.html")
 
 
-@silk_profile("all_locked")
+@instrument("all_locked")
 def all_locked(request):
     """
     Response for cases where a page requires an authenticated user with elevated privileges.
@@ -107,7 +108,7 @@ def all_locked(request):
     return render(request, "auth/all_locked.html")
 
 
-@silk_profile("not-logged-in")
+@instrument("not-logged-in")
 def not_logged_in(request):
     """
     Response for cases where a page requires an authenticated user with elevated privileges.
@@ -118,7 +119,7 @@ def not_logged_in(request):
     return render(request, "auth/not_logged_in.html")
 
 
-@silk_profile("please-register")
+@instrument("please-register")
 def please_register(request):
     """
     Response for cases where a page requires any general authenticated user.
@@ -129,7 +130,7 @@ def please_register(request):
     return render(request, "auth/please_register.html")
 
 
-@silk_profile("permission-denied")
+@instrument("permission-denied")
 def permission_denied(request):
     """
     Response on pages that require higher privileges than the requesting user holds.
@@ -140,7 +141,7 @@ def permission_denied(request):
     return render(request, "auth/permission_denied.html")
 
 
-@silk_profile("login-view-post-success")
+@instrument("login-view-post-success")
 def __login_view_post_success(request, user):
     login(request, user)
     if UserSession.objects.filter(user=request.user).exists():
@@ -158,7 +159,7 @@ def __login_view_post_success(request, user):
             },
         )
     elif user.campaigns.count() == 1 and not user.campaigns.first().active:
-        user_is_admin = request.user.groups.filter(name="fEMR Admin").exists()
+        user_is_admin = in_group(request.user, "fEMR Admin")
         if not user_is_admin:
             return_response = redirect("main:all_locked")
         else:
@@ -182,7 +183,7 @@ def __login_view_post_success(request, user):
     return return_response
 
 
-@silk_profile("login-view-post-failure")
+@instrument("login-view-post-failure")
 def __login_view_post_failure(request):
     ip_address = get_client_ip(request)
     AuditEntry.objects.create(
@@ -211,7 +212,7 @@ def __login_view_post_failure(request):
     )
 
 
-@silk_profile("--login-view-post")
+@instrument("--login-view-post")
 def __login_view_post(request):
     form = LoginForm(request.POST)
     if form.is_valid():
@@ -229,7 +230,7 @@ def __login_view_post(request):
     return return_response
 
 
-@silk_profile("login_view")
+@instrument("login_view")
 def login_view(request):
     """
     Handles authenticating existing users.
@@ -252,7 +253,7 @@ def login_view(request):
     return return_response
 
 
-@silk_profile("logout-view")
+@instrument("logout-view")
 def logout_view(request):
     """
     Handles logout.
@@ -272,7 +273,7 @@ def logout_view(request):
 
 
 @is_authenticated
-@silk_profile("change-password")
+@instrument("change-password")
 def change_password(request):
     """
     Handle requests to change passwords for the AUTH_USER model.
@@ -313,7 +314,7 @@ def change_password(request):
 
 
 @is_authenticated
-@silk_profile("required-change-password")
+@instrument("required-change-password")
 def required_change_password(request):
     """
     Handle requests to change passwords for the AUTH_USER model.
@@ -352,7 +353,7 @@ def required_change_password(request):
 
 @is_authenticated
 @is_admin
-@silk_profile("reset-lockouts")
+@instrument("reset-lockouts")
 def reset_lockouts(request, username=None):
     if username is not None:
         reset(username=username)
@@ -1,8 +1,9 @@
 from dal import autocomplete
-from silk.profiling.profiler import silk_profile
+
+from main.instrumentation import instrument
+from main.vocabulary import search_vocabulary
 
 from .models import (
-    Campaign,
     Ethnicity,
     InventoryCategory,
     InventoryEntry,
@@ -25,34 +26,18 @@ class DiagnosisAutocomplete(
         if not self.request.user.is_authenticated:
             return Diagnosis.objects.none()
 
-        autocomplete_queryset = Diagnosis.objects.all()
-
-        if self.q:
-            autocomplete_queryset = autocomplete_queryset.filter(text__icontains=self.q)
-
-        return autocomplete_queryset
+        return search_vocabulary(Diagnosis, self.q)
 
 
 class ChiefComplaintAutocomplete(
     autocomplete.Select2QuerySetView
 ):  # pylint: disable=too-many-ancestors
-    @silk_profile("chief-complaint-autocomplete")
+    @instrument("chief-complaint-autocomplete")
     def get_queryset(self):
         if not self.request.user.is_authenticated:
             return ChiefComplaint.objects.none()
 
-        autocomplete_queryset = (
-            ChiefComplaint.objects.filter(active=True).order_by("text").distinct("text")
-        )
-
-        if self.q:
-            autocomplete_queryset = (
-                autocomplete_queryset.filter(text__icontains=self.q)
-                .order_by("text")
-                .distinct("text")
-            )
-
-        return autocomplete_queryset
+        return search_vocabulary(ChiefComplaint, self.q)
 
 
 class MedicationAutocomplete(
@@ -62,12 +47,7 @@ class MedicationAutocomplete(
         if not self.request.user.is_authenticated:
             return Medication.objects.none()
 
-        autocomplete_queryset = Medication.objects.all()
-
-        if self.q:
-            autocomplete_queryset = autocomplete_queryset.filter(text__icontains=self.q)
-
-        return autocomplete_queryset
+        return search_vocabulary(Medication, self.q)
 
 
 class InventoryEntryAutocomplete(
@@ -80,7 +60,7 @@ class InventoryEntryAutocomplete(
         if not self.request.user.is_authenticated:
             return InventoryEntry.objects.none()
 
-        campaign = Campaign.objects.get(name=self.request.user.current_campaign)
+        campaign = self.request.campaign
         autocomplete_queryset = campaign.inventory.entries.all()
 
         if self.q:
@@ -98,12 +78,7 @@ class InventoryFormAutocomplete(
         if not self.request.user.is_authenticated:
             return InventoryForm.objects.none()
 
-        autocomplete_queryset = InventoryForm.objects.all()
-
-        if self.q:
-            autocomplete_queryset = autocomplete_queryset.filter(name__icontains=self.q)
-
-        return autocomplete_queryset
+        return search_vocabulary(InventoryForm, self.q)
 
 
 class InventoryCategoryAutocomplete(
@@ -113,12 +88,7 @@ class InventoryCategoryAutocomplete(
         if not self.request.user.is_authenticated:
             return InventoryCategory.objects.none()
 
-        autocomplete_queryset = InventoryCategory.objects.all()
-
-        if self.q:
-            autocomplete_queryset = autocomplete_queryset.filter(name__icontains=self.q)
-
-        return autocomplete_queryset
+        return search_vocabulary(InventoryCategory, self.q)
 
 
 class ManufacturerAutocomplete(
@@ -128,12 +98,7 @@ class ManufacturerAutocomplete(
         if not self.request.user.is_authenticated:
             return Manufacturer.objects.none()
 
-        autocomplete_queryset = Manufacturer.objects.all()
-
-        if self.q:
-            autocomplete_queryset = autocomplete_queryset.filter(name__icontains=self.q)
-
-        return autocomplete_queryset
+        return search_vocabulary(Manufacturer, self.q)
 
 
 class TestAutocomplete(
@@ -143,12 +108,7 @@ class TestAutocomplete(
         if not self.request.user.is_authenticated:
             return Test.objects.none()
 
-        autocomplete_queryset = Test.objects.all()
-
-        if self.q:
-            autocomplete_queryset = autocomplete_queryset.filter(text__icontains=self.q)
-
-        return autocomplete_queryset
+        return search_vocabulary(Test, self.q)
 
 
 class AdministrationScheduleAutocomplete(
@@ -158,12 +118,7 @@ class AdministrationScheduleAutocomplete(
         if not self.request.user.is_authenticated:
             return AdministrationSchedule.objects.none()
 
-        autocomplete_queryset = AdministrationSchedule.objects.all()
-
-        if self.q:
-            autocomplete_queryset = autocomplete_queryset.filter(text__icontains=self.q)
-
-        return autocomplete_queryset
+        return search_vocabulary(AdministrationSchedule, self.q)
 
 
 class RaceAutocomplete(
@@ -173,12 +128,7 @@ class RaceAutocomplete(
         if not self.request.user.is_authenticated:
             return Race.objects.none()
 
-        autocomplete_queryset = Race.objects.all()
-
-        if self.q:
-            autocomplete_queryset = autocomplete_queryset.filter(name__icontains=self.q)
-
-        return autocomplete_queryset
+        return search_vocabulary(Race, self.q)
 
 
 class EthnicityAutocomplete(
@@ -188,12 +138,7 @@ class EthnicityAutocomplete(
         if not self.request.user.is_authenticated:
             return Ethnicity.objects.none()
 
-        autocomplete_queryset = Ethnicity.objects.all()
-
-        if self.q:
-            autocomplete_queryset = autocomplete_queryset.filter(name__icontains=self.q)
-
-        return autocomplete_queryset
+        return search_vocabulary(Ethnicity, self.q)
 
 
 class StateAutocomplete(
@@ -203,9 +148,4 @@ class StateAutocomplete(
         if not self.request.user.is_authenticated:
             return State.objects.none()
 
-        autocomplete_queryset = State.objects.all()
-
-        if self.q:
-            autocomplete_queryset = autocomplete_queryset.filter(name__icontains=self.q)
-
-        return autocomplete_queryset
+        return search_vocabulary(State, self.q)
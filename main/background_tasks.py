@@ -2,16 +2,16 @@
 Non-view functions used to carry out background processes.
 """
 import os
-from datetime import timedelta, datetime
+from datetime import timedelta
 from celery import shared_task
 
 from django.db.models.query_utils import Q
 from django.utils import timezone
 from django.core.mail import send_mail
 
-from silk.profiling.profiler import silk_profile
 from model_bakery import baker
 
+from main.instrumentation import instrument
 from main.models import (
     CSVExport,
     Campaign,
@@ -21,10 +21,11 @@ from main.models import (
     cal_key,
     fEMRUser,
 )
+from main.user_groups import user_group_names
 
 
 @shared_task
-@silk_profile("run-encounter-close")
+@instrument("run-encounter-close")
 def run_encounter_close():
     """
     When triggered, this function will search for expired PatientEncounter
@@ -46,7 +47,7 @@ def run_encounter_close():
 
 
 @shared_task
-@silk_profile("run-user-deactivate")
+@instrument("run-user-deactivate")
 def run_user_deactivate(now=timezone.now()):
     """
     Mark any users who haven't logged in in a month as inactive,
@@ -72,7 +73,7 @@ def run_user_deactivate(now=timezone.now()):
 
 
 @shared_task
-@silk_profile("reset-sessions")
+@instrument("reset-sessions")
 def reset_sessions() -> None:
     """
     Empty out sessions older than 1 minute.
@@ -84,7 +85,7 @@ def reset_sessions() -> None:
         session.delete()
 
 
-@silk_profile("check-browser")
+@instrument("check-browser")
 def check_browser(request) -> bool:
     if request.user_agent.browser.family not in [
         "Chrome",
@@ -99,7 +100,7 @@ def check_browser(request) -> bool:
     return retval
 
 
-@silk_profile("check-admin-permission")
+@instrument("check-admin-permission")
 def check_admin_permission(user):
     """
     Given a user, check whether that user is a member of an
@@ -116,12 +117,11 @@ def check_admin_permission(user):
         "Organization Admin",
         "Operation Admin",
     }
-    user_groups = {group.name for group in user.groups.all().iterator()}
-    return admin_groups.intersection(user_groups)
+    return admin_groups.intersection(user_group_names(user))
 
 
 @shared_task
-@silk_profile("assign-broken-patients")
+@instrument("assign-broken-patients")
 def assign_broken_patient():
     """
     Skim the database for patients with a campaign_key of
@@ -135,7 +135,7 @@ def assign_broken_patient():
 
 
 @shared_task
-@silk_profile("delete-old-export")
+@instrument("delete-old-export")
 def delete_old_export():
     now = timezone.now()
     delta = now - timedelta(weeks=2)
@@ -144,22 +144,7 @@ def delete_old_export():
 
 
 @shared_task
-@silk_profile("assign_new_timestamp")
-def assign_new_timestamp():
-    now = timezone.make_aware(datetime.today(), timezone.get_default_timezone())
-    now = now.astimezone(timezone.get_current_timezone())
-    for patient in Patient.objects.filter(
-        (Q(patientencounter__timestamp__date=now) | Q(timestamp__date=now))
-    ).order_by("-timestamp"):
-        if patient.patientencounter_set.count() > 0:
-            patient.timestamp = (
-                patient.patientencounter_set.all().order_by("-timestamp")[0].timestamp
-            )
-            patient.save()
-
-
-@shared_task
-@silk_profile("stress-test")
+@instrument("stress-test")
 def start_stress_test(campaign_name):
     campaign = Campaign.objects.get_or_create(name=campaign_name)[0]
     for _ in range(1000):
@@ -169,4 +154,4 @@ def start_stress_test(campaign_name):
             encounter = baker.make("main.PatientEncounter")
             encounter.patient = patient
             encounter.campaign = campaign
-            encounter.save()
\ No newline at end of file
+            encounter.save()
@@ -0,0 +1,57 @@
+"""
+The names of each user's active campaigns, cached on their session so that
+campaign validation doesn't query for them on every request.
+"""
+from uuid import uuid4
+
+from django.core.cache import cache
+
+CAMPAIGN_ACCESS_VERSION_KEY = "campaign-access-version"
+
+
+def campaign_access_version():
+    """
+    The current version of everyone's campaign access, or None if the cache
+    can't be reached, in which case nothing should be served from a session.
+    """
+    version = cache.get(CAMPAIGN_ACCESS_VERSION_KEY)
+    if version is None:
+        cache.add(CAMPAIGN_ACCESS_VERSION_KEY, uuid4().hex, None)
+        version = cache.get(CAMPAIGN_ACCESS_VERSION_KEY)
+    return version
+
+
+def invalidate_campaign_access():
+    """
+    Make every session fetch its active campaigns again, after a campaign or
+    a user's campaigns change.
+    """
+    cache.set(CAMPAIGN_ACCESS_VERSION_KEY, uuid4().hex, None)
+
+
+def active_campaign_names(request):
+    """
+    The names of the user's active campaigns, oldest first, fetched in one
+    query and then kept on the session until campaign access changes.
+    """
+    version = campaign_access_version()
+    cached = request.session.get("active_campaigns")
+    if (
+        version is not None
+        and cached is not None
+        and cached["version"] == version
+        and cached["user"] == request.user.pk
+    ):
+        return cached["names"]
+    names = list(
+        request.user.campaigns.filter(active=True)
+        .order_by("pk")
+        .values_list("name", flat=True)
+    )
+    if version is not None:
+        request.session["active_campaigns"] = {
+            "version": version,
+            "user": request.user.pk,
+            "names": names,
+        }
+    return names
@@ -0,0 +1,51 @@
+"""
+The timezone of each user's current campaign, cached on their session so that
+activating it doesn't need a query on every request.
+"""
+from functools import lru_cache
+
+import pytz
+
+from main.campaign_access import campaign_access_version
+from main.models import Campaign
+
+
+@lru_cache(maxsize=None)
+def get_timezone(tzname):
+    """
+    The tzinfo for tzname, built once per process.
+    """
+    return pytz.timezone(tzname)
+
+
+def campaign_timezone_name(request):
+    """
+    The name of the current campaign's timezone, or None if the user has no
+    campaign. It is looked up once and then kept on the session until the user
+    changes campaigns or a campaign is edited.
+    """
+    version = campaign_access_version()
+    campaign_name = request.user.current_campaign
+    cached = request.session.get("campaign_timezone")
+    if (
+        version is not None
+        and cached is not None
+        and cached["version"] == version
+        and cached["campaign"] == campaign_name
+    ):
+        return cached["tzname"]
+    try:
+        tzname = request.campaign.timezone
+    except Campaign.DoesNotExist:
+        tzname = None
+    if version is not None:
+        request.session["campaign_timezone"] = {
+            "version": version,
+            "campaign": campaign_name,
+            "tzname": tzname,
+        }
+    return tzname
+
+
+def forget_campaign_timezone(request):
+    request.session.pop("campaign_timezone", None)
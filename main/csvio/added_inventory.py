@@ -4,6 +4,7 @@ import io
 from django.core.exceptions import ValidationError
 
 from main.csvio import add_to_inventory
+from main.csvio.formulary_export import write_formulary
 
 
 class AddedInventoryHandler:
@@ -11,51 +12,7 @@ class AddedInventoryHandler:
         return self.__import(upload, campaign)
 
     def write(self, response, formulary):
-        return self.__export(response, formulary)
-
-    @staticmethod
-    def __export(response, formulary):
-        writer = csv.writer(response)
-        writer.writerow(
-            [
-                "Category",
-                "Medication",
-                "Form",
-                "Strength",
-                "Strength Unit",
-                "Count",
-                "Count Unit",
-                "Quantity",
-                "Amount",
-                "Quantity Unit",
-                "Initial Quantity",
-                "Item Number",
-                "Box Number",
-                "Expiration Date",
-                "Manufacturer",
-            ]
-        )
-        for item in formulary:
-            writer.writerow(
-                [
-                    item.category,
-                    item.medication,
-                    item.form,
-                    item.strength,
-                    item.strength_unit,
-                    item.count,
-                    item.count_unit,
-                    item.quantity,
-                    item.amount,
-                    item.quantity_unit,
-                    item.initial_quantity,
-                    item.item_number,
-                    item.box_number,
-                    item.expiration_date,
-                    item.manufacturer,
-                ]
-            )
-        return response
+        return write_formulary(response, formulary)
 
     @staticmethod
     def __import(csvfile, campaign):
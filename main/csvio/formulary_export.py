@@ -0,0 +1,126 @@
+"""
+This file handles exporting a campaign's formulary as CSV, for both the
+formulary download and the inventory handlers.
+"""
+import csv
+import time
+
+from django.core.cache import cache
+
+FORMULARY_CACHE_TIMEOUT = 60 * 60 * 24
+FORMULARY_CHUNK_SIZE = 500
+
+FORMULARY_TITLE_ROW = [
+    "Category",
+    "Medication",
+    "Form",
+    "Strength",
+    "Strength Unit",
+    "Count",
+    "Count Unit",
+    "Quantity",
+    "Amount",
+    "Quantity Unit",
+    "Initial Quantity",
+    "Item Number",
+    "Box Number",
+    "Expiration Date",
+    "Manufacturer",
+]
+
+
+class Echo:
+    """
+    A file-like object whose write hands back what it was given, so that
+    csv.writer can render rows one at a time for streaming.
+    """
+
+    def write(self, value):
+        return value
+
+
+def formulary_rows(formulary):
+    """
+    Yield the title row and then one row per entry, with every related
+    object fetched in the same query as its entry.
+    """
+    yield FORMULARY_TITLE_ROW
+    for item in formulary.select_related(
+        "category", "medication", "form", "manufacturer"
+    ).iterator(chunk_size=FORMULARY_CHUNK_SIZE):
+        yield [
+            item.category,
+            item.medication,
+            item.form,
+            item.strength,
+            item.strength_unit,
+            item.count,
+            item.count_unit,
+            item.quantity,
+            item.amount,
+            item.quantity_unit,
+            item.initial_quantity,
+            item.item_number,
+            item.box_number,
+            item.expiration_date,
+            item.manufacturer,
+        ]
+
+
+def write_formulary(response, formulary):
+    csv.writer(response).writerows(formulary_rows(formulary))
+    return response
+
+
+def formulary_version_key(inventory_id):
+    return f"formulary-export-version-{inventory_id}"
+
+
+def new_formulary_version():
+    """
+    A starting version for a counter that's missing from the cache, unlikely to
+    match one a formulary was cached under before the counter was evicted.
+    """
+    return int(time.time() * 1000)
+
+
+def formulary_cache_key(inventory_id):
+    """
+    Cache key for an inventory's rendered formulary. It carries a version
+    number, so a formulary rendered while an entry was being saved is cached
+    under a key that's already out of date.
+    """
+    key = formulary_version_key(inventory_id)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, new_formulary_version(), None)
+        version = cache.get(key)
+    return f"formulary-export-{inventory_id}-{version}"
+
+
+def invalidate_formulary(inventory_id):
+    key = formulary_version_key(inventory_id)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, new_formulary_version(), None)
+
+
+def formulary_csv(inventory):
+    """
+    Yield an inventory's formulary as CSV, line by line. The rendered CSV is
+    cached once it has been streamed in full, and served from the cache until
+    an entry of the inventory changes.
+    """
+    key = formulary_cache_key(inventory.pk)
+    rendered = cache.get(key)
+    if rendered is not None:
+        yield rendered
+        return
+    writer = csv.writer(Echo())
+    lines = []
+    for row in formulary_rows(inventory.entries.order_by("medication")):
+        line = writer.writerow(row)
+        lines.append(line)
+        yield line
+    cache.set(key, "".join(lines), FORMULARY_CACHE_TIMEOUT)
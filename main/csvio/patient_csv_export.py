@@ -1,39 +1,70 @@
 """
-This file contains a single function which handles exporting
-patient records as CSV files.
+This file handles exporting patient records as CSV files, and serving
+the finished exports back to the user.
 """
 import csv
-from io import StringIO
+import gzip
 import math
+import mimetypes
 import os
+import shutil
+import tempfile
 from datetime import datetime, timedelta
+from hashlib import sha256
+from io import TextIOWrapper
+from itertools import islice
 
-from celery import shared_task
-from silk.profiling.profiler import silk_profile
+from celery import chord, shared_task
 from pytz import timezone as pytz_timezone
 
-from django.http.response import HttpResponse
+from django.http.response import HttpResponse, StreamingHttpResponse
 from django.contrib import messages
 from django.shortcuts import redirect, render
-from django.core.files.base import ContentFile
-from django.core.paginator import Paginator
-from django.core.mail import send_mail
-from django.db.models import Q
+from django.core.cache import cache
+from django.core.files.base import File
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import Max, prefetch_related_objects
 from django.utils import timezone
-
-from clinic_messages.models import Message
+from django.utils.cache import patch_vary_headers
 
 from main.background_tasks import check_admin_permission
+from main.csvio.patient_export_data import (
+    EXPORT_CHUNK_SIZE,
+    export_encounter_prefetches,
+    export_encounter_queryset,
+    export_patient_data,
+    export_prefetches,
+    export_row_count,
+    iterate_export_patient_chunks,
+    last_export_timestamp,
+    notify_export_finished,
+)
+from main.csvio.patient_parquet_export import parquet_export_handler
+from main.csvio.unit_conversion import (
+    fahrenheit_temperatures,
+    imperial_heights,
+    imperial_weights,
+)
+from main.instrumentation import instrument
+from main.pagination import KeysetPaginator
 from main.models import (
     CSVExport,
     Campaign,
-    Patient,
     PatientEncounter,
     fEMRUser,
 )
 
+EXPORT_SHARD_SIZE = 2000
+EXPORT_ROW_CACHE_TIMEOUT = 60 * 60 * 24 * 14
+EXPORT_COMPRESSION_LEVEL = 6
+EXPORT_DOWNLOAD_CHUNK_SIZE = 64 * 1024
+EXPORT_STALLED_AFTER = timedelta(minutes=15)
+# How long a queued shard task may wait for a worker before it's taken to be
+# lost and queued again.
+EXPORT_LOST_AFTER = timedelta(hours=24)
+
 
-@silk_profile("calc-height")
 def calc_height(encounter: PatientEncounter) -> str:
     primary = math.floor(
         round(
@@ -76,54 +107,40 @@ def calc_height(encounter: PatientEncounter) -> str:
     return f"{primary}' {secondary}\""
 
 
-@silk_profile("dict-builder")
-def dict_builder(patient_data, vitals_dict, treatments_dict, hpis_dict):
-    max_treatments = 0
-    max_hpis = 0
-    max_vitals = 0
-    for patient in patient_data:
-        for encounter in patient.patientencounter_set.all():
-            vitals = encounter.vitals_set.all()
-            vitals_count = vitals.count()
-            treatments = encounter.treatment_set.all()
-            treatments_count = treatments.count()
-            hpis = encounter.historyofpresentillness_set.all()
-            hpis_count = hpis.count()
-
-            vitals_dict[encounter] = (vitals, vitals_count)
-            treatments_dict[encounter] = (treatments, treatments_count)
-            hpis_dict[encounter] = (hpis, hpis_count)
-
-            max_treatments = max(treatments_count, max_treatments)
-            max_hpis = max(hpis_count, max_hpis)
-            max_vitals = max(vitals_count, max_vitals)
-    return max_treatments, max_hpis, max_vitals
-
-
-@silk_profile("extend-vitals-list")
-def extend_vitals_list(campaign, vitals, row, max_vitals):
-    for vital in vitals[0]:
+@instrument("export-column-widths")
+def export_column_widths(patient_data):
+    """
+    Work out how many vitals, treatment and HPI column groups the export
+    needs, using the encounter Count annotations and a Max aggregate so that
+    the whole calculation happens in the database.
+
+    :return: (max_treatments, max_hpis, max_vitals)
+    """
+    widths = (
+        export_encounter_queryset()
+        .filter(patient__in=patient_data)
+        .aggregate(
+            max_treatments=Max("treatments_count"),
+            max_hpis=Max("hpis_count"),
+            max_vitals=Max("vitals_count"),
+        )
+    )
+    return (
+        widths["max_treatments"] or 0,
+        widths["max_hpis"] or 0,
+        widths["max_vitals"] or 0,
+    )
+
+
+def extend_vitals_list(vitals, temperatures, row, max_vitals):
+    for vital, temperature in zip(vitals[0], temperatures):
         row.extend(
             [
                 vital.systolic_blood_pressure,
                 vital.diastolic_blood_pressure,
                 vital.mean_arterial_pressure,
                 vital.heart_rate,
-                round(
-                    (
-                        (
-                            vital.body_temperature
-                            if vital.body_temperature is not None
-                            else 0
-                        )
-                        * 9
-                        / 5
-                    )
-                    + 32,
-                    2,
-                )
-                if campaign.units == "i"
-                else vital.body_temperature,
+                temperature,
                 vital.oxygen_concentration,
                 vital.glucose_level,
             ]
@@ -132,7 +149,6 @@ def extend_vitals_list(campaign, vitals, row, max_vitals):
         row.extend(["", "", "", "", "", "", ""] * (max_vitals - vitals[1]))
 
 
-@silk_profile("extend-treatments-list")
 def extend_treatments_list(row, treatments, max_treatments):
     for item in treatments[0]:
         row.extend(
@@ -148,7 +164,6 @@ def extend_treatments_list(row, treatments, max_treatments):
         row.extend(["", "", "", "", ""] * (max_treatments - treatments[1]))
 
 
-@silk_profile("extend-hpis-list")
 def extend_hpis_list(row, hpis, max_hpis):
     for item in hpis[0]:
         row.extend(
@@ -170,7 +185,7 @@ def extend_hpis_list(row, hpis, max_hpis):
         row.extend(["", "", "", "", "", "", "", "", "", "", ""] * (max_hpis - hpis[1]))
 
 
-@silk_profile("build-title-row")
+@instrument("build-title-row")
 def build_title_row(campaign, title_row, max_vitals, max_treatments, max_hpis):
     for _ in range(max_vitals):
         title_row.extend(
@@ -214,112 +229,236 @@ def build_title_row(campaign, title_row, max_vitals, max_treatments, max_hpis):
         )
 
 
-@silk_profile("write-result-file")
-def write_result_file(writer, title_row, patient_rows):
-    writer.writerow(title_row)
+@instrument("write-result-file")
+def write_result_file(
+    writer, title_row, patient_rows, chunk_size=EXPORT_CHUNK_SIZE, progress=None
+):
+    """
+    Write the title row followed by every patient row, handing rows to the
+    writer in chunks so that patient_rows may be a generator of any length.
+    A title_row of None writes the patient rows alone. If given, progress is
+    called with the number of rows in each chunk once it has been written.
+    """
+    if title_row is not None:
+        writer.writerow(title_row)
+    chunk = []
     for row in patient_rows:
-        writer.writerow(row)
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            writer.writerows(chunk)
+            if progress is not None:
+                progress(len(chunk))
+            chunk = []
+    if chunk:
+        writer.writerows(chunk)
+        if progress is not None:
+            progress(len(chunk))
+
+
+def encounter_cache_key(campaign, patient, encounter, campaign_time_zone_b):
+    """
+    Cache key for an encounter's rendered cells. It changes whenever the
+    encounter, its patient or any of its vitals, treatments or HPIs are
+    saved, added or removed, or when the campaign's units or timezone do.
+    Changing a treatment's medications moves its timestamp too, see
+    main.signals.touch_changed_treatments.
+    """
+    version = "|".join(
+        str(value)
+        for value in (
+            campaign.units,
+            campaign.timezone,
+            campaign_time_zone_b,
+            patient.timestamp,
+            encounter.timestamp,
+            encounter.vitals_count,
+            encounter.vitals_updated,
+            encounter.treatments_count,
+            encounter.treatments_updated,
+            encounter.hpis_count,
+            encounter.hpis_updated,
+        )
+    )
+    return f"export-row-{encounter.pk}-{sha256(version.encode()).hexdigest()}"
+
+
+def encounter_measurements(campaign, encounters):
+    """
+    Height, weight and vitals temperatures for each encounter, in the
+    campaign's units. Imperial campaigns have the whole chunk converted in
+    one vectorized pass.
+
+    :return: A dict of encounter id to (height, weight, temperatures).
+    """
+    vitals = [encounter.vitals_set.all() for encounter in encounters]
+    temperatures = [vital.body_temperature for group in vitals for vital in group]
+    if campaign.units == "i":
+        heights = imperial_heights(
+            [encounter.body_height_primary for encounter in encounters],
+            [encounter.body_height_secondary for encounter in encounters],
+        )
+        weights = imperial_weights([encounter.body_weight for encounter in encounters])
+        temperatures = fahrenheit_temperatures(temperatures)
+    else:
+        heights = [
+            f"{encounter.body_height_primary} m {encounter.body_height_secondary} cm"
+            for encounter in encounters
+        ]
+        weights = [encounter.body_weight for encounter in encounters]
+    temperatures = iter(temperatures)
+    return {
+        encounter.pk: (height, weight, list(islice(temperatures, len(group))))
+        for encounter, height, weight, group in zip(
+            encounters, heights, weights, vitals
+        )
+    }
 
 
-def patient_processing_loop(
-    patient_data,
-    patient_rows,
-    campaign,
-    vitals_dict,
-    max_vitals,
-    treatments_dict,
-    max_treatments,
-    hpis_dict,
-    max_hpis,
+def render_encounter_cells(
+    patient, encounter, measurements, campaign_time_zone, campaign_time_zone_b
 ):
-    campaign_time_zone = pytz_timezone(campaign.timezone)
-    campaign_time_zone_b = datetime.now(tz=campaign_time_zone).strftime("%Z%z")
-    export_id = 1
-    for patient in patient_data:
-        for encounter in patient.patientencounter_set.all():
-            row = [
-                export_id,
-                patient.sex_assigned_at_birth,
-                patient.age,
-                patient.city,
-                # pylint: disable=C0301
-                f"{encounter.timestamp.astimezone(campaign_time_zone)} {campaign_time_zone_b}",
-                calc_height(encounter)
-                if campaign.units == "i"
-                else f"{encounter.body_height_primary} m {encounter.body_height_secondary} cm",
-                round(
-                    (encounter.body_weight if encounter.body_weight is not None else 0)
-                    * 2.2046,
-                    2,
-                )
-                if campaign.units == "i"
-                else encounter.body_weight,
-                encounter.body_mass_index,
-                encounter.smoking,
-                encounter.history_of_diabetes,
-                encounter.history_of_hypertension,
-                encounter.history_of_high_cholesterol,
-                encounter.alcohol,
-                encounter.community_health_worker_notes,
-                encounter.procedure,
-                encounter.pharmacy_notes,
-                encounter.medical_history,
-                encounter.social_history,
-                encounter.current_medications,
-                encounter.family_history,
-            ]
-            extend_vitals_list(campaign, vitals_dict[encounter], row, max_vitals)
-            extend_treatments_list(row, treatments_dict[encounter], max_treatments)
-            extend_hpis_list(row, hpis_dict[encounter], max_hpis)
-            patient_rows.append(row)
-        export_id += 1
-    return len(patient_rows)
+    """
+    Render an encounter as four unpadded groups of cells: the encounter
+    itself, then its vitals, treatments and HPIs. Every cell is already a
+    string, so the result can be cached and padded to any column width.
+    """
+    height, weight, temperatures = measurements
+    encounter_cells = [
+        patient.sex_assigned_at_birth,
+        patient.age,
+        patient.city,
+        # pylint: disable=C0301
+        f"{encounter.timestamp.astimezone(campaign_time_zone)} {campaign_time_zone_b}",
+        height,
+        weight,
+        encounter.body_mass_index,
+        encounter.smoking,
+        encounter.history_of_diabetes,
+        encounter.history_of_hypertension,
+        encounter.history_of_high_cholesterol,
+        encounter.alcohol,
+        encounter.community_health_worker_notes,
+        encounter.procedure,
+        encounter.pharmacy_notes,
+        encounter.medical_history,
+        encounter.social_history,
+        encounter.current_medications,
+        encounter.family_history,
+    ]
+    vitals_cells = []
+    extend_vitals_list(
+        (encounter.vitals_set.all(), encounter.vitals_count),
+        temperatures,
+        vitals_cells,
+        0,
+    )
+    treatments_cells = []
+    extend_treatments_list(
+        treatments_cells,
+        (encounter.treatment_set.all(), encounter.treatments_count),
+        0,
+    )
+    hpis_cells = []
+    extend_hpis_list(
+        hpis_cells,
+        (encounter.historyofpresentillness_set.all(), encounter.hpis_count),
+        0,
+    )
+    return [
+        ["" if cell is None else str(cell) for cell in cells]
+        for cells in (encounter_cells, vitals_cells, treatments_cells, hpis_cells)
+    ]
 
 
-@silk_profile("--filter-patients-by-week")
-def __filter_patients_by_week(campaign):
-    timestamp_from = timezone.now() - timedelta(days=7)
-    timestamp_to = timezone.now()
-    return Patient.objects.filter(
-        Q(campaign=campaign)
-        & (
-            Q(
-                patientencounter__timestamp__gte=timestamp_from,
-                patientencounter__timestamp__lt=timestamp_to,
-            )
-            | Q(
-                timestamp__gte=timestamp_from,
-                timestamp__lt=timestamp_to,
+@instrument("cached-encounter-cells")
+def cached_encounter_cells(
+    campaign, patients, campaign_time_zone, campaign_time_zone_b
+):
+    """
+    Rendered cells for every encounter of a chunk of patients, keyed by
+    encounter id. Encounters whose cached cells are still current are taken
+    from the cache; only the rest have their vitals, treatments and HPIs
+    fetched and are rendered again.
+    """
+    encounters = {}
+    for patient in patients:
+        for encounter in patient.patientencounter_set.all():
+            key = encounter_cache_key(
+                campaign, patient, encounter, campaign_time_zone_b
             )
+            encounters[key] = (patient, encounter)
+    cells = cache.get_many(list(encounters))
+    stale = [key for key in encounters if key not in cells]
+    stale_encounters = [encounters[key][1] for key in stale]
+    prefetch_related_objects(stale_encounters, *export_encounter_prefetches())
+    measurements = encounter_measurements(campaign, stale_encounters)
+    rendered = {
+        key: render_encounter_cells(
+            *encounters[key],
+            measurements[encounters[key][1].pk],
+            campaign_time_zone,
+            campaign_time_zone_b,
         )
-    ).distinct()
+        for key in stale
+    }
+    cache.set_many(rendered, EXPORT_ROW_CACHE_TIMEOUT)
+    cells.update(rendered)
+    return {encounter.pk: cells[key] for key, (_, encounter) in encounters.items()}
 
 
-@silk_profile("--filter-patients-by-month")
-def __filter_patients_by_month(campaign):
-    timestamp_from = timezone.now() - timedelta(days=30)
-    timestamp_to = timezone.now()
-    return Patient.objects.filter(
-        Q(campaign=campaign)
-        & (
-            Q(
-                patientencounter__timestamp__gte=timestamp_from,
-                patientencounter__timestamp__lt=timestamp_to,
-            )
-            | Q(
-                timestamp__gte=timestamp_from,
-                timestamp__lt=timestamp_to,
-            )
+def generate_patient_rows(
+    patient_data, campaign, max_vitals, max_treatments, max_hpis, export_id=1
+):
+    """
+    Yield one export row per encounter in a single forward pass over the
+    patients, so callers never need to hold the full set of rows in memory.
+    Patients are numbered from export_id onwards.
+    """
+    campaign_time_zone = pytz_timezone(campaign.timezone)
+    campaign_time_zone_b = datetime.now(tz=campaign_time_zone).strftime("%Z%z")
+    group_widths = (7 * max_vitals, 5 * max_treatments, 11 * max_hpis)
+    for patients in iterate_export_patient_chunks(patient_data, export_prefetches()):
+        cells = cached_encounter_cells(
+            campaign, patients, campaign_time_zone, campaign_time_zone_b
         )
-    ).distinct()
+        for patient in patients:
+            for encounter in patient.patientencounter_set.all():
+                encounter_cells, *group_cells = cells[encounter.pk]
+                row = [export_id, *encounter_cells]
+                for group, width in zip(group_cells, group_widths):
+                    # Vitals, treatments or HPIs added since the widths were
+                    # worked out are left off rather than overrunning the title.
+                    group = group[:width]
+                    row.extend(group)
+                    row.extend([""] * (width - len(group)))
+                yield row
+            export_id += 1
 
 
-@shared_task
-@silk_profile("csv-export-handler")
-def csv_export_handler(user_id, campaign_id, timeframe):
-    campaign = Campaign.objects.get(pk=campaign_id)
-    export_file = StringIO()
-    writer = csv.writer(export_file)
+def patient_processing_loop(
+    patient_data, patient_rows, campaign, max_vitals, max_treatments, max_hpis
+):
+    patient_rows.extend(
+        generate_patient_rows(
+            patient_data, campaign, max_vitals, max_treatments, max_hpis
+        )
+    )
+    return len(patient_rows)
+
+
+def write_rows_to_file(export_file, title_row, patient_rows, progress=None):
+    """
+    Write CSV rows as UTF-8 into a binary file handle, leaving the handle
+    open and positioned at the end of what was written.
+    """
+    text_file = TextIOWrapper(export_file, encoding="utf-8", newline="")
+    writer = csv.writer(text_file)
+    write_result_file(writer, title_row, patient_rows, progress=progress)
+    text_file.flush()
+    text_file.detach()
+
+
+def export_title_row(campaign, max_vitals, max_treatments, max_hpis):
     title_row = [
         "Patient",
         "Sex Assigned at Birth",
@@ -342,67 +481,356 @@ def csv_export_handler(user_id, campaign_id, timeframe):
         "Current Medications",
         "Family History",
     ]
-    if timeframe == 2:
-        patient_data = __filter_patients_by_week(campaign)
-    elif timeframe == 3:
-        patient_data = __filter_patients_by_month(campaign)
-    else:
-        patient_data = Patient.objects.filter(campaign=campaign)
-    patient_rows = []
-    vitals_dict = {}
-    treatments_dict = {}
-    hpis_dict = {}
-    max_treatments, max_hpis, max_vitals = dict_builder(
-        patient_data, vitals_dict, treatments_dict, hpis_dict
+    build_title_row(campaign, title_row, max_vitals, max_treatments, max_hpis)
+    return title_row
+
+
+def export_filename(campaign):
+    return f"patient-export-{campaign.name}-{datetime.now()}.csv.gz"
+
+
+@instrument("shard-boundaries")
+def shard_boundaries(patient_data, shard_size=EXPORT_SHARD_SIZE):
+    """
+    Split patient_data into consecutive primary key ranges of shard_size
+    patients each.
+
+    :return: A list of (first_pk, last_pk) pairs, in order.
+    """
+    boundaries = []
+    first_pk = last_pk = None
+    patient_ids = patient_data.order_by("pk").values_list("pk", flat=True)
+    for index, patient_id in enumerate(patient_ids.iterator()):
+        if index % shard_size == 0 and first_pk is not None:
+            boundaries.append((first_pk, last_pk))
+            first_pk = None
+        if first_pk is None:
+            first_pk = patient_id
+        last_pk = patient_id
+    if first_pk is not None:
+        boundaries.append((first_pk, last_pk))
+    return boundaries
+
+
+def export_checkpoints(campaign, timeframe, timestamp_from, shard_size):
+    """
+    Everything a sharded export needs to render, or resume rendering, the
+    same rows from the same patients: its format, the timeframe and its
+    cutoffs, the column widths and title row, and the primary key range of
+    each shard.
+    Each shard also tracks when it was queued, the lease of the worker
+    rendering it, how many of its rows are written and, once it is done,
+    the storage name of its file.
+    """
+    timestamp_to = timezone.now()
+    patient_data = export_patient_data(
+        campaign, timeframe, timestamp_to, timestamp_from
+    )
+    widths = export_column_widths(patient_data)
+    max_treatments, max_hpis, max_vitals = widths
+    return patient_data, {
+        "format": "csv",
+        "timeframe": timeframe,
+        "timestamp_to": timestamp_to.isoformat(),
+        "timestamp_from": timestamp_from.isoformat()
+        if timestamp_from is not None
+        else None,
+        "widths": list(widths),
+        "title_row": export_title_row(campaign, max_vitals, max_treatments, max_hpis),
+        "shards": [
+            {
+                "first_pk": first_pk,
+                "last_pk": last_pk,
+                "export_id": index * shard_size + 1,
+                "rows": 0,
+                "file": None,
+                "dispatched_at": None,
+                "leased_at": None,
+            }
+            for index, (first_pk, last_pk) in enumerate(
+                shard_boundaries(patient_data, shard_size)
+            )
+        ],
+    }
+
+
+def lease_expired(leased_at, now):
+    """
+    Whether a lease taken at leased_at, an ISO timestamp or None, has lapsed.
+    Leases are renewed at every progress checkpoint, so one only lapses
+    when its worker has stopped making progress.
+    """
+    return (
+        leased_at is None
+        or now - datetime.fromisoformat(leased_at) >= EXPORT_STALLED_AFTER
+    )
+
+
+def shard_is_queued(shard, now):
+    """
+    Whether shard's task has been queued and not yet picked up by a worker.
+    """
+    dispatched_at = shard.get("dispatched_at")
+    return (
+        dispatched_at is not None
+        and shard.get("leased_at") is None
+        and now - datetime.fromisoformat(dispatched_at) < EXPORT_LOST_AFTER
     )
-    patient_processing_loop(
+
+
+def record_shard_progress(export_pk, index, rows, shard_name=None):
+    """
+    Checkpoint how many rows shard index has written, and its file once it
+    is finished, renewing the shard's lease and recomputing the export's
+    overall progress from its shards. The row is locked so that shards
+    finishing together don't overwrite each other's checkpoints.
+    """
+    with transaction.atomic():
+        export = CSVExport.objects.select_for_update().get(pk=export_pk)
+        shard = export.checkpoints["shards"][index]
+        shard["rows"] = rows
+        shard["leased_at"] = timezone.now().isoformat()
+        if shard_name is not None:
+            shard["file"] = shard_name
+        export.rows_done = sum(shard["rows"] for shard in export.checkpoints["shards"])
+        export.save(update_fields=["checkpoints", "rows_done", "timestamp"])
+
+
+def shard_is_finished(shard):
+    return shard["file"] is not None and default_storage.exists(shard["file"])
+
+
+def claim_export_shard(export_pk, index):
+    """
+    Lease shard index to the calling worker, starting its progress again,
+    unless the shard is finished or another worker holds a live lease on it.
+
+    :return: The export, or None if the shard wasn't claimed.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        export = (
+            CSVExport.objects.select_for_update()
+            .select_related("campaign")
+            .get(pk=export_pk)
+        )
+        shard = export.checkpoints["shards"][index]
+        if shard_is_finished(shard) or not lease_expired(shard.get("leased_at"), now):
+            return None
+        shard["rows"] = 0
+        shard["leased_at"] = now.isoformat()
+        export.rows_done = sum(shard["rows"] for shard in export.checkpoints["shards"])
+        export.save(update_fields=["checkpoints", "rows_done", "timestamp"])
+    return export
+
+
+@shared_task(acks_late=True, reject_on_worker_lost=True)
+@instrument("csv-export-shard")
+def csv_export_shard(export_pk, index):
+    """
+    Render the rows for one primary key range of an export into a shard file
+    in storage. A shard that's already finished, or being rendered by
+    another worker, is left alone, so a redelivered or resumed task only
+    redoes unfinished work.
+
+    :return: The storage name of the shard file, or None if another worker
+             is rendering it.
+    """
+    export = claim_export_shard(export_pk, index)
+    if export is None:
+        return CSVExport.objects.get(pk=export_pk).checkpoints["shards"][index]["file"]
+    state = export.checkpoints
+    shard = state["shards"][index]
+    patient_data = export_patient_data(
+        export.campaign,
+        state["timeframe"],
+        datetime.fromisoformat(state["timestamp_to"]),
+        datetime.fromisoformat(state["timestamp_from"])
+        if state["timestamp_from"] is not None
+        else None,
+    ).filter(pk__gte=shard["first_pk"], pk__lte=shard["last_pk"])
+    max_treatments, max_hpis, max_vitals = state["widths"]
+    patient_rows = generate_patient_rows(
         patient_data,
-        patient_rows,
-        campaign,
-        vitals_dict,
+        export.campaign,
         max_vitals,
-        treatments_dict,
         max_treatments,
-        hpis_dict,
         max_hpis,
+        export_id=shard["export_id"],
     )
-    build_title_row(campaign, title_row, max_vitals, max_treatments, max_hpis)
-    write_result_file(writer, title_row, patient_rows)
+    rows_written = 0
+
+    def progress(rows):
+        nonlocal rows_written
+        rows_written += rows
+        record_shard_progress(export_pk, index, rows_written)
+
+    with tempfile.TemporaryFile() as shard_file:
+        write_rows_to_file(shard_file, None, patient_rows, progress)
+        shard_file.seek(0)
+        shard_name = default_storage.save(
+            f"export/shards/{export_pk}-{shard['first_pk']}-{shard['last_pk']}.csv",
+            File(shard_file),
+        )
+    record_shard_progress(export_pk, index, rows_written, shard_name)
+    return shard_name
+
+
+def claim_export_merge(export_pk):
+    """
+    Lease the merge of an export to the calling worker, once every shard is
+    finished, unless the export is already merged or another worker holds a
+    live lease on merging it.
+
+    :return: The export, or None if the merge wasn't claimed.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        export = (
+            CSVExport.objects.select_for_update()
+            .select_related("campaign", "user")
+            .get(pk=export_pk)
+        )
+        if (
+            export.finished
+            or not lease_expired(export.checkpoints.get("merge_leased_at"), now)
+            or not all(
+                shard_is_finished(shard) for shard in export.checkpoints["shards"]
+            )
+        ):
+            return None
+        export.checkpoints["merge_leased_at"] = now.isoformat()
+        export.save(update_fields=["checkpoints", "timestamp"])
+    return export
+
+
+@shared_task(acks_late=True, reject_on_worker_lost=True)
+@instrument("merge-csv-export-shards")
+def merge_csv_export_shards(export_pk):
+    """
+    Concatenate the checkpointed shard files, in order, under a single title
+    row and save the gzip-compressed result as the user's export. Shard files
+    are only removed once the export itself has been saved. Nothing is done
+    until every shard is finished, nor once the export has been merged, so
+    however many chords an export was dispatched in, it's merged once.
+    """
+    export = claim_export_merge(export_pk)
+    if export is None:
+        return
+    shard_names = [shard["file"] for shard in export.checkpoints["shards"]]
+    with tempfile.TemporaryFile() as export_file:
+        with gzip.GzipFile(
+            fileobj=export_file, mode="wb", compresslevel=EXPORT_COMPRESSION_LEVEL
+        ) as compressed_file:
+            write_rows_to_file(compressed_file, export.checkpoints["title_row"], [])
+            for shard_name in shard_names:
+                with default_storage.open(shard_name, "rb") as shard_file:
+                    shutil.copyfileobj(shard_file, compressed_file)
+        export_file.seek(0)
+        export.file.save(
+            export_filename(export.campaign), File(export_file), save=False
+        )
+    export.rows_done = export.rows_total
+    export.finished = True
+    export.save()
+    for shard_name in shard_names:
+        default_storage.delete(shard_name)
+    notify_export_finished(export.user)
+
+
+def claim_export_dispatch(export_pk):
+    """
+    Mark every shard of the export that's neither finished, queued nor
+    being rendered as queued, under a lock so that overlapping dispatches
+    never queue the same shard twice.
+
+    :return: The indexes of the shards to queue, and whether every shard is
+             already finished.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        export = CSVExport.objects.select_for_update().get(pk=export_pk)
+        shards = export.checkpoints["shards"]
+        finished = [shard_is_finished(shard) for shard in shards]
+        claimed = [
+            index
+            for index, shard in enumerate(shards)
+            if not finished[index]
+            and not shard_is_queued(shard, now)
+            and lease_expired(shard.get("leased_at"), now)
+        ]
+        for index in claimed:
+            shards[index]["dispatched_at"] = now.isoformat()
+            shards[index]["leased_at"] = None
+        if claimed:
+            export.save(update_fields=["checkpoints", "timestamp"])
+    return claimed, all(finished)
+
+
+def dispatch_export_shards(export_pk):
+    """
+    Queue a task for every shard of the export that isn't finished, queued
+    or being rendered, with a chord merging the shard files once they all
+    have. If every shard is finished, only the merge is queued.
+    """
+    claimed, finished = claim_export_dispatch(export_pk)
+    merge = merge_csv_export_shards.si(export_pk)
+    if claimed:
+        chord([csv_export_shard.si(export_pk, index) for index in claimed])(merge)
+    elif finished:
+        merge.delay()
+
+
+@shared_task
+@instrument("sharded-csv-export-handler")
+def sharded_csv_export_handler(
+    user_id, campaign_id, timeframe, shard_size=EXPORT_SHARD_SIZE
+):
+    """
+    Split an export into primary key ranges of shard_size patients and
+    render each range as its own task, with a chord merging the shard files
+    once every range has finished. The export is recorded up front, along
+    with its checkpoints, so its progress can be shown while it runs.
+    """
+    campaign = Campaign.objects.get(pk=campaign_id)
     user = fEMRUser.objects.get(pk=user_id)
-    export = CSVExport()
-    export.file.save(
-        f"patient-export-{campaign.name}-{datetime.now()}.csv",
-        ContentFile(export_file.getvalue().encode("utf-8")),
+    patient_data, checkpoints = export_checkpoints(
+        campaign, timeframe, last_export_timestamp(user, campaign, "csv"), shard_size
     )
-    export.user = user
-    export.campaign = campaign
-    export.save()
-    message = Message.objects.create(
-        subject="CSV Export Finished",
-        content="""
-        This message is to let you know that the CSV export you began has finished. You can go back to the View Finished Exports page to download it.
-        """,
-        sender=fEMRUser.objects.get(username="admin"),
-        recipient=user,
+    export = CSVExport.objects.create(
+        user=user,
+        campaign=campaign,
+        rows_total=export_row_count(patient_data),
+        checkpoints=checkpoints,
     )
-    if os.environ.get("DEFAULT_FROM_EMAIL", None) is not None:
-        send_mail(
-            f"Message from {message.sender}",
-            # pylint: disable=C0301
-            f"{message.content}\n\n\nTHIS IS AN AUTOMATED MESSAGE. PLEASE DO NOT REPLY TO THIS EMAIL. PLEASE LOG IN TO REPLY.",
-            os.environ.get("DEFAULT_FROM_EMAIL"),
-            [message.recipient.email],
-        )
+    dispatch_export_shards(export.pk)
 
 
-@silk_profile("csv-export-list")
+@shared_task
+@instrument("resume-stalled-exports")
+def resume_stalled_exports():
+    """
+    Pick sharded exports whose progress hasn't moved for a while back up
+    from their last checkpoints. Only shards that are unfinished and whose
+    task is neither still queued nor still running are queued again.
+    """
+    stalled = CSVExport.objects.filter(
+        finished=False,
+        checkpoints__has_key="shards",
+        timestamp__lt=timezone.now() - EXPORT_STALLED_AFTER,
+    )
+    for export_pk in stalled.values_list("pk", flat=True).iterator():
+        dispatch_export_shards(export_pk)
+
+
+@instrument("csv-export-list")
 def csv_export_list(request):
     if request.user.is_authenticated:
         if check_admin_permission(request.user):
             exports = CSVExport.objects.filter(user=request.user).order_by("-id")
-            paginator = Paginator(exports, 10)
-            page_number = request.GET.get("page")
-            page_obj = paginator.get_page(page_number)
+            page_obj = KeysetPaginator(exports, 10).get_page(
+                request.GET.get("after"), request.GET.get("before")
+            )
             return_response = render(
                 request, "admin/export_list.html", {"exports": page_obj}
             )
@@ -413,17 +841,121 @@ def csv_export_list(request):
     return return_response
 
 
-@silk_profile("fetch-csv-export")
+def parse_byte_range(range_header, size):
+    """
+    Parse a single-range HTTP Range header against a file of the given size.
+
+    :return: An inclusive (first, last) byte pair, None if the header is
+             absent or not a single byte range, or False if the range
+             cannot be satisfied.
+    """
+    if not range_header or not range_header.startswith("bytes="):
+        return None
+    byte_range = range_header[len("bytes=") :]
+    if "," in byte_range or "-" not in byte_range:
+        return None
+    first, last = (value.strip() for value in byte_range.split("-", 1))
+    try:
+        if first == "":
+            first, last = max(size - int(last), 0), size - 1
+        else:
+            first = int(first)
+            last = min(int(last), size - 1) if last != "" else size - 1
+    except ValueError:
+        return None
+    if first > last or first >= size:
+        return False
+    return first, last
+
+
+def iterate_file(file_handle, length=None, chunk_size=EXPORT_DOWNLOAD_CHUNK_SIZE):
+    """
+    Read file_handle in chunks, stopping after length bytes if given, and
+    close it once the response has been sent.
+    """
+    try:
+        while length is None or length > 0:
+            chunk = file_handle.read(
+                chunk_size if length is None else min(chunk_size, length)
+            )
+            if not chunk:
+                break
+            if length is not None:
+                length -= len(chunk)
+            yield chunk
+    finally:
+        file_handle.close()
+
+
+def ranged_file_response(request, file_handle, size, content_type):
+    """
+    Stream file_handle back, honouring a single byte range if one was asked
+    for.
+    """
+    byte_range = parse_byte_range(request.META.get("HTTP_RANGE"), size)
+    if byte_range is False:
+        file_handle.close()
+        response = HttpResponse(status=416)
+        response["Content-Range"] = f"bytes */{size}"
+    elif byte_range is None:
+        response = StreamingHttpResponse(
+            iterate_file(file_handle), content_type=content_type
+        )
+        response["Content-Length"] = size
+    else:
+        first, last = byte_range
+        file_handle.seek(first)
+        response = StreamingHttpResponse(
+            iterate_file(file_handle, last - first + 1),
+            status=206,
+            content_type=content_type,
+        )
+        response["Content-Length"] = last - first + 1
+        response["Content-Range"] = f"bytes {first}-{last}/{size}"
+    response["Accept-Ranges"] = "bytes"
+    return response
+
+
+def export_file_response(request, export):
+    """
+    Stream an export back to the user. Compressed exports are sent as they
+    are stored, with a gzip Content-Encoding, to clients that accept it, and
+    decompressed on the fly for those that don't.
+    """
+    filename = os.path.basename(export.file.name)
+    compressed = filename.endswith(".gz")
+    if compressed:
+        filename = filename[: -len(".gz")]
+    content_type = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+    file_handle = export.file.open("rb")
+    if not compressed:
+        response = ranged_file_response(
+            request, file_handle, export.file.size, content_type
+        )
+    elif "gzip" in request.META.get("HTTP_ACCEPT_ENCODING", ""):
+        response = ranged_file_response(
+            request, file_handle, export.file.size, content_type
+        )
+        response["Content-Encoding"] = "gzip"
+    else:
+        response = StreamingHttpResponse(
+            iterate_file(gzip.GzipFile(fileobj=file_handle, mode="rb")),
+            content_type=content_type,
+        )
+    patch_vary_headers(response, ("Accept-Encoding",))
+    response["Content-Disposition"] = f'attachment; filename="{filename}"'
+    return response
+
+
+@instrument("fetch-csv-export")
 def fetch_csv_export(request, export_id=None):
     if request.user.is_authenticated:
         if check_admin_permission(request.user):
             export = CSVExport.objects.get(pk=export_id)
-            with open(export.file.url, "rb") as file_handle:
-                resp = HttpResponse(file_handle.read(), content_type="text/csv")
-                resp[
-                    "Content-Disposition"
-                ] = f'attachment; filename="{os.path.basename(export.file.path)}"'
-                return resp
+            if export.finished:
+                return_response = export_file_response(request, export)
+            else:
+                return_response = redirect("main:csv_export_list")
         else:
             return_response = redirect("main:permission_denied")
     else:
@@ -431,15 +963,20 @@ def fetch_csv_export(request, export_id=None):
     return return_response
 
 
-@silk_profile("run-patient-csv-export")
+@instrument("run-patient-csv-export")
 def run_patient_csv_export(request, timeframe=1):
     if request.user.is_authenticated:
         if check_admin_permission(request.user):
-            campaign = Campaign.objects.get(name=request.user.current_campaign)
-            csv_export_handler.delay(request.user.pk, campaign.id, timeframe)
+            campaign = request.campaign
+            if request.GET.get("format") == "parquet":
+                parquet_export_handler.delay(request.user.pk, campaign.id, timeframe)
+            else:
+                sharded_csv_export_handler.delay(
+                    request.user.pk, campaign.id, timeframe
+                )
             messages.info(
                 request,
-                "We're building your CSV - you'll receive a message once it's done. This may take up to 10 minutes.",
+                "We're building your export - you'll receive a message once it's done. This may take up to 10 minutes.",
             )
             return_response = render(
                 request, "admin/home.html", {"user": request.user, "page_name": "Admin"}
@@ -0,0 +1,233 @@
+"""
+The patients, encounters and encounter details an export covers, fetched a
+chunk at a time. Shared by the CSV and Parquet patient exports.
+"""
+import os
+from datetime import datetime, timedelta
+
+from django.core.mail import send_mail
+from django.db.models import Count, Exists, Max, OuterRef, Prefetch, Q
+from django.utils import timezone
+
+from clinic_messages.models import Message
+
+from main.instrumentation import instrument
+from main.models import (
+    CSVExport,
+    HistoryOfPresentIllness,
+    InventoryEntry,
+    Patient,
+    PatientEncounter,
+    Treatment,
+    Vitals,
+    fEMRUser,
+)
+
+EXPORT_CHUNK_SIZE = 500
+
+
+def export_encounter_queryset():
+    """
+    Encounters annotated with the number of vitals, treatments and HPIs
+    attached to them, so the export never has to ask for a count, and with
+    the latest change to each, which together version a cached row.
+    """
+    return PatientEncounter.objects.annotate(
+        vitals_count=Count("vitals", distinct=True),
+        treatments_count=Count("treatment", distinct=True),
+        hpis_count=Count("historyofpresentillness", distinct=True),
+        vitals_updated=Max("vitals__timestamp"),
+        treatments_updated=Max("treatment__timestamp"),
+        hpis_updated=Max("historyofpresentillness__timestamp"),
+    )
+
+
+def export_prefetches():
+    """
+    The annotated encounters for a whole chunk of patients, in one query.
+    """
+    return [Prefetch("patientencounter_set", queryset=export_encounter_queryset())]
+
+
+def export_encounter_prefetches():
+    """
+    Everything an encounter's row touches, fetched with one query per
+    relation for however many encounters need rendering.
+    """
+    return [
+        Prefetch("vitals_set"),
+        Prefetch(
+            "treatment_set",
+            queryset=Treatment.objects.select_related(
+                "diagnosis", "administration_schedule", "prescriber"
+            ).prefetch_related(
+                Prefetch(
+                    "medication",
+                    queryset=InventoryEntry.objects.select_related(
+                        "medication", "form"
+                    ),
+                )
+            ),
+        ),
+        Prefetch(
+            "historyofpresentillness_set",
+            queryset=HistoryOfPresentIllness.objects.select_related("chief_complaint"),
+        ),
+    ]
+
+
+def iterate_export_patient_chunks(
+    patient_data, prefetches, chunk_size=EXPORT_CHUNK_SIZE
+):
+    """
+    Walk patient_data in primary key order, one chunk at a time, applying
+    the given prefetches to each chunk. The number of queries depends on the
+    number of chunks rather than the number of patients, and only a single
+    chunk is held in memory at once.
+    """
+    last_id = 0
+    while True:
+        chunk = list(
+            patient_data.filter(pk__gt=last_id)
+            .order_by("pk")
+            .prefetch_related(*prefetches)[:chunk_size]
+        )
+        if chunk:
+            yield chunk
+        if len(chunk) < chunk_size:
+            break
+        last_id = chunk[-1].pk
+
+
+def export_row_count(patient_data):
+    """
+    How many rows the export will have, one per encounter, so progress can
+    be reported against it.
+    """
+    return PatientEncounter.objects.filter(patient__in=patient_data).count()
+
+
+@instrument("--filter-patients-by-week")
+def __filter_patients_by_week(campaign, timestamp_to=None):
+    timestamp_to = timestamp_to if timestamp_to is not None else timezone.now()
+    timestamp_from = timestamp_to - timedelta(days=7)
+    return Patient.objects.filter(
+        Q(campaign=campaign)
+        & (
+            Q(
+                patientencounter__timestamp__gte=timestamp_from,
+                patientencounter__timestamp__lt=timestamp_to,
+            )
+            | Q(
+                timestamp__gte=timestamp_from,
+                timestamp__lt=timestamp_to,
+            )
+        )
+    ).distinct()
+
+
+@instrument("--filter-patients-by-month")
+def __filter_patients_by_month(campaign, timestamp_to=None):
+    timestamp_to = timestamp_to if timestamp_to is not None else timezone.now()
+    timestamp_from = timestamp_to - timedelta(days=30)
+    return Patient.objects.filter(
+        Q(campaign=campaign)
+        & (
+            Q(
+                patientencounter__timestamp__gte=timestamp_from,
+                patientencounter__timestamp__lt=timestamp_to,
+            )
+            | Q(
+                timestamp__gte=timestamp_from,
+                timestamp__lt=timestamp_to,
+            )
+        )
+    ).distinct()
+
+
+@instrument("--filter-patients-changed-since")
+def __filter_patients_changed_since(campaign, timestamp_from):
+    """
+    The campaign's patients changed since timestamp_from, themselves or in
+    an encounter or its details. Each child table is checked with an EXISTS
+    subquery, so no patient is joined to all of its children and nothing
+    needs deduplicating.
+    """
+    patient_data = Patient.objects.filter(campaign=campaign)
+    if timestamp_from is not None:
+        changed_children = [
+            model.objects.filter(
+                **{lookup: OuterRef("pk")}, timestamp__gte=timestamp_from
+            )
+            for model, lookup in (
+                (PatientEncounter, "patient"),
+                (Vitals, "encounter__patient"),
+                (Treatment, "encounter__patient"),
+                (HistoryOfPresentIllness, "encounter__patient"),
+            )
+        ]
+        condition = Q(timestamp__gte=timestamp_from)
+        for children in changed_children:
+            condition |= Q(Exists(children))
+        patient_data = patient_data.filter(condition)
+    return patient_data
+
+
+def last_export_timestamp(user, campaign, export_format="csv"):
+    """
+    The cutoff the user's most recent export of this campaign in export_format
+    was taken at, or None if they have no such export on file. CSV and Parquet
+    exports are followed separately, so one format's export doesn't hold back
+    the other's changes. Anything changed while that export was still being
+    written falls after its cutoff, so it's picked up by the next one. Exports
+    made before cutoffs were recorded fall back to when they finished, and
+    those made before formats were recorded were CSV.
+    """
+    exports = CSVExport.objects.filter(user=user, campaign=campaign, finished=True)
+    if export_format == "csv":
+        exports = exports.filter(
+            Q(checkpoints__format="csv") | ~Q(checkpoints__has_key="format")
+        )
+    else:
+        exports = exports.filter(checkpoints__format=export_format)
+    last_export = exports.order_by("-timestamp").first()
+    if last_export is None:
+        return None
+    cutoff = last_export.checkpoints.get("timestamp_to")
+    return datetime.fromisoformat(cutoff) if cutoff else last_export.timestamp
+
+
+def export_patient_data(campaign, timeframe, timestamp_to=None, timestamp_from=None):
+    """
+    The patients covered by an export: everyone in the campaign, those seen
+    in the week (timeframe 2) or month (timeframe 3) up to timestamp_to, or
+    those with anything changed since timestamp_from (timeframe 4).
+    """
+    if timeframe == 2:
+        patient_data = __filter_patients_by_week(campaign, timestamp_to)
+    elif timeframe == 3:
+        patient_data = __filter_patients_by_month(campaign, timestamp_to)
+    elif timeframe == 4:
+        patient_data = __filter_patients_changed_since(campaign, timestamp_from)
+    else:
+        patient_data = Patient.objects.filter(campaign=campaign)
+    return patient_data
+
+
+def notify_export_finished(user):
+    message = Message.objects.create(
+        subject="CSV Export Finished",
+        content="""
+        This message is to let you know that the CSV export you began has finished. You can go back to the View Finished Exports page to download it.
+        """,
+        sender=fEMRUser.objects.get(username="admin"),
+        recipient=user,
+    )
+    if os.environ.get("DEFAULT_FROM_EMAIL", None) is not None:
+        send_mail(
+            f"Message from {message.sender}",
+            # pylint: disable=C0301
+            f"{message.content}\n\n\nTHIS IS AN AUTOMATED MESSAGE. PLEASE DO NOT REPLY TO THIS EMAIL. PLEASE LOG IN TO REPLY.",
+            os.environ.get("DEFAULT_FROM_EMAIL"),
+            [message.recipient.email],
+        )
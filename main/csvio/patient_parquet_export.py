@@ -0,0 +1,308 @@
+"""
+This file handles exporting patient records as a set of long-format Parquet
+tables - one each for encounters, vitals, treatments and HPIs - bundled into
+a single zip archive.
+"""
+import os
+import tempfile
+import zipfile
+from datetime import datetime
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+from celery import shared_task
+
+from django.core.files.base import File
+from django.db.models import F, prefetch_related_objects
+from django.utils import timezone
+
+from main.csvio.patient_export_data import (
+    export_encounter_prefetches,
+    export_patient_data,
+    export_prefetches,
+    export_row_count,
+    iterate_export_patient_chunks,
+    last_export_timestamp,
+    notify_export_finished,
+)
+from main.instrumentation import instrument
+from main.models import CSVExport, Campaign, fEMRUser
+
+PARQUET_COMPRESSION = "zstd"
+
+ENCOUNTER_SCHEMA = pa.schema(
+    [
+        ("patient", pa.int64()),
+        ("encounter", pa.int64()),
+        ("sex_assigned_at_birth", pa.string()),
+        ("age", pa.int32()),
+        ("city", pa.string()),
+        ("date_seen", pa.timestamp("us", tz="UTC")),
+        ("height_m", pa.int32()),
+        ("height_cm", pa.float64()),
+        ("weight_kg", pa.float64()),
+        ("bmi", pa.float64()),
+        ("history_of_tobacco_use", pa.bool_()),
+        ("history_of_diabetes", pa.bool_()),
+        ("history_of_hypertension", pa.bool_()),
+        ("history_of_high_cholesterol", pa.bool_()),
+        ("history_of_alcohol_abuse", pa.bool_()),
+        ("community_health_worker_notes", pa.string()),
+        ("procedure", pa.string()),
+        ("pharmacy_notes", pa.string()),
+        ("medical_history", pa.string()),
+        ("social_history", pa.string()),
+        ("current_medications", pa.string()),
+        ("family_history", pa.string()),
+    ]
+)
+
+VITALS_SCHEMA = pa.schema(
+    [
+        ("encounter", pa.int64()),
+        ("systolic_blood_pressure", pa.int32()),
+        ("diastolic_blood_pressure", pa.int32()),
+        ("mean_arterial_pressure", pa.float64()),
+        ("heart_rate", pa.int32()),
+        ("body_temperature_c", pa.float64()),
+        ("oxygen_concentration", pa.int32()),
+        ("glucose_level", pa.float64()),
+    ]
+)
+
+TREATMENT_SCHEMA = pa.schema(
+    [
+        ("encounter", pa.int64()),
+        ("diagnosis", pa.string()),
+        ("medication", pa.string()),
+        ("administration_schedule", pa.string()),
+        ("days", pa.int32()),
+        ("prescriber", pa.string()),
+    ]
+)
+
+HPI_SCHEMA = pa.schema(
+    [
+        ("encounter", pa.int64()),
+        ("chief_complaint", pa.string()),
+        ("onset", pa.string()),
+        ("provokes", pa.string()),
+        ("palliates", pa.string()),
+        ("quality", pa.string()),
+        ("radiation", pa.string()),
+        ("severity", pa.string()),
+        ("time_of_day", pa.string()),
+        ("narrative", pa.string()),
+        ("physical_examination", pa.string()),
+        ("tests_ordered", pa.string()),
+    ]
+)
+
+
+def _as_string(value):
+    return str(value) if value is not None else None
+
+
+def _as_float(value):
+    """
+    Measurements go into float64 columns, which Arrow won't fill from a
+    Decimal.
+    """
+    return float(value) if value is not None else None
+
+
+def encounter_record(patient_id, encounter_id, patient, encounter):
+    return {
+        "patient": patient_id,
+        "encounter": encounter_id,
+        "sex_assigned_at_birth": patient.sex_assigned_at_birth,
+        "age": patient.age,
+        "city": patient.city,
+        "date_seen": encounter.timestamp,
+        "height_m": encounter.body_height_primary,
+        "height_cm": _as_float(encounter.body_height_secondary),
+        "weight_kg": _as_float(encounter.body_weight),
+        "bmi": _as_float(encounter.body_mass_index),
+        "history_of_tobacco_use": encounter.smoking,
+        "history_of_diabetes": encounter.history_of_diabetes,
+        "history_of_hypertension": encounter.history_of_hypertension,
+        "history_of_high_cholesterol": encounter.history_of_high_cholesterol,
+        "history_of_alcohol_abuse": encounter.alcohol,
+        "community_health_worker_notes": encounter.community_health_worker_notes,
+        "procedure": encounter.procedure,
+        "pharmacy_notes": encounter.pharmacy_notes,
+        "medical_history": encounter.medical_history,
+        "social_history": encounter.social_history,
+        "current_medications": encounter.current_medications,
+        "family_history": encounter.family_history,
+    }
+
+
+def vitals_record(encounter_id, vital):
+    return {
+        "encounter": encounter_id,
+        "systolic_blood_pressure": vital.systolic_blood_pressure,
+        "diastolic_blood_pressure": vital.diastolic_blood_pressure,
+        "mean_arterial_pressure": _as_float(vital.mean_arterial_pressure),
+        "heart_rate": vital.heart_rate,
+        "body_temperature_c": _as_float(vital.body_temperature),
+        "oxygen_concentration": vital.oxygen_concentration,
+        "glucose_level": _as_float(vital.glucose_level),
+    }
+
+
+def treatment_record(encounter_id, treatment):
+    return {
+        "encounter": encounter_id,
+        "diagnosis": _as_string(treatment.diagnosis),
+        "medication": ",".join(str(x) for x in treatment.medication.all()),
+        "administration_schedule": _as_string(treatment.administration_schedule),
+        "days": treatment.days,
+        "prescriber": _as_string(treatment.prescriber),
+    }
+
+
+def hpi_record(encounter_id, hpi):
+    return {
+        "encounter": encounter_id,
+        "chief_complaint": _as_string(hpi.chief_complaint),
+        "onset": hpi.onset,
+        "provokes": hpi.provokes,
+        "palliates": hpi.palliates,
+        "quality": hpi.quality,
+        "radiation": hpi.radiation,
+        "severity": hpi.severity,
+        "time_of_day": hpi.time_of_day,
+        "narrative": hpi.narrative,
+        "physical_examination": hpi.physical_examination,
+        "tests_ordered": hpi.tests_ordered,
+    }
+
+
+def chunk_tables(patients, patient_id, encounter_id):
+    """
+    Flatten a chunk of prefetched patients into one list of records per
+    table, numbering patients and encounters on from the ids given.
+
+    :return: The records for each table, and the next free patient and
+             encounter ids.
+    """
+    encounters = []
+    vitals = []
+    treatments = []
+    hpis = []
+    for patient in patients:
+        for encounter in patient.patientencounter_set.all():
+            encounters.append(
+                encounter_record(patient_id, encounter_id, patient, encounter)
+            )
+            vitals.extend(
+                vitals_record(encounter_id, vital)
+                for vital in encounter.vitals_set.all()
+            )
+            treatments.extend(
+                treatment_record(encounter_id, treatment)
+                for treatment in encounter.treatment_set.all()
+            )
+            hpis.extend(
+                hpi_record(encounter_id, hpi)
+                for hpi in encounter.historyofpresentillness_set.all()
+            )
+            encounter_id += 1
+        patient_id += 1
+    return (encounters, vitals, treatments, hpis), patient_id, encounter_id
+
+
+@instrument("write-parquet-tables")
+def write_parquet_tables(directory, patient_data, progress=None):
+    """
+    Stream patient_data into one Parquet file per table inside directory,
+    writing a row group per chunk of patients. If given, progress is called
+    with the number of encounters in each chunk once it has been written.
+
+    :return: The paths of the files written.
+    """
+    tables = {
+        "encounters": ENCOUNTER_SCHEMA,
+        "vitals": VITALS_SCHEMA,
+        "treatments": TREATMENT_SCHEMA,
+        "hpis": HPI_SCHEMA,
+    }
+    paths = [os.path.join(directory, f"{name}.parquet") for name in tables]
+    writers = [
+        pq.ParquetWriter(path, schema, compression=PARQUET_COMPRESSION)
+        for path, schema in zip(paths, tables.values())
+    ]
+    patient_id = encounter_id = 1
+    try:
+        for patients in iterate_export_patient_chunks(
+            patient_data, export_prefetches()
+        ):
+            prefetch_related_objects(
+                [
+                    encounter
+                    for patient in patients
+                    for encounter in patient.patientencounter_set.all()
+                ],
+                *export_encounter_prefetches(),
+            )
+            records, patient_id, encounter_id = chunk_tables(
+                patients, patient_id, encounter_id
+            )
+            for writer, schema, table_records in zip(writers, tables.values(), records):
+                writer.write_table(pa.Table.from_pylist(table_records, schema=schema))
+            if progress is not None:
+                progress(len(records[0]))
+    finally:
+        for writer in writers:
+            writer.close()
+    return paths
+
+
+@shared_task
+@instrument("parquet-export-handler")
+def parquet_export_handler(user_id, campaign_id, timeframe):
+    """
+    Export the campaign's patients as zipped Parquet tables. The export is
+    recorded up front, with its cutoff, so its progress can be shown while
+    it runs, as it is for CSV exports.
+    """
+    campaign = Campaign.objects.get(pk=campaign_id)
+    user = fEMRUser.objects.get(pk=user_id)
+    timestamp_to = timezone.now()
+    patient_data = export_patient_data(
+        campaign,
+        timeframe,
+        timestamp_to,
+        timestamp_from=last_export_timestamp(user, campaign, "parquet"),
+    )
+    export = CSVExport.objects.create(
+        user=user,
+        campaign=campaign,
+        rows_total=export_row_count(patient_data),
+        checkpoints={
+            "format": "parquet",
+            "timeframe": timeframe,
+            "timestamp_to": timestamp_to.isoformat(),
+        },
+    )
+
+    def progress(rows):
+        CSVExport.objects.filter(pk=export.pk).update(rows_done=F("rows_done") + rows)
+
+    with tempfile.TemporaryDirectory() as directory:
+        paths = write_parquet_tables(directory, patient_data, progress)
+        with tempfile.TemporaryFile() as archive_file:
+            with zipfile.ZipFile(archive_file, "w", zipfile.ZIP_STORED) as archive:
+                for path in paths:
+                    archive.write(path, os.path.basename(path))
+            archive_file.seek(0)
+            export.file.save(
+                f"patient-export-{campaign.name}-{datetime.now()}.zip",
+                File(archive_file),
+                save=False,
+            )
+    export.rows_done = export.rows_total
+    export.finished = True
+    export.save()
+    notify_export_finished(user)
@@ -0,0 +1,37 @@
+"""
+Vectorized metric to imperial conversions for exports, so that a whole
+chunk of encounters is converted in one NumPy pass rather than cell by cell.
+Missing measurements are read as 0, as the per-encounter conversions do.
+"""
+import numpy as np
+
+
+def measurement_array(values):
+    return np.nan_to_num(np.array(values, dtype=np.float64), nan=0.0)
+
+
+def imperial_heights(primary, secondary):
+    """
+    Convert metre and centimetre heights to feet and inches.
+
+    :return: A list of heights formatted as 5' 11".
+    """
+    inches = np.rint(
+        (measurement_array(primary) * 100 + measurement_array(secondary)) / 2.54
+    )
+    feet, inches = np.divmod(inches.astype(np.int64), 12)
+    return [f"{foot}' {inch}\"" for foot, inch in zip(feet.tolist(), inches.tolist())]
+
+
+def imperial_weights(weights):
+    """
+    Convert kilogram weights to pounds, to two decimal places.
+    """
+    return np.round(measurement_array(weights) * 2.2046, 2).tolist()
+
+
+def fahrenheit_temperatures(temperatures):
+    """
+    Convert Celsius temperatures to Fahrenheit, to two decimal places.
+    """
+    return np.round(measurement_array(temperatures) * 9 / 5 + 32, 2).tolist()
@@ -1,7 +1,7 @@
 from django.shortcuts import redirect
-from django.db.models.query_utils import Q
 
 from main.background_tasks import check_admin_permission
+from main.user_groups import in_group
 
 
 def is_authenticated(view_func):
@@ -17,7 +17,7 @@ def is_authenticated(view_func):
 
 def is_femr_admin(view_func):
     def wrap(request, *args, **kwargs):
-        if request.user.groups.filter(name="fEMR Admin").exists():
+        if in_group(request.user, "fEMR Admin"):
             return_response = view_func(request, *args, **kwargs)
         else:
             return_response = redirect("main:permission_denied")
@@ -28,7 +28,7 @@ def is_femr_admin(view_func):
 
 def is_org_admin(view_func):
     def wrap(request, *args, **kwargs):
-        if request.user.groups.filter(name="Organization Admin").exists():
+        if in_group(request.user, "Organization Admin"):
             return_response = view_func(request, *args, **kwargs)
         else:
             return_response = redirect("main:permission_denied")
@@ -39,9 +39,7 @@ def is_org_admin(view_func):
 
 def is_op_admin(view_func):
     def wrap(request, *args, **kwargs):
-        if request.user.groups.filter(
-            Q(name="Operation Admin") | Q(name="Organization Admin")
-        ).exists():
+        if in_group(request.user, "Operation Admin", "Organization Admin"):
             return_response = view_func(request, *args, **kwargs)
         else:
             return_response = redirect("main:permission_denied")
@@ -11,14 +11,13 @@ from django.core.exceptions import ObjectDoesNotExist
 from django.core.mail import send_mail
 from django.shortcuts import render, redirect, get_object_or_404
 from django.utils import timezone
-from silk.profiling.profiler import silk_profile
 
 from clinic_messages.models import Message
 from main.decorators import is_authenticated
 from main.femr_admin_views import get_client_ip
 from main.forms import PhotoForm, VitalsForm
+from main.instrumentation import instrument
 from .models import (
-    Campaign,
     ChiefComplaint,
     DatabaseChangeLog,
     Patient,
@@ -41,7 +40,7 @@ def patient_delete_view(request, patient_id=None):
     if request.method == "POST":
         try:
             target_object = get_object_or_404(Patient, pk=patient_id)
-            this_campaign = Campaign.objects.get(name=request.user.current_campaign)
+            this_campaign = request.campaign
             contact = this_campaign.instance.main_contact
             DatabaseChangeLog.objects.create(
                 action="Delete",
@@ -113,7 +112,7 @@ def delete_treatment_view(request, treatment_id=None):
 
 
 @is_authenticated
-@silk_profile("delete-photo-view")
+@instrument("delete-photo-view")
 def delete_photo_view(request, patient_id=None, encounter_id=None, photo_id=None):
     """
     Used to edit Encounter objects.
@@ -127,7 +126,7 @@ def delete_photo_view(request, patient_id=None, encounter_id=None, photo_id=None
     if request.user.current_campaign == "RECOVERY MODE":
         return_response = redirect("main:home")
     else:
-        units = Campaign.objects.get(name=request.user.current_campaign).units
+        units = request.campaign.units
         encounter = get_object_or_404(PatientEncounter, pk=encounter_id)
         patient = get_object_or_404(Patient, pk=patient_id)
         photo = Photo.objects.get(pk=photo_id)
@@ -7,9 +7,10 @@ If one is not found, they will direct to the appropriate error page.
 import math
 import os
 
+from django.db.models import Prefetch
 from django.shortcuts import render, redirect, get_object_or_404
-from silk.profiling.profiler import silk_profile
 
+from main.instrumentation import instrument
 from main.serializers import PatientEncounterSerializer
 from main.femr_admin_views import get_client_ip
 from main.qldb_interface import update_patient, update_patient_encounter
@@ -24,9 +25,9 @@ from main.forms import (
     VitalsForm,
 )
 from main.models import (
-    Campaign,
     Diagnosis,
     HistoryOfPresentIllness,
+    InventoryEntry,
     Patient,
     PatientDiagnosis,
     PatientEncounter,
@@ -44,7 +45,7 @@ from main.unit_converters import (
 )
 
 
-@silk_profile("patient-edit-form-get")
+@instrument("patient-edit-form-get")
 def __patient_edit_form_get(request, patient_id, patient, encounters):
     DatabaseChangeLog.objects.create(
         action="View",
@@ -52,7 +53,7 @@ def __patient_edit_form_get(request, patient_id, patient, encounters):
         instance=str(patient),
         ip=get_client_ip(request),
         username=request.user.username,
-        campaign=Campaign.objects.get(name=request.user.current_campaign),
+        campaign=request.campaign,
     )
     form = PatientForm(instance=patient)
     return render(
@@ -68,14 +69,14 @@ def __patient_edit_form_get(request, patient_id, patient, encounters):
     )
 
 
-@silk_profile("patient-edit-form-post")
+@instrument("patient-edit-form-post")
 def __patient_edit_form_post(request, patient_id, patient, encounters):
     form = PatientForm(request.POST or None, instance=patient)
     campaign_key = patient.campaign_key
     if form.is_valid():
         patient = form.save()
         patient.campaign_key = campaign_key
-        patient.campaign.add(Campaign.objects.get(name=request.user.current_campaign))
+        patient.campaign.add(request.campaign)
         patient.save()
         DatabaseChangeLog.objects.create(
             action="Edit",
@@ -83,7 +84,7 @@ def __patient_edit_form_post(request, patient_id, patient, encounters):
             instance=str(patient),
             ip=get_client_ip(request),
             username=request.user.username,
-            campaign=Campaign.objects.get(name=request.user.current_campaign),
+            campaign=request.campaign,
         )
         if os.environ.get("QLDB_ENABLED") == "TRUE":
             update_patient(form.cleaned_data)
@@ -107,7 +108,7 @@ def __patient_edit_form_post(request, patient_id, patient, encounters):
     return return_response
 
 
-@silk_profile("patient-edit-form-view")
+@instrument("patient-edit-form-view")
 def patient_edit_form_view(request, patient_id=None):
     """
     Used to edit Patient objects.
@@ -134,11 +135,30 @@ def patient_edit_form_view(request, patient_id=None):
     return return_response
 
 
-@silk_profile("encounter-edit-form-get")
+def __encounter_treatments(encounter):
+    """
+    An encounter's treatments with everything the form lists for each, so
+    rendering them costs the same few queries however many there are. Views
+    pass them on as a list: anything formatting a lazy queryset in the
+    context, such as captured logging, would otherwise query it again.
+    """
+    return (
+        Treatment.objects.filter(encounter=encounter)
+        .select_related("diagnosis", "administration_schedule", "prescriber")
+        .prefetch_related(
+            Prefetch(
+                "medication",
+                queryset=InventoryEntry.objects.select_related("medication", "form"),
+            )
+        )
+    )
+
+
+@instrument("encounter-edit-form-get")
 def __encounter_edit_form_get(request, patient_id, encounter_id):
     encounter = get_object_or_404(PatientEncounter, pk=encounter_id)
     patient = get_object_or_404(Patient, pk=patient_id)
-    units = Campaign.objects.get(name=request.user.current_campaign).units
+    units = request.campaign.units
     vitals_form = VitalsForm(unit=units)
     DatabaseChangeLog.objects.create(
         action="View",
@@ -146,7 +166,7 @@ def __encounter_edit_form_get(request, patient_id, encounter_id):
         instance=str(encounter),
         ip=get_client_ip(request),
         username=request.user.username,
-        campaign=Campaign.objects.get(name=request.user.current_campaign),
+        campaign=request.campaign,
     )
     form = PatientEncounterForm(instance=encounter, unit=units)
     if not encounter.active:
@@ -176,8 +196,8 @@ def __encounter_edit_form_get(request, patient_id, encounter_id):
             "active": encounter_active,
             "aux_form": AuxiliaryPatientEncounterForm(),
             "form": form,
-            "vitals": Vitals.objects.filter(encounter=encounter),
-            "treatments": Treatment.objects.filter(encounter=encounter),
+            "vitals": list(Vitals.objects.filter(encounter=encounter)),
+            "treatments": list(__encounter_treatments(encounter)),
             "vitals_form": vitals_form,
             "page_name": f"Edit Encounter for {patient.first_name} {patient.last_name} {suffix}",
             "encounter": encounter,
@@ -190,13 +210,12 @@ def __encounter_edit_form_get(request, patient_id, encounter_id):
     )
 
 
-@silk_profile("encounter-edit-form-post")
+@instrument("encounter-edit-form-post")
 def __encounter_edit_form_post(request, patient_id, encounter_id):
     encounter = get_object_or_404(PatientEncounter, pk=encounter_id)
     patient = get_object_or_404(Patient, pk=patient_id)
-    units = Campaign.objects.get(name=request.user.current_campaign).units
+    units = request.campaign.units
     photos = encounter.photos.all().iterator()
-    treatments = Treatment.objects.filter(encounter=encounter)
     form = PatientEncounterForm(request.POST or None, instance=encounter, unit=units)
     if form.is_valid():
         encounter = form.save(commit=False)
@@ -211,7 +230,7 @@ def __encounter_edit_form_post(request, patient_id, encounter_id):
             instance=str(encounter),
             ip=get_client_ip(request),
             username=request.user.username,
-            campaign=Campaign.objects.get(name=request.user.current_campaign),
+            campaign=request.campaign,
         )
         if os.environ.get("QLDB_ENABLED") == "TRUE":
             encounter_data = PatientEncounterSerializer(encounter).data
@@ -242,8 +261,8 @@ def __encounter_edit_form_post(request, patient_id, encounter_id):
                 "active": encounter_active,
                 "aux_form": AuxiliaryPatientEncounterForm(),
                 "form": form,
-                "vitals": Vitals.objects.filter(encounter=encounter),
-                "treatments": treatments,
+                "vitals": list(Vitals.objects.filter(encounter=encounter)),
+                "treatments": list(__encounter_treatments(encounter)),
                 "vitals_form": VitalsForm(unit=units),
                 "page_name": f"Edit Encounter for {patient.first_name} {patient.last_name} {suffix}",
                 "encounter": encounter,
@@ -257,7 +276,7 @@ def __encounter_edit_form_post(request, patient_id, encounter_id):
     return return_response
 
 
-@silk_profile("encounter-edit-form-view")
+@instrument("encounter-edit-form-view")
 def encounter_edit_form_view(request, patient_id=None, encounter_id=None):
     """
     Used to edit Encounter objects.
@@ -283,7 +302,7 @@ def encounter_edit_form_view(request, patient_id=None, encounter_id=None):
     return return_response
 
 
-@silk_profile("new-diagnosis-view")
+@instrument("new-diagnosis-view")
 def new_diagnosis_view(request, patient_id=None, encounter_id=None):
     """
     Used to edit Encounter objects.
@@ -306,7 +325,7 @@ def new_diagnosis_view(request, patient_id=None, encounter_id=None):
 
 
 def __new_diagnosis_view_body(request, patient_id, encounter_id):
-    campaign = Campaign.objects.get(name=request.user.current_campaign)
+    campaign = request.campaign
     encounter = get_object_or_404(PatientEncounter, pk=encounter_id)
     patient = get_object_or_404(Patient, pk=patient_id)
     treatment_form = TreatmentForm()
@@ -374,7 +393,7 @@ def new_diagnosis_view_post(request, encounter, diagnosis_set):
             instance=str(encounter),
             ip=get_client_ip(request),
             username=request.user.username,
-            campaign=Campaign.objects.get(name=request.user.current_campaign),
+            campaign=request.campaign,
         )
         if os.environ.get("QLDB_ENABLED") == "TRUE":
             encounter_data = PatientEncounterSerializer(encounter).data
@@ -382,7 +401,7 @@ def new_diagnosis_view_post(request, encounter, diagnosis_set):
     return diagnosis_form
 
 
-@silk_profile("new-treatment-view")
+@instrument("new-treatment-view")
 def new_treatment_view(request, patient_id=None, encounter_id=None):
     """
     Used to edit Encounter objects.
@@ -405,7 +424,7 @@ def new_treatment_view(request, patient_id=None, encounter_id=None):
 
 
 def __new_treatment_view_body(request, patient_id, encounter_id):
-    campaign = Campaign.objects.get(name=request.user.current_campaign)
+    campaign = request.campaign
     encounter = get_object_or_404(PatientEncounter, pk=encounter_id)
     patient = get_object_or_404(Patient, pk=patient_id)
     treatment_form = TreatmentForm()
@@ -482,7 +501,7 @@ def __treatment_view_post(request, encounter):
             instance=str(encounter),
             ip=get_client_ip(request),
             username=request.user.username,
-            campaign=Campaign.objects.get(name=request.user.current_campaign),
+            campaign=request.campaign,
         )
         if os.environ.get("QLDB_ENABLED") == "TRUE":
             encounter_data = PatientEncounterSerializer(encounter).data
@@ -490,7 +509,7 @@ def __treatment_view_post(request, encounter):
     return treatment_form
 
 
-@silk_profile("aux-form-view")
+@instrument("aux-form-view")
 def aux_form_view(request, patient_id=None, encounter_id=None):
     """
     Used to edit Encounter objects.
@@ -557,7 +576,7 @@ def __aux_form_view_post(
 
 def __aux_form_view_get(request, encounter_id, patient, treatment_form, diagnosis_form):
     encounter = PatientEncounter.objects.get(pk=encounter_id)
-    units = Campaign.objects.get(name=request.user.current_campaign).units
+    units = request.campaign.units
     form = PatientEncounterForm(instance=encounter, unit=units)
     if units == "i":
         aux_form_imperial(form, encounter)
@@ -585,7 +604,7 @@ def __aux_form_view_get(request, encounter_id, patient, treatment_form, diagnosi
 
 
 def __aux_form_invalid(request, encounter_id, patient, treatment_form, diagnosis_form):
-    units = Campaign.objects.get(name=request.user.current_campaign).units
+    units = request.campaign.units
     encounter = PatientEncounter.objects.get(pk=encounter_id)
     form = PatientEncounterForm(instance=encounter, unit=units)
     if units == "i":
@@ -631,7 +650,7 @@ def __aux_form_is_valid(request, encounter, treatment_form):
         instance=str(encounter),
         ip=get_client_ip(request),
         username=request.user.username,
-        campaign=Campaign.objects.get(name=request.user.current_campaign),
+        campaign=request.campaign,
     )
     if os.environ.get("QLDB_ENABLED") == "TRUE":
         encounter_data = PatientEncounterSerializer(encounter).data
@@ -643,13 +662,13 @@ def __aux_form_is_valid(request, encounter, treatment_form):
     )
 
 
-@silk_profile("history-view")
+@instrument("history-view")
 def history_view(request, patient_id=None, encounter_id=None):
     if request.user.is_authenticated:
         if request.user.current_campaign == "RECOVERY MODE":
             return_response = redirect("main:home")
         else:
-            units = Campaign.objects.get(name=request.user.current_campaign).units
+            units = request.campaign.units
             encounter = get_object_or_404(PatientEncounter, pk=encounter_id)
             patient = get_object_or_404(Patient, pk=patient_id)
             aux_form = HistoryPatientEncounterForm(instance=encounter)
@@ -667,9 +686,7 @@ def history_view(request, patient_id=None, encounter_id=None):
                         instance=str(encounter),
                         ip=get_client_ip(request),
                         username=request.user.username,
-                        campaign=Campaign.objects.get(
-                            name=request.user.current_campaign
-                        ),
+                        campaign=request.campaign,
                     )
                     if os.environ.get("QLDB_ENABLED") == "TRUE":
                         encounter_data = PatientEncounterSerializer(encounter).data
@@ -745,7 +762,7 @@ def __history_view_get(request, encounter_id, units, patient, aux_form):
     )
 
 
-@silk_profile("new-vitals-view")
+@instrument("new-vitals-view")
 def new_vitals_view(request, patient_id=None, encounter_id=None):
     """
     Used to edit Encounter objects.
@@ -759,7 +776,7 @@ def new_vitals_view(request, patient_id=None, encounter_id=None):
         if request.user.current_campaign == "RECOVERY MODE":
             return_response = redirect("main:home")
         else:
-            units = Campaign.objects.get(name=request.user.current_campaign).units
+            units = request.campaign.units
             encounter = get_object_or_404(PatientEncounter, pk=encounter_id)
             patient = get_object_or_404(Patient, pk=patient_id)
             vitals = Vitals.objects.filter(encounter=encounter)
@@ -806,16 +823,16 @@ def new_vitals_view_post(request, units, encounter):
             instance=str(encounter),
             ip=get_client_ip(request),
             username=request.user.username,
-            campaign=Campaign.objects.get(name=request.user.current_campaign),
+            campaign=request.campaign,
         )
         if os.environ.get("QLDB_ENABLED") == "TRUE":
             encounter_data = PatientEncounterSerializer(encounter).data
             update_patient_encounter(encounter_data)
 
 
-@silk_profile("hpi-view-post")
+@instrument("hpi-view-post")
 def __hpi_view_post(request, patient_id, encounter_id):
-    units = Campaign.objects.get(name=request.user.current_campaign).units
+    units = request.campaign.units
     encounter = get_object_or_404(PatientEncounter, pk=encounter_id)
     patient = get_object_or_404(Patient, pk=patient_id)
     vitals = Vitals.objects.filter(encounter=encounter)
@@ -853,7 +870,7 @@ def __hpi_view_post(request, patient_id, encounter_id):
     )
 
 
-@silk_profile("hpi-view")
+@instrument("hpi-view")
 def hpi_view(request, patient_id=None, encounter_id=None):
     if request.user.is_authenticated:
         if request.user.current_campaign == "RECOVERY MODE":
@@ -865,7 +882,7 @@ def hpi_view(request, patient_id=None, encounter_id=None):
     return return_response
 
 
-@silk_profile("submit-hpi-view")
+@instrument("submit-hpi-view")
 def submit_hpi_view(request, patient_id=None, encounter_id=None, hpi_id=None):
     if request.user.is_authenticated:
         if request.user.current_campaign == "RECOVERY MODE":
@@ -883,7 +900,7 @@ def submit_hpi_view(request, patient_id=None, encounter_id=None, hpi_id=None):
                     instance=str(encounter),
                     ip=get_client_ip(request),
                     username=request.user.username,
-                    campaign=Campaign.objects.get(name=request.user.current_campaign),
+                    campaign=request.campaign,
                 )
                 if os.environ.get("QLDB_ENABLED") == "TRUE":
                     encounter_data = PatientEncounterSerializer(encounter).data
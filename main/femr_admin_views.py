@@ -1,5 +1,6 @@
 from django.shortcuts import get_object_or_404, redirect, render
-from silk.profiling.profiler import silk_profile
+
+from main.campaign_timezone import forget_campaign_timezone
 from main.decorators import is_authenticated, is_femr_admin
 
 from main.forms import (
@@ -11,6 +12,7 @@ from main.forms import (
     fEMRAdminUserForm,
     fEMRAdminUserUpdateForm,
 )
+from main.instrumentation import instrument
 from main.models import (
     AuditEntry,
     Campaign,
@@ -39,6 +41,7 @@ def change_campaign(request):
         if campaign is not None:
             request.user.current_campaign = campaign
             request.user.save()
+            forget_campaign_timezone(request)
             AuditEntry.objects.create(
                 action="user_changed_campaigns",
                 ip=get_client_ip(request),
@@ -80,7 +83,7 @@ def new_campaign_view(request):
                     instance=str(item),
                     ip=get_client_ip(request),
                     username=request.user.username,
-                    campaign=Campaign.objects.get(name=request.user.current_campaign),
+                    campaign=request.campaign,
                 )
                 return_value = render(
                     request, "femr_admin/confirm/campaign_submitted.html"
@@ -116,7 +119,7 @@ def new_instance_view(request):
                 instance=str(item),
                 ip=get_client_ip(request),
                 username=request.user.username,
-                campaign=Campaign.objects.get(name=request.user.current_campaign),
+                campaign=request.campaign,
             )
             return_value = render(request, "femr_admin/confirm/instance_submitted.html")
         else:
@@ -161,7 +164,7 @@ def new_contact_view(request):
                 instance=str(item),
                 ip=get_client_ip(request),
                 username=request.user.username,
-                campaign=Campaign.objects.get(name=request.user.current_campaign),
+                campaign=request.campaign,
             )
             contact_form = fEMRAdminUserForm()
     return render(
@@ -239,7 +242,7 @@ def edit_contact_view(request, user_id=None):
                 instance=str(item),
                 ip=get_client_ip(request),
                 username=request.user.username,
-                campaign=Campaign.objects.get(name=request.user.current_campaign),
+                campaign=request.campaign,
             )
             return_value = render(request, "femr_admin/confirm/contact_submitted.html")
         else:
@@ -294,7 +297,7 @@ def edit_instance_view(request, instance_id=None):
                 instance=str(item),
                 ip=get_client_ip(request),
                 username=request.user.username,
-                campaign=Campaign.objects.get(name=request.user.current_campaign),
+                campaign=request.campaign,
             )
             return_response = render(
                 request, "femr_admin/confirm/instance_submitted.html"
@@ -452,7 +455,7 @@ def list_organization_view(request):
 
 @is_femr_admin
 @is_authenticated
-@silk_profile("edit-organization-view")
+@instrument("edit-organization-view")
 def edit_organization_view(request, organization_id=None):
     instance = Organization.objects.get(pk=organization_id)
     contact = instance.main_contact
@@ -469,7 +472,7 @@ def edit_organization_view(request, organization_id=None):
                 instance=str(item),
                 ip=get_client_ip(request),
                 username=request.user.username,
-                campaign=Campaign.objects.get(name=request.user.current_campaign),
+                campaign=request.campaign,
             )
             return_response = render(
                 request, "femr_admin/confirm/organization_submitted.html"
@@ -506,7 +509,7 @@ def new_organization_view(request):
                 instance=str(item),
                 ip=get_client_ip(request),
                 username=request.user.username,
-                campaign=Campaign.objects.get(name=request.user.current_campaign),
+                campaign=request.campaign,
             )
             return_response = render(
                 request, "femr_admin/confirm/organization_submitted.html"
@@ -79,7 +79,7 @@ def __patient_form_view_post(request, campaign):
             instance=str(item),
             ip=get_client_ip(request),
             username=request.user.username,
-            campaign=Campaign.objects.get(name=request.user.current_campaign),
+            campaign=request.campaign,
         )
         if item.id != "" and item.id is not None:
             return_response = render(
@@ -138,7 +138,7 @@ def patient_form_view(request):
     if request.user.current_campaign == "RECOVERY MODE":
         return_response = redirect("main:home")
     else:
-        campaign = Campaign.objects.get(name=request.user.current_campaign)
+        campaign = request.campaign
         if request.method == "POST":
             return_response = __patient_form_view_post(request, campaign)
         else:
@@ -147,13 +147,13 @@ def patient_form_view(request):
 
 
 def __patient_encounter_form_get(request, patient):
-    telehealth = Campaign.objects.get(name=request.user.current_campaign).telehealth
+    telehealth = request.campaign.telehealth
     treatment_form = TreatmentForm()
     diagnosis_form = DiagnosisForm()
     encounter_open = (
         len(PatientEncounter.objects.filter(patient=patient).filter(active=True)) > 0
     )
-    units = Campaign.objects.get(name=request.user.current_campaign).units
+    units = request.campaign.units
     form = PatientEncounterForm(unit=units, prefix="form")
     vitals_form = VitalsForm(unit=units, prefix="vitals_form")
     try:
@@ -236,8 +236,8 @@ def __patient_encounter_form_get(request, patient):
 
 
 def __patient_encounter_form_post(request, patient):
-    telehealth = Campaign.objects.get(name=request.user.current_campaign).telehealth
-    units = Campaign.objects.get(name=request.user.current_campaign).units
+    telehealth = request.campaign.telehealth
+    units = request.campaign.units
     encounter_open = (
         len(PatientEncounter.objects.filter(patient=patient).filter(active=True)) > 0
     )
@@ -250,7 +250,7 @@ def __patient_encounter_form_post(request, patient):
         vitals = vitals_form.save(commit=False)
         encounter.patient = patient
         encounter.active = True
-        encounter.campaign = Campaign.objects.get(name=request.user.current_campaign)
+        encounter.campaign = request.campaign
         encounter.save()
         vitals.encounter = encounter
         vitals.save()
@@ -264,7 +264,7 @@ def __patient_encounter_form_post(request, patient):
             instance=str(encounter),
             ip=get_client_ip(request),
             username=request.user.username,
-            campaign=Campaign.objects.get(name=request.user.current_campaign),
+            campaign=request.campaign,
         )
         DatabaseChangeLog.objects.create(
             action="Create",
@@ -272,7 +272,7 @@ def __patient_encounter_form_post(request, patient):
             instance=str(encounter),
             ip=get_client_ip(request),
             username=request.user.username,
-            campaign=Campaign.objects.get(name=request.user.current_campaign),
+            campaign=request.campaign,
         )
         if "submit_encounter" in request.POST:
             return_response = render(
@@ -351,9 +351,7 @@ def referral_form_view(request, patient_id=None):
                 "patient_id": patient_id,
                 "page_name": "Campaign Referral",
                 "campaigns": Campaign.objects.filter(
-                    instance=Campaign.objects.get(
-                        name=request.user.current_campaign
-                    ).instance
+                    instance=request.campaign.instance
                 ).filter(active=True),
             },
         )
@@ -1,10 +1,9 @@
-from django.http.response import HttpResponse
+from django.http.response import StreamingHttpResponse
 from django.shortcuts import render, redirect, get_object_or_404
 from django.core.paginator import Paginator
 
-from silk.profiling.profiler import silk_profile
-
 from main.csvio.added_inventory import AddedInventoryHandler
+from main.csvio.formulary_export import formulary_csv
 from main.csvio.initial_inventory import InitialInventoryHandler
 from main.decorators import is_admin, is_authenticated
 from main.forms import (
@@ -13,14 +12,15 @@ from main.forms import (
     InventoryEntryForm,
     RemoveSupplyForm,
 )
-from main.models import Campaign, InventoryEntry
+from main.instrumentation import instrument
+from main.models import InventoryEntry
 
 
-@silk_profile("formulary-home-view")
+@instrument("formulary-home-view")
 @is_authenticated
 @is_admin
 def formulary_home_view(request):
-    campaign = Campaign.objects.get(name=request.user.current_campaign)
+    campaign = request.campaign
     formulary = campaign.inventory.entries.all().order_by("medication")
     paginator = Paginator(formulary, 10)
     page_number = request.GET.get("page")
@@ -32,14 +32,14 @@ def formulary_home_view(request):
     )
 
 
-@silk_profile("add-supply-view")
+@instrument("add-supply-view")
 @is_authenticated
 def add_supply_view(request):
     if request.method == "GET":
         form = InventoryEntryForm()
         return_response = render(request, "formulary/add_supply.html", {"form": form})
     else:
-        campaign = Campaign.objects.get(name=request.user.current_campaign)
+        campaign = request.campaign
         form = InventoryEntryForm(request.POST)
         entry = form.save()
         entry.amount = entry.count * entry.quantity
@@ -50,7 +50,7 @@ def add_supply_view(request):
     return return_response
 
 
-@silk_profile("edit-supply-view")
+@instrument("edit-supply-view")
 @is_authenticated
 @is_admin
 def edit_supply_view(request, entry_id=None):
@@ -71,16 +71,16 @@ def edit_supply_view(request, entry_id=None):
     return return_response
 
 
-@silk_profile("delete-supply-item")
+@instrument("delete-supply-item")
 @is_authenticated
 def delete_supply_item(request, supply_id=None):
-    campaign = Campaign.objects.get(name=request.user.current_campaign)
+    campaign = request.campaign
     entry = InventoryEntry.objects.get(pk=supply_id)
     campaign.inventory.entries.remove(entry)
     return redirect("main:formulary_home_view")
 
 
-@silk_profile("edit-add-supply-view")
+@instrument("edit-add-supply-view")
 @is_authenticated
 @is_admin
 def edit_add_supply_view(request, entry_id=None):
@@ -116,7 +116,7 @@ def edit_add_supply_view(request, entry_id=None):
     return return_response
 
 
-@silk_profile("edit-sub-supply-view")
+@instrument("edit-sub-supply-view")
 @is_authenticated
 @is_admin
 def edit_sub_supply_view(request, entry_id=None):
@@ -158,18 +158,18 @@ def edit_sub_supply_view(request, entry_id=None):
     return return_response
 
 
-@silk_profile("csv-handler-view")
+@instrument("csv-handler-view")
 @is_authenticated
 @is_admin
 def csv_handler_view(request):
     return render(request, "formulary/csv_handler.html", {"form": CSVUploadForm()})
 
 
-@silk_profile("csv-import-view")
+@instrument("csv-import-view")
 @is_authenticated
 @is_admin
 def csv_import_view(request):
-    campaign = Campaign.objects.get(name=request.user.current_campaign)
+    campaign = request.campaign
     form = CSVUploadForm(request.POST, request.FILES)
     result = ""
     if form.is_valid():
@@ -204,15 +204,12 @@ def csv_import_view(request):
     return return_response
 
 
-@silk_profile("csv-export-view")
+@instrument("csv-export-view")
 @is_authenticated
 @is_admin
 def csv_export_view(request):
-    campaign = Campaign.objects.get(name=request.user.current_campaign)
-    formulary = campaign.inventory.entries.all().order_by("medication")
-    return_response = HttpResponse(
+    return StreamingHttpResponse(
+        formulary_csv(request.campaign.inventory),
         content_type="text/csv",
         headers={"Content-Disposition": 'attachment; filename="formulary.csv"'},
     )
-    handler = InitialInventoryHandler()
-    return handler.write(return_response, formulary)
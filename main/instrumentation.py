@@ -0,0 +1,114 @@
+"""
+Lightweight timing of named spans, sampled per span and handed to pluggable
+exporters, so that hot code paths stay visible in production without writing
+profiles to the database.
+
+Wrap a function with @instrument("span-name"), or a block with
+`with span("span-name"):`. settings.INSTRUMENTATION_SAMPLE_RATES maps span
+names to the fraction of calls that are timed, with
+settings.INSTRUMENTATION_DEFAULT_SAMPLE_RATE used for the rest, and
+settings.INSTRUMENTATION_EXPORTERS lists the dotted paths of the exporter
+classes each timing is recorded by.
+"""
+import json
+import logging
+import random
+from contextlib import contextmanager
+from functools import lru_cache, wraps
+from time import perf_counter
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+from main.metrics import observe
+
+
+class PrometheusExporter:
+    """
+    Counts each sampled span into the femr_span_duration_seconds histogram
+    served by /metrics.
+    """
+
+    def record(self, name, duration):
+        observe("femr_span_duration_seconds", name, duration)
+
+
+class JsonLogExporter:
+    """
+    Logs each sampled span as a line of JSON to the femr.instrumentation
+    logger.
+    """
+
+    logger = logging.getLogger("femr.instrumentation")
+
+    def record(self, name, duration):
+        self.logger.info(
+            json.dumps({"span": name, "duration_ms": round(duration * 1000, 3)})
+        )
+
+
+@lru_cache(maxsize=None)
+def get_exporters():
+    return tuple(import_string(path)() for path in settings.INSTRUMENTATION_EXPORTERS)
+
+
+@lru_cache(maxsize=None)
+def sample_rate(name):
+    return settings.INSTRUMENTATION_SAMPLE_RATES.get(
+        name, settings.INSTRUMENTATION_DEFAULT_SAMPLE_RATE
+    )
+
+
+@receiver(setting_changed)
+def reload_instrumentation_settings(setting, **kwargs):
+    if setting.startswith("INSTRUMENTATION_"):
+        get_exporters.cache_clear()
+        sample_rate.cache_clear()
+
+
+def is_sampled(name):
+    rate = sample_rate(name)
+    return rate >= 1 or (rate > 0 and random.random() < rate)
+
+
+def record(name, duration):
+    for exporter in get_exporters():
+        exporter.record(name, duration)
+
+
+@contextmanager
+def span(name):
+    """
+    Time the enclosed block as the span name, if this call is sampled.
+    """
+    if not is_sampled(name):
+        yield
+        return
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        record(name, perf_counter() - start)
+
+
+def instrument(name):
+    """
+    Decorate a function so that its calls are timed as the span name.
+    """
+
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not is_sampled(name):
+                return func(*args, **kwargs)
+            start = perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                record(name, perf_counter() - start)
+
+        return wrapper
+
+    return decorator
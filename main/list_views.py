@@ -11,27 +11,44 @@ from datetime import datetime, timedelta
 from django.core.exceptions import ObjectDoesNotExist
 from django.db.models import Q
 from django.shortcuts import render
-from django.core.paginator import Paginator
 from django.utils import timezone
-from silk.profiling.profiler import silk_profile
 
 from main.csvio.patient_csv_export import run_patient_csv_export
 from main.decorators import is_authenticated
+from main.instrumentation import instrument
+from main.pagination import KeysetPaginator
+from main.patient_search import search_patients
 
 from .models import (
     ChiefComplaint,
     Patient,
-    Campaign,
 )
 
 
-@silk_profile("get-latest-timestamp")
+@instrument("get-latest-timestamp")
 def get_latest_timestamp(patient):
     return patient.timestamp
 
 
+def __seen_today(campaign):
+    """
+    The campaign's patients with an encounter or an update since midnight. The two
+    date ranges are OR'd, so at best the planner combines the last_encounter_at and
+    timestamp indexes with a bitmap OR; the rows are then sorted on -timestamp.
+    """
+    today = timezone.localtime().replace(hour=0, minute=0, second=0, microsecond=0)
+    tomorrow = today + timedelta(days=1)
+    return Patient.objects.filter(
+        Q(campaign=campaign)
+        & (
+            Q(last_encounter_at__gte=today, last_encounter_at__lt=tomorrow)
+            | Q(timestamp__gte=today, timestamp__lt=tomorrow)
+        )
+    ).order_by("-timestamp")
+
+
 @is_authenticated
-@silk_profile("patient_list_view")
+@instrument("patient_list_view")
 def patient_list_view(request):
     """
     Administrative/Clinician list of patients entered into the system.
@@ -40,17 +57,12 @@ def patient_list_view(request):
     :return: HTTPResponse.
     """
     try:
-        now = timezone.make_aware(datetime.today(), timezone.get_default_timezone())
-        now = now.astimezone(timezone.get_current_timezone())
-        data = Patient.objects.filter(
-            (Q(patientencounter__timestamp__date=now) | Q(timestamp__date=now))
-            & Q(campaign=Campaign.objects.get(name=request.user.current_campaign))
-        ).order_by("-timestamp")
+        data = __seen_today(request.campaign)
     except ObjectDoesNotExist:
         data = []
-    paginator = Paginator(data, 10)
-    page_number = request.GET.get("page")
-    page_obj = paginator.get_page(page_number)
+    page_obj = KeysetPaginator(data, 10).get_page(
+        request.GET.get("after"), request.GET.get("before")
+    )
     return render(
         request,
         "list/patient.html",
@@ -75,18 +87,12 @@ def patient_csv_export_view(request, timeframe=1):
     return run_patient_csv_export(request, timeframe)
 
 
-@silk_profile("--run-patient-list-filter-one")
+@instrument("--run-patient-list-filter-one")
 def __run_patient_list_filter_one(_, campaign):
-    now = timezone.make_aware(datetime.today(), timezone.get_default_timezone())
-    now = now.astimezone(timezone.get_current_timezone())
-    data = Patient.objects.filter(
-        Q(campaign=campaign)
-        & (Q(patientencounter__timestamp__date=now) | Q(timestamp__date=now))
-    ).order_by("-timestamp")
-    return data
+    return __seen_today(campaign)
 
 
-@silk_profile("--run_timestamp_filter")
+@instrument("--run_timestamp_filter")
 def __run_timestamp_filter(campaign, timestamp_to, timestamp_from):
     return (
         Patient.objects.filter(
@@ -107,21 +113,21 @@ def __run_timestamp_filter(campaign, timestamp_to, timestamp_from):
     )
 
 
-@silk_profile("--run-patient-list-filter-two")
+@instrument("--run-patient-list-filter-two")
 def __run_patient_list_filter_two(_, campaign):
     timestamp_from = timezone.now() - timedelta(days=7)
     timestamp_to = timezone.now()
     return __run_timestamp_filter(campaign, timestamp_to, timestamp_from)
 
 
-@silk_profile("--run-patient-list-filter-three")
+@instrument("--run-patient-list-filter-three")
 def __run_patient_list_filter_three(_, campaign):
     timestamp_from = timezone.now() - timedelta(days=30)
     timestamp_to = timezone.now()
     return __run_timestamp_filter(campaign, timestamp_to, timestamp_from)
 
 
-@silk_profile("--run-patient-list-filter-four")
+@instrument("--run-patient-list-filter-four")
 def __run_patient_list_filter_four(request, campaign):
     try:
         timestamp_from = datetime.strptime(
@@ -136,7 +142,7 @@ def __run_patient_list_filter_four(request, campaign):
     return data
 
 
-@silk_profile("--run-patient-list-filter-five")
+@instrument("--run-patient-list-filter-five")
 def __run_patient_list_filter_five(request, campaign):
     try:
         timestamp_from = datetime.strptime(request.GET["date_filter_start"], "%Y-%m-%d")
@@ -149,9 +155,9 @@ def __run_patient_list_filter_five(request, campaign):
     return data
 
 
-@silk_profile("--run-patient-list-filter")
+@instrument("--run-patient-list-filter")
 def __run_patient_list_filter(request):
-    current_campaign = Campaign.objects.get(name=request.user.current_campaign)
+    current_campaign = request.campaign
     try:
         if request.GET["filter_list"] == "1":
             data = __run_patient_list_filter_one(request, current_campaign)
@@ -174,11 +180,11 @@ def __run_patient_list_filter(request):
             data = []
     except ObjectDoesNotExist:
         data = []
-    return list(data)
+    return data
 
 
 @is_authenticated
-@silk_profile("filter-patient-list-view")
+@instrument("filter-patient-list-view")
 def filter_patient_list_view(request):
     """
     Runs a search of all patients, using a name entered on the List page.
@@ -187,9 +193,9 @@ def filter_patient_list_view(request):
     :return: HTTPResponse.
     """
     data = __run_patient_list_filter(request)
-    paginator = Paginator(data, 10)
-    page_number = request.GET.get("page")
-    page_obj = paginator.get_page(page_number)
+    page_obj = KeysetPaginator(data, 10).get_page(
+        request.GET.get("after"), request.GET.get("before")
+    )
     return render(
         request,
         "list/patient_filter.html",
@@ -208,7 +214,7 @@ def filter_patient_list_view(request):
 
 
 @is_authenticated
-@silk_profile("search-patient-list-view")
+@instrument("search-patient-list-view")
 def search_patient_list_view(request):
     """
     Runs a search of all patients, using a name entered on the List page.
@@ -217,33 +223,12 @@ def search_patient_list_view(request):
     :return: HTTPResponse.
     """
     try:
-        current_campaign = Campaign.objects.get(name=request.user.current_campaign)
-        patients = Patient.objects.filter(campaign=current_campaign)
-        data = None
-        break_search = Q()
-        for term in request.GET["name_search"].split():
-            break_search |= Q(first_name__icontains=term) | Q(last_name__icontains=term)
-        data = patients.filter(
-            (
-                Q(campaign_key__icontains=request.GET["name_search"])
-                | Q(first_name__icontains=request.GET["name_search"])
-                | Q(last_name__icontains=request.GET["name_search"])
-                | Q(phone_number__icontains=request.GET["name_search"])
-                | Q(
-                    phone_number__icontains=__parse_phone_number(
-                        request.GET["name_search"]
-                    )
-                )
-                | Q(email_address__iexact=request.GET["name_search"])
-                | break_search
-            )
-        ).order_by("-timestamp")
-        data = data if data is not None else []
+        data = search_patients(request.campaign, request.GET["name_search"])
     except ObjectDoesNotExist:
         data = []
-    paginator = Paginator(data, 10)
-    page_number = request.GET.get("page")
-    page_obj = paginator.get_page(page_number)
+    page_obj = KeysetPaginator(data, 10).get_page(
+        request.GET.get("after"), request.GET.get("before")
+    )
     return render(
         request,
         "list/patient_search.html",
@@ -259,16 +244,6 @@ def search_patient_list_view(request):
     )
 
 
-def __parse_phone_number(input_string):
-    if len(input_string) < 10 or len(input_string) > 10:
-        return_response = input_string
-    else:
-        return_response = (
-            f"({input_string[0:3]}){input_string[3:6]}-{input_string[6:10]}"
-        )
-    return return_response
-
-
 @is_authenticated
 def chief_complaint_list_view(request, patient_id=None, encounter_id=None):
     return render(
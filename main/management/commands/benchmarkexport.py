@@ -0,0 +1,96 @@
+"""
+Defines a benchmarkexport command extending manage.py.
+"""
+import timeit
+
+from django.core.management.base import BaseCommand
+from django.db.models import prefetch_related_objects
+
+from main.csvio.patient_csv_export import calc_height
+from main.csvio.patient_export_data import export_encounter_queryset
+from main.csvio.unit_conversion import (
+    fahrenheit_temperatures,
+    imperial_heights,
+    imperial_weights,
+)
+from main.models import Campaign
+
+
+def scalar_conversion(encounters, temperatures):
+    heights = [calc_height(encounter) for encounter in encounters]
+    weights = [
+        round(
+            (encounter.body_weight if encounter.body_weight is not None else 0)
+            * 2.2046,
+            2,
+        )
+        for encounter in encounters
+    ]
+    temperatures = [
+        round(
+            ((temperature if temperature is not None else 0) * 9 / 5) + 32,
+            2,
+        )
+        for temperature in temperatures
+    ]
+    return heights, weights, temperatures
+
+
+def vectorized_conversion(encounters, temperatures):
+    heights = imperial_heights(
+        [encounter.body_height_primary for encounter in encounters],
+        [encounter.body_height_secondary for encounter in encounters],
+    )
+    weights = imperial_weights([encounter.body_weight for encounter in encounters])
+    return heights, weights, fahrenheit_temperatures(temperatures)
+
+
+class Command(BaseCommand):
+    """
+    Extends the BaseCommand class, providing tie-ins to Django.
+    """
+
+    help = (
+        "Time the per-cell and vectorized imperial conversions of the patient "
+        "export over every encounter of a campaign. Run scaledata first for a "
+        "10,000 encounter campaign."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--campaign", default="Test")
+        parser.add_argument("--repeat", type=int, default=5)
+
+    def handle(self, *args, **options):
+        """
+        Carry out the command functionality.
+
+        @param args:
+        @param options:
+        @return:
+        """
+        campaign = Campaign.objects.get(name=options["campaign"])
+        encounters = list(export_encounter_queryset().filter(campaign=campaign))
+        prefetch_related_objects(encounters, "vitals_set")
+        temperatures = [
+            vital.body_temperature
+            for encounter in encounters
+            for vital in encounter.vitals_set.all()
+        ]
+        self.stdout.write(
+            f"{len(encounters)} encounters, {len(temperatures)} vitals, "
+            f"best of {options['repeat']}"
+        )
+        results = {}
+        for name, conversion in (
+            ("scalar", scalar_conversion),
+            ("vectorized", vectorized_conversion),
+        ):
+            results[name] = min(
+                timeit.repeat(
+                    lambda conversion=conversion: conversion(encounters, temperatures),
+                    number=1,
+                    repeat=options["repeat"],
+                )
+            )
+            self.stdout.write(f"{name}: {results[name] * 1000:.1f} ms")
+        self.stdout.write(f"speedup: {results['scalar'] / results['vectorized']:.1f}x")
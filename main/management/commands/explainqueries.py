@@ -0,0 +1,131 @@
+"""
+Defines an explainqueries command extending manage.py.
+"""
+import re
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Q
+from django.utils import timezone
+
+from main.models import (
+    AuditEntry,
+    Campaign,
+    DatabaseChangeLog,
+    Patient,
+    PatientEncounter,
+)
+
+# Plan lines reading a whole table: Postgres' "Seq Scan on main_patient" and
+# SQLite's "SCAN main_patient", as opposed to "SCAN main_patient USING INDEX".
+SEQUENTIAL_SCAN_PATTERNS = {
+    "postgresql": re.compile(r"Seq Scan on (\w+)"),
+    "sqlite": re.compile(r"\bSCAN (?:TABLE )?(\w+)(?!.*\bUSING\b.*\bINDEX\b)"),
+}
+
+
+def sequential_scans(plan, vendor=None):
+    """
+    The tables read in full by an EXPLAIN plan.
+    """
+    pattern = SEQUENTIAL_SCAN_PATTERNS.get(vendor or connection.vendor)
+    if pattern is None:
+        return []
+    return [match.group(1) for match in map(pattern.search, plan.splitlines()) if match]
+
+
+def key_querysets(campaign):
+    """
+    The querysets behind the busiest lists and tasks, by name.
+    """
+    today = timezone.localtime().replace(hour=0, minute=0, second=0, microsecond=0)
+    patient = Patient.objects.filter(campaign=campaign).first()
+    return {
+        "patient list": Patient.objects.filter(campaign=campaign).order_by(
+            "-timestamp", "-id"
+        ),
+        "patients seen today": Patient.objects.filter(
+            Q(campaign=campaign)
+            & (Q(last_encounter_at__gte=today) | Q(timestamp__gte=today))
+        ).order_by("-timestamp"),
+        "patient encounters": PatientEncounter.objects.filter(patient=patient).order_by(
+            "-timestamp"
+        ),
+        "campaign encounters": PatientEncounter.objects.filter(
+            campaign=campaign
+        ).order_by("-timestamp"),
+        "expired encounters": PatientEncounter.objects.filter(
+            active=True,
+            timestamp__lt=timezone.now() - timedelta(days=campaign.encounter_close),
+        ),
+        "audit log": AuditEntry.objects.filter(
+            Q(campaign=campaign) | Q(action="user_login_failed")
+        ).order_by("-timestamp", "-id"),
+        "database log": DatabaseChangeLog.objects.exclude(
+            model__in=["Campaign", "Instance"]
+        )
+        .filter(campaign=campaign)
+        .order_by("-timestamp", "-id"),
+    }
+
+
+class Command(BaseCommand):
+    """
+    Extends the BaseCommand class, providing tie-ins to Django.
+    """
+
+    help = (
+        "EXPLAIN the querysets behind the patient, encounter and log lists for a "
+        "campaign and report the ones that read a table in full. Planners prefer "
+        "sequential scans of small tables, so run it against realistic data, "
+        "such as a campaign filled by scaledata."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--campaign", default="Test")
+        parser.add_argument(
+            "--analyze",
+            action="store_true",
+            help="Run the queries and report actual timings (Postgres only).",
+        )
+        parser.add_argument(
+            "--verbose-plans",
+            action="store_true",
+            help="Print every plan, not only those with sequential scans.",
+        )
+
+    def handle(self, *args, **options):
+        """
+        Carry out the command functionality.
+
+        @param args:
+        @param options:
+        @return:
+        """
+        try:
+            campaign = Campaign.objects.get(name=options["campaign"])
+        except Campaign.DoesNotExist as error:
+            raise CommandError(f"No campaign named {options['campaign']}.") from error
+        explain_options = {}
+        if options["analyze"] and connection.vendor == "postgresql":
+            explain_options["analyze"] = True
+        querysets = key_querysets(campaign)
+        scanned = 0
+        for name, queryset in querysets.items():
+            plan = queryset.explain(**explain_options)
+            tables = sequential_scans(plan)
+            if tables:
+                scanned += 1
+                self.stdout.write(
+                    self.style.WARNING(
+                        f"{name}: sequential scan of {', '.join(sorted(set(tables)))}"
+                    )
+                )
+            else:
+                self.stdout.write(self.style.SUCCESS(f"{name}: indexed"))
+            if tables or options["verbose_plans"]:
+                self.stdout.write(plan)
+        self.stdout.write(
+            f"{scanned} of {len(querysets)} querysets scan a table in full"
+        )
@@ -0,0 +1,228 @@
+"""
+Histograms of request latency, queries per request, Celery task durations and
+instrumented spans, rendered in the Prometheus text format for /metrics.
+
+Observations are buffered in each process and added into counters in the
+cache every METRICS_FLUSH_INTERVAL seconds, so that every web worker and every
+Celery worker reports into the same totals.
+"""
+import threading
+import time
+from bisect import bisect_left
+
+from django.contrib.sessions.models import Session
+from django.core.cache import cache
+from django.utils import timezone
+
+METRICS_FLUSH_INTERVAL = 10
+METRICS_SERIES_KEY = "metrics-series"
+
+# Upper bounds, in seconds, of the histogram buckets durations are counted into.
+DURATION_BUCKETS = (
+    0.0005,
+    0.001,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+# Each histogram's label name, buckets, help text, and the factor its sum is
+# scaled by so that it can be kept in an integer counter.
+HISTOGRAMS = {
+    "femr_view_duration_seconds": (
+        "view",
+        DURATION_BUCKETS,
+        "Time taken to respond to a request, per view.",
+        1000000,
+    ),
+    "femr_view_queries": (
+        "view",
+        QUERY_BUCKETS,
+        "Database queries run per request, per view.",
+        1,
+    ),
+    "femr_celery_task_duration_seconds": (
+        "task",
+        DURATION_BUCKETS,
+        "Time taken to run a Celery task.",
+        1000000,
+    ),
+    "femr_span_duration_seconds": (
+        "span",
+        DURATION_BUCKETS,
+        "Time spent in sampled instrumented spans.",
+        1000000,
+    ),
+}
+
+
+def series_key(metric, label, index):
+    return f"metrics-{metric}-{label}-{index}"
+
+
+def add_to_counter(key, delta):
+    try:
+        cache.incr(key, delta)
+    except ValueError:
+        # Either nothing has been counted under key yet, or the cache can't be
+        # reached, in which case add() fails silently and the delta is dropped.
+        if not cache.add(key, delta, None):
+            try:
+                cache.incr(key, delta)
+            except ValueError:
+                pass
+
+
+class MetricsBuffer:
+    """
+    Observations made in this process since they were last added to the cache.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.last_flush = time.monotonic()
+
+    def observe(self, metric, label, value):
+        _, buckets, _, scale = HISTOGRAMS[metric]
+        index = bisect_left(buckets, value)
+        with self.lock:
+            values = self.pending.get((metric, label))
+            if values is None:
+                values = self.pending[(metric, label)] = [0] * (len(buckets) + 2)
+            if index < len(buckets):
+                values[index] += 1
+            values[-2] += 1
+            values[-1] += round(value * scale)
+            flush_due = time.monotonic() - self.last_flush >= METRICS_FLUSH_INTERVAL
+        if flush_due:
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            pending, self.pending = self.pending, {}
+            self.last_flush = time.monotonic()
+        if not pending:
+            return
+        for (metric, label), values in pending.items():
+            for index, delta in enumerate(values):
+                if delta:
+                    add_to_counter(series_key(metric, label, index), delta)
+        series = cache.get(METRICS_SERIES_KEY) or set()
+        if not series.issuperset(pending):
+            cache.set(METRICS_SERIES_KEY, series | set(pending), None)
+
+
+metrics_buffer = MetricsBuffer()
+
+# When each Celery task running in this process started, by task id.
+task_start_times = {}
+
+
+def observe(metric, label, value):
+    metrics_buffer.observe(metric, label, value)
+
+
+def task_started(task_id):
+    task_start_times[task_id] = time.perf_counter()
+
+
+def task_finished(task_id, task_name):
+    """
+    Record how long a task took and flush straight away, since a worker may not
+    run another task for hours.
+    """
+    start = task_start_times.pop(task_id, None)
+    if start is not None:
+        observe(
+            "femr_celery_task_duration_seconds", task_name, time.perf_counter() - start
+        )
+    metrics_buffer.flush()
+
+
+def render_histograms():
+    series = sorted(cache.get(METRICS_SERIES_KEY) or ())
+    keys = [
+        series_key(metric, label, index)
+        for metric, label in series
+        for index in range(len(HISTOGRAMS[metric][1]) + 2)
+    ]
+    counters = cache.get_many(keys)
+    lines = []
+    for metric, (label_name, buckets, help_text, scale) in HISTOGRAMS.items():
+        lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} histogram"]
+        for label in (label for name, label in series if name == metric):
+            values = [
+                counters.get(series_key(metric, label, index), 0)
+                for index in range(len(buckets) + 2)
+            ]
+            labels = f'{label_name}="{label}"'
+            cumulative = 0
+            for bound, count in zip(buckets, values):
+                cumulative += count
+                lines.append(f'{metric}_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines += [
+                f'{metric}_bucket{{{labels},le="+Inf"}} {values[-2]}',
+                f"{metric}_sum{{{labels}}} {values[-1] / scale}",
+                f"{metric}_count{{{labels}}} {values[-2]}",
+            ]
+    return lines
+
+
+def render_cache_stats():
+    """
+    Hit and miss totals reported by the cache servers, where the cache backend
+    exposes them.
+    """
+    client = getattr(cache, "_cache", None)
+    if not hasattr(client, "get_stats"):
+        return []
+    try:
+        server_stats = client.get_stats()
+    except Exception:  # pylint: disable=W0703
+        return []
+    hits = misses = 0
+    for _, stats in server_stats:
+        hits += int(stats.get(b"get_hits", stats.get("get_hits", 0)))
+        misses += int(stats.get(b"get_misses", stats.get("get_misses", 0)))
+    lines = [
+        "# HELP femr_cache_get_hits_total Cache lookups that found a value.",
+        "# TYPE femr_cache_get_hits_total counter",
+        f"femr_cache_get_hits_total {hits}",
+        "# HELP femr_cache_get_misses_total Cache lookups that found nothing.",
+        "# TYPE femr_cache_get_misses_total counter",
+        f"femr_cache_get_misses_total {misses}",
+    ]
+    if hits + misses:
+        lines += [
+            "# HELP femr_cache_hit_ratio Share of cache lookups that found a value.",
+            "# TYPE femr_cache_hit_ratio gauge",
+            f"femr_cache_hit_ratio {hits / (hits + misses)}",
+        ]
+    return lines
+
+
+def render_metrics():
+    """
+    Every metric, in the Prometheus text exposition format.
+    """
+    metrics_buffer.flush()
+    lines = render_histograms() + render_cache_stats()
+    lines += [
+        "# HELP femr_active_sessions Sessions that haven't expired yet.",
+        "# TYPE femr_active_sessions gauge",
+        "femr_active_sessions "
+        f"{Session.objects.filter(expire_date__gt=timezone.now()).count()}",
+    ]
+    return "\n".join(lines) + "\n"
@@ -1,51 +1,132 @@
 """
 Middleware classes intended to intercept requests and enact logic before they hit a view.
 """
-import pytz
+import re
+import time
+
+from django.conf import settings
 from django.contrib.auth import logout
-from django.contrib.auth.models import AnonymousUser
 from django.shortcuts import render
 from django.utils import timezone
+from django.utils.functional import SimpleLazyObject
 
-from clinic_messages.models import Message
+from main.campaign_access import active_campaign_names
+from main.campaign_timezone import campaign_timezone_name, get_timezone
 from main.forms import LoginForm
-from main.models import Campaign, UserSession, fEMRUser
+from main.metrics import observe
+from main.query_budget import query_budget, recording_queries, report_over_budget
+from main.models import Campaign, UserSession
+from main.unread_messages import unread_message_count
+from main.user_groups import in_group
+
+USER_SESSION_REFRESH_INTERVAL = 20
+
+
+def is_fast_path(request):
+    """
+    Whether the request is for an endpoint listed in settings.MIDDLEWARE_FAST_PATH_URLS,
+    which skips the per-user campaign and message work.
+    """
+    if not hasattr(request, "_fast_path"):
+        request._fast_path = any(
+            re.match(pattern, request.path_info)
+            for pattern in settings.MIDDLEWARE_FAST_PATH_URLS
+        )
+    return request._fast_path
+
+
+def get_campaign(request):
+    return Campaign.objects.select_related("inventory", "instance").get(
+        name=request.user.current_campaign
+    )
+
+
+def attach_campaign(request):
+    """
+    Set request.campaign to the user's current campaign, loaded from the
+    database the first time it's used. Call this again whenever the user's
+    current campaign changes part way through a request.
+    """
+    request.campaign = SimpleLazyObject(lambda: get_campaign(request))
+
+
+class MetricsMiddleware:
+    """
+    A Middleware class recording how long each request took and how many queries it ran,
+    per view, for the /metrics endpoint.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        start = time.perf_counter()
+        with recording_queries(request) as queries:
+            response = self.get_response(request)
+        duration = time.perf_counter() - start
+        match = request.resolver_match
+        view_name = match.view_name if match is not None else "unresolved"
+        observe("femr_view_duration_seconds", view_name, duration)
+        observe("femr_view_queries", view_name, queries.count)
+        return response
+
+
+class QueryBudgetMiddleware:
+    """
+    A Middleware class logging a warning for each request that runs more queries than its
+    view's budget in settings.QUERY_BUDGETS, along with the queries it repeated.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with recording_queries(request) as recorder:
+            response = self.get_response(request)
+        match = request.resolver_match
+        if match is not None:
+            budget = query_budget(match.view_name)
+            if budget is not None and recorder.count > budget:
+                report_over_budget(request, match.view_name, budget, recorder)
+        return response
+
+
+class CurrentCampaignMiddleware:
+    """
+    A Middleware class providing the current user's campaign as request.campaign, so that
+    views, decorators and other middleware share a single lookup per request.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        attach_campaign(request)
+        return self.get_response(request)
 
 
 class TimezoneMiddleware:
     """
     A Middleware class to handle setting the current timezone to the current campaign's
-    selected timezone. This will also handle initially setting the current session's
-    campaign if it hasn't been set yet.
+    selected timezone, falling back to the one chosen for the session. The campaign's
+    timezone is cached on the session, so this costs no queries once it's been resolved.
     """
 
     def __init__(self, get_response):
         self.get_response = get_response
 
     def __call__(self, request):
-        if request.user.is_authenticated and not AnonymousUser:
-            if request.user.current_campaign == "RECOVERY MODE":
-                try:
-                    request.user.current_campaign = (
-                        request.user.campaigns.filter(active=True).first().name
-                    )
-                    request.user.save()
-                    tzname = Campaign.objects.get(
-                        name=request.user.current_campaign
-                    ).timezone
-                except IndexError:
-                    if request.user.groups.filter(name="fEMR Admin").exists():
-                        request.user.current_campaign = "RECOVERY MODE"
-                        request.user.save()
-                    tzname = request.session.get("django_timezone")
-            else:
-                tzname = Campaign.objects.get(
-                    name=request.user.current_campaign
-                ).timezone
-        else:
+        tzname = None
+        if request.user.is_authenticated and request.user.current_campaign not in (
+            None,
+            "",
+            "RECOVERY MODE",
+        ):
+            tzname = campaign_timezone_name(request)
+        if not tzname:
             tzname = request.session.get("django_timezone")
         if tzname:
-            timezone.activate(pytz.timezone(tzname))
+            timezone.activate(get_timezone(tzname))
         else:
             timezone.deactivate()
         return self.get_response(request)
@@ -54,114 +135,59 @@ class TimezoneMiddleware:
 class CampaignActivityCheckMiddleware:
     """
     Defines middleware to stop non-admin users from logging in if their campaigns are all inactive.
+
+    The user's active campaigns are fetched once and cached on their session, and every
+    outcome is then decided from that list: users whose current campaign isn't active are
+    moved to their first active campaign, admins with none fall back to recovery mode,
+    and anyone else is logged out.
     """
 
     def __init__(self, get_response):
         self.get_response = get_response
 
     def __call__(self, request):
-        is_admin = request.user.groups.filter(name="fEMR Admin").exists()
-        if request.user.is_authenticated:
-            self.__check_valid_campaign(request.user)
-            if not is_admin:
-                return_response = self.__user_not_admin(request)
+        if is_fast_path(request) or not request.user.is_authenticated:
+            return self.get_response(request)
+        active_campaigns = active_campaign_names(request)
+        campaign_name = request.user.current_campaign
+        return_response = None
+        if campaign_name not in active_campaigns:
+            if len(active_campaigns) != 0:
+                self.__switch_campaign(request, active_campaigns[0])
+            elif in_group(request.user, "fEMR Admin"):
+                if campaign_name != "RECOVERY MODE":
+                    self.__switch_campaign(request, "RECOVERY MODE")
+            elif campaign_name is None or campaign_name == "":
+                return_response = self.__logged_out(
+                    request,
+                    "You have no active campaigns. Please contact your "
+                    "administrator to proceed. ",
+                )
             else:
-                return_response = self.__run_if_admin(request, is_admin)
-        else:
+                return_response = self.__logged_out(
+                    request,
+                    "Your active campaign has been deactivated. "
+                    "Please log in again to proceed.",
+                )
+        if return_response is None:
             return_response = self.get_response(request)
         return return_response
 
     @staticmethod
-    def __check_valid_campaign(user):
-        campaigns = user.campaigns.filter(active=True)
-        if user.current_campaign != "RECOVERY_MODE":
-            try:
-                campaigns.get(name=user.current_campaign)
-            except Campaign.DoesNotExist:
-                if len(campaigns) != 0:
-                    user.current_campaign = campaigns.first().name
-                    user.save()
-
-    def __user_not_admin(self, request):
-        campaign_name = request.user.current_campaign
-        if campaign_name is None or campaign_name == "":
-            return_response = self.__campaign_is_none(request)
-            campaign = None
-        else:
-            return_response = self.get_response(request)
-            campaign = Campaign.objects.get(name=campaign_name)
-        if campaign and not campaign.active:
-            return_response = self.__campaign_not_active(request)
-        return return_response
+    def __switch_campaign(request, campaign_name):
+        request.user.current_campaign = campaign_name
+        request.user.save()
+        attach_campaign(request)
 
     @staticmethod
-    def __campaign_not_active(request):
+    def __logged_out(request, error_message):
         logout(request)
-        form = LoginForm()
         return render(
             request,
             "auth/login.html",
-            {
-                "form": form,
-                "error_message": "Your active campaign has been deactivated. "
-                "Please log in again to proceed.",
-            },
+            {"form": LoginForm(), "error_message": error_message},
         )
 
-    def __campaign_is_none(self, request):
-        campaigns = request.user.campaigns.filter(active=True)
-        if len(campaigns) != 0:
-            request.user.current_campaign = campaigns.first().name
-            request.user.save()
-            return_response = self.get_response(request)
-        else:
-            logout(request)
-            return_response = render(
-                request,
-                "auth/login.html",
-                {
-                    "form": LoginForm(),
-                    "error_message": "You have no active campaigns. Please contact your "
-                    "administrator to proceed. ",
-                },
-            )
-        return return_response
-
-    def __run_if_admin(self, request, is_admin):
-        if request.user.is_authenticated and is_admin:
-            campaign_name = request.user.current_campaign
-            if campaign_name is None or campaign_name == "":
-                return_response = self.__campaign_name_is_none(request)
-            elif campaign_name != "RECOVERY MODE":
-                return_response = self.__campaign_not_in_recovery_mode(request)
-            else:
-                return_response = self.get_response(request)
-        else:
-            return_response = self.get_response(request)
-        return return_response
-
-    def __campaign_name_is_none(self, request):
-        if len(request.user.campaigns.filter(active=True)) != 0:
-            request.user.current_campaign = (
-                request.user.campaigns.filter(active=True).first().name
-            )
-        else:
-            request.user.current_campaign = "RECOVERY MODE"
-        request.user.save()
-        return self.get_response(request)
-
-    def __campaign_not_in_recovery_mode(self, request):
-        campaign = Campaign.objects.get(name=request.user.current_campaign)
-        if not campaign.active:
-            if len(request.user.campaigns.filter(active=True)) != 0:
-                request.user.current_campaign = (
-                    request.user.campaigns.filter(active=True).first().name
-                )
-            else:
-                request.user.current_campaign = "RECOVERY MODE"
-            request.user.save()
-        return self.get_response(request)
-
 
 class ClinicMessageMiddleware:
     """
@@ -172,18 +198,19 @@ class ClinicMessageMiddleware:
         self.get_response = get_response
 
     def __call__(self, request):
-        if request.user.is_authenticated:
-            request.message_number = (
-                Message.objects.filter(recipient=request.user)
-                .filter(read=False)
-                .count()
-            )
+        if request.user.is_authenticated and not is_fast_path(request):
+            request.message_number = unread_message_count(request.user)
         return self.get_response(request)
 
 
 class CheckForSessionInvalidatedMiddleware:
     """
     Defines middleware to handle creation of new sessions if the current session is stale.
+
+    Writes are coalesced: the UserSession is only written when the session key changes,
+    when it was last refreshed more than USER_SESSION_REFRESH_INTERVAL seconds ago, or
+    when its row has gone missing in between. That interval has to stay well inside the
+    minute after which reset_sessions clears the UserSession out.
     """
 
     def __init__(self, get_response):
@@ -191,9 +218,24 @@ class CheckForSessionInvalidatedMiddleware:
 
     def __call__(self, request):
         if request.user.is_authenticated:
-            try:
-                request.user.logged_in_user.session_key = request.session.session_key
-                request.user.logged_in_user.save()
-            except fEMRUser.logged_in_user.RelatedObjectDoesNotExist:
-                UserSession.objects.get_or_create(user=request.user)
+            session_key = request.session.session_key
+            refreshed = request.session.get("user_session_refreshed", 0)
+            if (
+                session_key != request.session.get("user_session_key")
+                or time.time() - refreshed >= USER_SESSION_REFRESH_INTERVAL
+                or not UserSession.objects.filter(user=request.user).exists()
+            ):
+                self.__refresh_user_session(request, session_key)
         return self.get_response(request)
+
+    @staticmethod
+    def __refresh_user_session(request, session_key):
+        updated = UserSession.objects.filter(user=request.user).update(
+            session_key=session_key, timestamp=timezone.now()
+        )
+        if not updated:
+            UserSession.objects.get_or_create(
+                user=request.user, defaults={"session_key": session_key}
+            )
+        request.session["user_session_key"] = session_key
+        request.session["user_session_refreshed"] = time.time()
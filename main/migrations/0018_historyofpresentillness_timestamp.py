@@ -0,0 +1,18 @@
+# Generated by Django 3.2.14 on 2026-10-18 09:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("main", "0017_auditentry_system_user_agent"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="historyofpresentillness",
+            name="timestamp",
+            field=models.DateTimeField(auto_now=True, null=True),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 3.2.14 on 2026-10-18 11:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("main", "0018_historyofpresentillness_timestamp"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="csvexport",
+            name="rows_total",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="csvexport",
+            name="rows_done",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        # Exports made before progress was tracked are all finished, but new
+        # ones start out unfinished.
+        migrations.AddField(
+            model_name="csvexport",
+            name="finished",
+            field=models.BooleanField(default=True),
+        ),
+        migrations.AlterField(
+            model_name="csvexport",
+            name="finished",
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name="csvexport",
+            name="checkpoints",
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
@@ -0,0 +1,44 @@
+from django.db import migrations
+
+# Trigram indexes over the same expressions Django's icontains and iexact
+# lookups compare on Postgres, so patient searches can use them.
+PATIENT_SEARCH_INDEXES = {
+    "main_patient_campaign_key_trgm": 'UPPER("campaign_key"::text)',
+    "main_patient_first_name_trgm": 'UPPER("first_name"::text)',
+    "main_patient_last_name_trgm": 'UPPER("last_name"::text)',
+    "main_patient_phone_number_trgm": 'UPPER("phone_number"::text)',
+    "main_patient_email_address_trgm": 'UPPER("email_address"::text)',
+}
+
+
+def create_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    schema_editor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    for name, expression in PATIENT_SEARCH_INDEXES.items():
+        schema_editor.execute(
+            f"CREATE INDEX IF NOT EXISTS {name} ON main_patient "
+            f"USING gin (({expression}) gin_trgm_ops)"
+        )
+    schema_editor.execute(
+        "CREATE INDEX IF NOT EXISTS main_patient_email_address_upper "
+        'ON main_patient (UPPER("email_address"::text))'
+    )
+
+
+def drop_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    for name in [*PATIENT_SEARCH_INDEXES, "main_patient_email_address_upper"]:
+        schema_editor.execute(f"DROP INDEX IF EXISTS {name}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("main", "0019_csvexport_progress"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_indexes, drop_search_indexes),
+    ]
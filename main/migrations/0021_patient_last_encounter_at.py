@@ -0,0 +1,42 @@
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def populate_last_encounter_at(apps, schema_editor):
+    Patient = apps.get_model("main", "Patient")
+    PatientEncounter = apps.get_model("main", "PatientEncounter")
+    Patient.objects.update(
+        last_encounter_at=Subquery(
+            PatientEncounter.objects.filter(patient=OuterRef("pk"))
+            .order_by("-timestamp")
+            .values("timestamp")[:1]
+        )
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("main", "0020_patient_search_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="patient",
+            name="last_encounter_at",
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.RunPython(populate_last_encounter_at, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name="patient",
+            index=models.Index(
+                fields=["-timestamp", "-id"], name="patient_timestamp_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="patient",
+            index=models.Index(
+                fields=["-last_encounter_at", "-id"], name="patient_last_encounter_idx"
+            ),
+        ),
+    ]
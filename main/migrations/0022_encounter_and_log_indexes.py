@@ -0,0 +1,52 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("main", "0021_patient_last_encounter_at"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="patientencounter",
+            index=models.Index(
+                fields=["patient", "-timestamp"], name="encounter_patient_ts_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="patientencounter",
+            index=models.Index(
+                fields=["campaign", "-timestamp"], name="encounter_campaign_ts_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="patientencounter",
+            index=models.Index(
+                condition=models.Q(active=True),
+                fields=["timestamp"],
+                name="encounter_active_ts_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="auditentry",
+            index=models.Index(
+                fields=["campaign", "-timestamp"], name="auditentry_campaign_ts_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="auditentry",
+            index=models.Index(
+                condition=models.Q(action="user_login_failed"),
+                fields=["-timestamp"],
+                name="auditentry_login_failed_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="databasechangelog",
+            index=models.Index(
+                fields=["campaign", "model", "-timestamp"],
+                name="changelog_campaign_ts_idx",
+            ),
+        ),
+    ]
@@ -10,7 +10,8 @@ from django.core.validators import (
     MinLengthValidator,
     MinValueValidator,
 )
-from django.db import models
+from django.db import models, transaction
+from django.db.models.functions import Greatest
 from django.db.models.fields import CharField
 from django.utils import timezone
 from django.utils.deconstruct import deconstructible
@@ -273,9 +274,20 @@ class Patient(models.Model):
     shared_email_address = models.BooleanField()
 
     timestamp = models.DateTimeField(auto_now=True, null=False, blank=False)
+    # When the patient's latest encounter was saved, kept up to date by
+    # PatientEncounter.save so that lists of recent patients needn't join encounters.
+    last_encounter_at = models.DateTimeField(null=True, blank=True, editable=False)
 
     campaign = models.ManyToManyField(Campaign, default=1)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["-timestamp", "-id"], name="patient_timestamp_idx"),
+            models.Index(
+                fields=["-last_encounter_at", "-id"], name="patient_last_encounter_idx"
+            ),
+        ]
+
     def __str__(self):
         """
         Streamlines casting the object to a string.
@@ -374,6 +386,10 @@ class CSVExport(models.Model):
     )
     file = models.FileField(upload_to="export/")
     timestamp = models.DateTimeField(auto_now=True, editable=False)
+    rows_total = models.PositiveIntegerField(default=0)
+    rows_done = models.PositiveIntegerField(default=0)
+    finished = models.BooleanField(default=False)
+    checkpoints = models.JSONField(default=dict, blank=True)
 
 
 class PatientEncounter(models.Model):
@@ -453,16 +469,48 @@ class PatientEncounter(models.Model):
         default=1,
     )
 
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["patient", "-timestamp"], name="encounter_patient_ts_idx"
+            ),
+            models.Index(
+                fields=["campaign", "-timestamp"], name="encounter_campaign_ts_idx"
+            ),
+            # Open encounters by age, for closing expired ones.
+            models.Index(
+                fields=["timestamp"],
+                name="encounter_active_ts_idx",
+                condition=models.Q(active=True),
+            ),
+        ]
+
     # noinspection PyTypeChecker
     def unit_aware_weight(self, unit):
         return self.body_weight if unit == "m" else (float(self.body_weight) * 2.2046)
 
     def save(self, *args, **kwargs):
         self.timestamp = timezone.now()
-        super().save(*args, **kwargs)
+        self.save_no_timestamp(*args, **kwargs)
 
     def save_no_timestamp(self, *args, **kwargs):
-        super().save(*args, **kwargs)
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            self.touch_patient()
+
+    def touch_patient(self):
+        """
+        Move the patient's last_encounter_at, and its timestamp, up to this
+        encounter's timestamp if it's the latest.
+        """
+        if self.patient_id is not None:
+            Patient.objects.filter(pk=self.patient_id).filter(
+                models.Q(last_encounter_at__isnull=True)
+                | models.Q(last_encounter_at__lt=self.timestamp)
+            ).update(
+                last_encounter_at=self.timestamp,
+                timestamp=Greatest("timestamp", models.Value(self.timestamp)),
+            )
 
     def __str__(self):
         """
@@ -491,6 +539,10 @@ class HistoryOfPresentIllness(models.Model):
 
     tests_ordered = models.CharField(max_length=255, null=True, blank=True)
 
+    timestamp = models.DateTimeField(
+        auto_now=True, editable=False, null=True, blank=True
+    )
+
 
 class Vitals(models.Model):
     encounter = models.ForeignKey(
@@ -669,6 +721,19 @@ class AuditEntry(models.Model):
     browser_user_agent = models.CharField(max_length=256, null=True)
     system_user_agent = models.CharField(max_length=256, null=True)
 
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["campaign", "-timestamp"], name="auditentry_campaign_ts_idx"
+            ),
+            # Failed logins have no campaign but appear in every campaign's log.
+            models.Index(
+                fields=["-timestamp"],
+                name="auditentry_login_failed_idx",
+                condition=models.Q(action="user_login_failed"),
+            ),
+        ]
+
     def __str__(self):
         return f"{self.action} - {self.username} - {self.ip} - {self.timestamp} - {self.campaign}"
 
@@ -682,6 +747,14 @@ class DatabaseChangeLog(models.Model):
     timestamp = models.DateTimeField(auto_now=True)
     campaign = models.ForeignKey(Campaign, on_delete=models.CASCADE)
 
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["campaign", "model", "-timestamp"],
+                name="changelog_campaign_ts_idx",
+            ),
+        ]
+
     def __str__(self):
         # pylint: disable=C0301
         return f"{self.action} {self.model} {self.instance} - by {self.ip} at {self.username}, {self.timestamp}"
@@ -7,7 +7,7 @@ from main.models import Campaign, Instance
 @is_org_admin
 @is_authenticated
 def organization_admin_home_view(request):
-    org = Campaign.objects.get(name=request.user.current_campaign).instance.organization
+    org = request.campaign.instance.organization
     instances = []
     campaigns = []
     try:
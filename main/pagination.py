@@ -0,0 +1,193 @@
+"""
+Keyset pagination: each page is fetched by filtering on the sort keys of the
+row it starts after, rather than by counting and offsetting, so every page of a
+list costs the same as the first.
+"""
+import base64
+import datetime
+import json
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Q, QuerySet
+
+
+class KeysetPage:
+    """
+    One page of a KeysetPaginator, iterable like a Django Page. Instead of
+    page numbers it carries the cursors of the pages either side of it.
+    """
+
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+
+class PrimaryKeyList:
+    """
+    A model's rows in an order worked out elsewhere, such as by search rank,
+    held as their primary keys and fetched a page at a time.
+    """
+
+    def __init__(self, model, pks):
+        self.model = model
+        self.pks = list(pks)
+
+    def fetch(self, pks):
+        rows = self.model.objects.in_bulk(pks)
+        return [rows[pk] for pk in pks if pk in rows]
+
+    def __iter__(self):
+        return iter(self.fetch(self.pks))
+
+    def __len__(self):
+        return len(self.pks)
+
+
+class KeysetPaginator:
+    """
+    Paginates a queryset by the keys it's ordered by, with the primary key
+    added as a tie-breaker if the ordering doesn't already include it. Lists
+    are paged through by the primary key of the row each page starts after,
+    and a PrimaryKeyList only fetches the rows of the page asked for.
+    """
+
+    def __init__(self, object_list, per_page):
+        self.object_list = object_list
+        self.per_page = per_page
+        self.ordering = None
+        if isinstance(object_list, QuerySet):
+            self.ordering = list(object_list.query.order_by)
+            if not {"pk", "-pk", "id", "-id"} & set(self.ordering):
+                last = self.ordering[-1] if self.ordering else "id"
+                self.ordering.append("-id" if last.startswith("-") else "id")
+
+    def get_page(self, after=None, before=None):
+        """
+        The page following the after cursor, or the one preceding the before
+        cursor. A missing or malformed cursor gives the first page.
+        """
+        cursor, forward = self.decode_cursor(after), True
+        if cursor is None and before:
+            cursor, forward = self.decode_cursor(before), False
+        if cursor is None:
+            forward = True
+        rows = self.fetch(cursor, forward)
+        more = len(rows) > self.per_page
+        rows = rows[: self.per_page]
+        if not forward:
+            rows.reverse()
+        has_next = more if forward else True
+        has_previous = cursor is not None if forward else more
+        return KeysetPage(
+            rows,
+            next_cursor=self.encode_cursor(rows[-1]) if rows and has_next else None,
+            previous_cursor=self.encode_cursor(rows[0])
+            if rows and has_previous
+            else None,
+        )
+
+    def fetch(self, cursor, forward):
+        if self.ordering is None:
+            return self.fetch_from_list(cursor, forward)
+        ordering = (
+            self.ordering
+            if forward
+            else [
+                name[1:] if name.startswith("-") else f"-{name}"
+                for name in self.ordering
+            ]
+        )
+        queryset = self.object_list.order_by(*ordering)
+        if cursor is not None:
+            queryset = queryset.filter(self.after_filter(ordering, cursor))
+        return list(queryset[: self.per_page + 1])
+
+    def fetch_from_list(self, cursor, forward):
+        if isinstance(self.object_list, PrimaryKeyList):
+            rows = None
+            pks = self.object_list.pks
+        else:
+            rows = list(self.object_list)
+            pks = [row.pk for row in rows]
+        position = None
+        if cursor is not None:
+            position = next(
+                (index for index, pk in enumerate(pks) if pk == cursor[0]), None
+            )
+        if position is None:
+            position = 0 if forward else len(pks)
+        elif forward:
+            position += 1
+        if forward:
+            page = slice(position, position + self.per_page + 1)
+        else:
+            page = slice(max(position - self.per_page - 1, 0), position)
+        page_rows = (
+            rows[page] if rows is not None else self.object_list.fetch(pks[page])
+        )
+        return page_rows if forward else page_rows[::-1]
+
+    @staticmethod
+    def after_filter(ordering, cursor):
+        """
+        Rows sorting after the cursor under ordering: greater on the first key,
+        or equal on it and greater on the next, and so on.
+        """
+        condition = Q()
+        equal = {}
+        for name, value in zip(ordering, cursor):
+            field = name.lstrip("-")
+            lookup = "lt" if name.startswith("-") else "gt"
+            condition |= Q(**equal, **{f"{field}__{lookup}": value})
+            equal[field] = value
+        return condition
+
+    def encode_cursor(self, row):
+        if self.ordering is None:
+            values = [row.pk]
+        else:
+            values = [
+                value.isoformat()
+                if isinstance(value, (datetime.date, datetime.datetime))
+                else value
+                for value in (getattr(row, name.lstrip("-")) for name in self.ordering)
+            ]
+        return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+    def decode_cursor(self, cursor):
+        if not cursor:
+            return None
+        try:
+            values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            if len(values) != (1 if self.ordering is None else len(self.ordering)):
+                return None
+            if self.ordering is None:
+                return values
+            return [
+                self.to_python(name.lstrip("-"), value)
+                for name, value in zip(self.ordering, values)
+            ]
+        except (ValueError, TypeError, ValidationError):
+            return None
+
+    def to_python(self, name, value):
+        model = self.object_list.model
+        try:
+            field = model._meta.pk if name == "pk" else model._meta.get_field(name)
+        except FieldDoesNotExist:
+            # An annotation, such as a search rank.
+            return value
+        return field.to_python(value)
@@ -1,9 +1,8 @@
 from django.shortcuts import render, get_object_or_404
-from silk.profiling.profiler import silk_profile
-from main.decorators import in_recovery_mode, is_authenticated
 
+from main.decorators import in_recovery_mode, is_authenticated
+from main.instrumentation import instrument
 from main.models import (
-    Campaign,
     HistoryOfPresentIllness,
     Patient,
     PatientDiagnosis,
@@ -12,7 +11,7 @@ from main.models import (
 )
 
 
-@silk_profile("patient-export-view-get")
+@instrument("patient-export-view-get")
 def __patient_export_view_get(request, patient_id=None):
     patient = get_object_or_404(Patient, pk=patient_id)
     encounters = patient.patientencounter_set.order_by("-timestamp")
@@ -46,16 +45,14 @@ def __patient_export_view_get(request, patient_id=None):
             "diagnoses": diagnoses,
             "histories_of_present_illness": history_of_present_illness_dictionary,
             "vitals": vitals_dictionary,
-            "telehealth": Campaign.objects.get(
-                name=request.user.current_campaign
-            ).telehealth,
-            "units": Campaign.objects.get(name=request.user.current_campaign).units,
+            "telehealth": request.campaign.telehealth,
+            "units": request.campaign.units,
         },
     )
 
 
 @is_authenticated
 @in_recovery_mode
-@silk_profile("patient-export-view")
+@instrument("patient-export-view")
 def patient_export_view(request, patient_id=None):
     return __patient_export_view_get(request, patient_id)
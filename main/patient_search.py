@@ -0,0 +1,250 @@
+"""
+Patient search over names, phone numbers, email addresses and campaign keys,
+ranked by trigram similarity to the search.
+
+On Postgres, matching runs against the pg_trgm GIN indexes created in
+migration 0020. Elsewhere, each process keeps an n-gram index of every
+campaign's patients it has searched, rebuilt when the version counter kept for
+the campaign in the cache moves on, which happens whenever one of its patients
+changes.
+"""
+import re
+import time
+
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Q, Value
+from django.db.models.functions import Concat, Greatest
+
+from main.models import Patient
+from main.pagination import PrimaryKeyList
+
+# Longest n-gram kept by the in-process index. Searches longer than this are
+# matched by intersecting the postings of their n-grams.
+NGRAM_LENGTH = 3
+
+
+def phone_number_variant(query):
+    """
+    A ten digit search formatted the way phone numbers are stored.
+    """
+    if len(query) != 10:
+        return_response = query
+    else:
+        return_response = f"({query[0:3]}){query[3:6]}-{query[6:10]}"
+    return return_response
+
+
+def trigrams(value):
+    """
+    The trigrams of value as pg_trgm counts them: per lowercased word, padded
+    with two spaces in front and one behind.
+    """
+    grams = set()
+    for word in re.findall(r"[^\W_]+", value.lower()):
+        padded = f"  {word} "
+        grams.update(padded[i : i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+def similarity(first, second):
+    """
+    pg_trgm's similarity() of two strings.
+    """
+    first_grams, second_grams = trigrams(first), trigrams(second)
+    if not first_grams or not second_grams:
+        return 0.0
+    return len(first_grams & second_grams) / len(first_grams | second_grams)
+
+
+def patient_search_version_key(campaign_pk):
+    return f"patient-search-version-{campaign_pk}"
+
+
+def new_patient_search_version():
+    """
+    A starting version for a counter that's missing from the cache, unlikely to
+    match one a process has kept from before the counter was evicted.
+    """
+    return int(time.time() * 1000)
+
+
+def invalidate_patient_search(campaign_pk):
+    key = patient_search_version_key(campaign_pk)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, new_patient_search_version(), None)
+
+
+class PostgresPatientSearch:
+    """
+    Matches with the same icontains lookups the patient list always used,
+    which the UPPER(...) gin_trgm_ops indexes answer without a sequential scan,
+    and ranks with pg_trgm's similarity().
+    """
+
+    @staticmethod
+    def search_filter(query):
+        name_terms = Q()
+        for term in query.split():
+            name_terms |= Q(first_name__icontains=term) | Q(last_name__icontains=term)
+        return (
+            Q(campaign_key__icontains=query)
+            | Q(first_name__icontains=query)
+            | Q(last_name__icontains=query)
+            | Q(phone_number__icontains=query)
+            | Q(phone_number__icontains=phone_number_variant(query))
+            | Q(email_address__iexact=query)
+            | name_terms
+        )
+
+    def search(self, campaign, query):
+        # pylint: disable=C0415
+        from django.contrib.postgres.search import TrigramSimilarity
+
+        return (
+            Patient.objects.filter(campaign=campaign)
+            .filter(self.search_filter(query))
+            .annotate(
+                rank=Greatest(
+                    TrigramSimilarity("first_name", query),
+                    TrigramSimilarity("last_name", query),
+                    TrigramSimilarity(
+                        Concat("first_name", Value(" "), "last_name"), query
+                    ),
+                )
+            )
+            .order_by("-rank", "-timestamp")
+        )
+
+
+class NgramIndex:
+    """
+    An in-memory inverted index from every n-gram of up to NGRAM_LENGTH
+    characters to the patients with a searchable field containing it.
+    """
+
+    def __init__(self, rows):
+        self.documents = {}
+        self.postings = {}
+        for pk, *fields in rows:
+            document = tuple(
+                "" if value is None else str(value).lower() for value in fields
+            )
+            self.documents[pk] = document
+            for value in document:
+                for length in range(1, NGRAM_LENGTH + 1):
+                    for start in range(len(value) - length + 1):
+                        self.postings.setdefault(
+                            value[start : start + length], set()
+                        ).add(pk)
+
+    def containing(self, needle):
+        """
+        The patients with a field that may contain needle, to be checked
+        against their documents.
+        """
+        if len(needle) <= NGRAM_LENGTH:
+            return self.postings.get(needle, set())
+        postings = [
+            self.postings.get(needle[start : start + NGRAM_LENGTH], set())
+            for start in range(len(needle) - NGRAM_LENGTH + 1)
+        ]
+        return set.intersection(*sorted(postings, key=len))
+
+
+class NgramPatientSearch:
+    """
+    Matches the same fields as the Postgres search from an in-process n-gram
+    index per campaign, for databases without pg_trgm.
+    """
+
+    # Order of the searchable fields in each indexed document.
+    FIELDS = (
+        "campaign_key",
+        "first_name",
+        "last_name",
+        "phone_number",
+        "email_address",
+    )
+
+    def __init__(self):
+        self.indexes = {}
+
+    def get_index(self, campaign):
+        key = patient_search_version_key(campaign.pk)
+        version = cache.get(key)
+        if version is None:
+            cache.add(key, new_patient_search_version(), None)
+            version = cache.get(key)
+        cached = self.indexes.get(campaign.pk)
+        if version is not None and cached is not None and cached[0] == version:
+            return cached[1]
+        index = NgramIndex(
+            Patient.objects.filter(campaign=campaign).values_list("pk", *self.FIELDS)
+        )
+        if version is not None:
+            self.indexes[campaign.pk] = (version, index)
+        return index
+
+    @staticmethod
+    def matches(document, query, terms):
+        campaign_key, first_name, last_name, phone_number, email_address = document
+        return (
+            query in campaign_key
+            or query in first_name
+            or query in last_name
+            or query in phone_number
+            or phone_number_variant(query) in phone_number
+            or query == email_address
+            or any(term in first_name or term in last_name for term in terms)
+        )
+
+    @staticmethod
+    def rank(document, query):
+        first_name, last_name = document[1], document[2]
+        return max(
+            similarity(first_name, query),
+            similarity(last_name, query),
+            similarity(f"{first_name} {last_name}", query),
+        )
+
+    def search(self, campaign, query):
+        """
+        The matching patients as a PrimaryKeyList, ranked from the index, so
+        only the page shown is loaded.
+        """
+        query = query.lower()
+        if not query:
+            return Patient.objects.filter(campaign=campaign).order_by("-timestamp")
+        index = self.get_index(campaign)
+        terms = query.split()
+        candidates = index.containing(query) | index.containing(
+            phone_number_variant(query)
+        )
+        for term in terms:
+            candidates |= index.containing(term)
+        matched = [
+            pk for pk in candidates if self.matches(index.documents[pk], query, terms)
+        ]
+        pks = list(
+            Patient.objects.filter(pk__in=matched)
+            .order_by("-timestamp")
+            .values_list("pk", flat=True)
+        )
+        pks.sort(key=lambda pk: self.rank(index.documents[pk], query), reverse=True)
+        return PrimaryKeyList(Patient, pks)
+
+
+ngram_patient_search = NgramPatientSearch()
+
+
+def search_patients(campaign, query):
+    """
+    The campaign's patients matching query, best match first, most recently
+    updated first among equals.
+    """
+    if connection.vendor == "postgresql":
+        return PostgresPatientSearch().search(campaign, query)
+    return ngram_patient_search.search(campaign, query)
@@ -1,9 +1,9 @@
 import os
 
 from django.shortcuts import render, get_object_or_404
-from silk.profiling.profiler import silk_profile
-from main.decorators import in_recovery_mode, is_authenticated
 
+from main.decorators import in_recovery_mode, is_authenticated
+from main.instrumentation import instrument
 from main.serializers import PatientEncounterSerializer
 from main.femr_admin_views import get_client_ip
 from main.qldb_interface import update_patient_encounter
@@ -12,7 +12,6 @@ from main.forms import (
     VitalsForm,
 )
 from main.models import (
-    Campaign,
     Patient,
     PatientEncounter,
     DatabaseChangeLog,
@@ -24,9 +23,9 @@ from main.models import (
 
 @is_authenticated
 @in_recovery_mode
-@silk_profile("upload-photo-view")
+@instrument("upload-photo-view")
 def upload_photo_view(request, patient_id=None, encounter_id=None):
-    units = Campaign.objects.get(name=request.user.current_campaign).units
+    units = request.campaign.units
     encounter = get_object_or_404(PatientEncounter, pk=encounter_id)
     patient = get_object_or_404(Patient, pk=patient_id)
     vitals = Vitals.objects.filter(encounter=encounter)
@@ -69,7 +68,7 @@ def __upload_photo_view_post(request, encounter):
             instance=str(encounter),
             ip=get_client_ip(request),
             username=request.user.username,
-            campaign=Campaign.objects.get(name=request.user.current_campaign),
+            campaign=request.campaign,
         )
         if os.environ.get("QLDB_ENABLED") == "TRUE":
             encounter_data = PatientEncounterSerializer(encounter).data
@@ -77,9 +76,9 @@ def __upload_photo_view_post(request, encounter):
     return aux_form
 
 
-@silk_profile("edit-photo-view-post")
+@instrument("edit-photo-view-post")
 def __edit_photo_view_post(request, patient_id, encounter_id, photo_id):
-    units = Campaign.objects.get(name=request.user.current_campaign).units
+    units = request.campaign.units
     encounter = get_object_or_404(PatientEncounter, pk=encounter_id)
     patient = get_object_or_404(Patient, pk=patient_id)
     photo = Photo.objects.get(pk=photo_id)
@@ -96,7 +95,7 @@ def __edit_photo_view_post(request, patient_id, encounter_id, photo_id):
             instance=str(photo),
             ip=get_client_ip(request),
             username=request.user.username,
-            campaign=Campaign.objects.get(name=request.user.current_campaign),
+            campaign=request.campaign,
         )
         if os.environ.get("QLDB_ENABLED") == "TRUE":
             encounter_data = PatientEncounterSerializer(encounter).data
@@ -124,7 +123,7 @@ def __edit_photo_view_post(request, patient_id, encounter_id, photo_id):
 
 @is_authenticated
 @in_recovery_mode
-@silk_profile("edit-profile-view")
+@instrument("edit-profile-view")
 def edit_photo_view(request, patient_id=None, encounter_id=None, photo_id=None):
     if request.method == "POST":
         return_response = __edit_photo_view_post(
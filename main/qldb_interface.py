@@ -4,7 +4,8 @@ Application-wide functions for interfacing with AWS QLDB.
 import os
 
 from pyqldb.driver.qldb_driver import QldbDriver
-from silk.profiling.profiler import silk_profile
+
+from main.instrumentation import instrument
 
 try:
     LEDGER_NAME = os.environ["qldb_name"]
@@ -13,7 +14,7 @@ except KeyError:
 
 
 # noinspection PyTypeChecker
-@silk_profile("create-tables")
+@instrument("create-tables")
 def create_tables():
     def create_patient_table(transaction_executor):
         statement = "CREATE TABLE Patient"
@@ -33,7 +34,7 @@ def create_tables():
 
 
 # noinspection PyTypeChecker
-@silk_profile("create-new-patient")
+@instrument("create-new-patient")
 def create_new_patient(patient: dict):
     """
     Create a new, blank patient record.
@@ -53,7 +54,7 @@ def create_new_patient(patient: dict):
 
 
 # noinspection PyTypeChecker
-@silk_profile("update-patient")
+@instrument("update-patient")
 def update_patient(patient: dict):
     """
     Update a patient with the provided dataset.
@@ -73,7 +74,7 @@ def update_patient(patient: dict):
 
 
 # noinspection PyTypeChecker
-@silk_profile("get-all-patients")
+@instrument("get-all-patients")
 def get_all_patients():
     """
     Retrieve all patient data
@@ -92,7 +93,7 @@ def get_all_patients():
 
 
 # noinspection PyTypeChecker
-@silk_profile("create-new-patient-encounter")
+@instrument("create-new-patient-encounter")
 def create_new_patient_encounter(patient_encounter: dict):
     """
     Create a new, blank patient record.
@@ -113,7 +114,7 @@ def create_new_patient_encounter(patient_encounter: dict):
 
 
 # noinspection PyTypeChecker
-@silk_profile("update-patient-encounter")
+@instrument("update-patient-encounter")
 def update_patient_encounter(patient_encounter: dict):
     def insert_documents(transaction_executor, payload: dict):
         transaction_executor.execute_statement(
@@ -127,7 +128,7 @@ def update_patient_encounter(patient_encounter: dict):
 
 
 # noinspection PyTypeChecker
-@silk_profile("get-all-patient-encounters")
+@instrument("get-all-patient-encounters")
 def get_all_patient_encounters():
     """
     Retrieve all patient data
@@ -0,0 +1,118 @@
+"""
+Query budgets: the most database queries a single request to a view should
+run, declared per URL name in settings.QUERY_BUDGETS, with
+settings.QUERY_BUDGET_DEFAULT covering every other view.
+
+QueryBudgetMiddleware logs requests that go over budget, and tests can hold a
+view to its budget with `with assert_query_budget("main:home"):`.
+"""
+import json
+import logging
+import re
+from collections import Counter
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connection
+
+logger = logging.getLogger("femr.query_budget")
+
+# A parenthesized list of placeholders, such as the parameters of an IN list,
+# which varies in length with the values queried.
+PLACEHOLDER_LIST = re.compile(r"\(%s(?:\s*,\s*%s)*\)")
+
+
+def query_budget(view_name):
+    """
+    The query budget of view_name, or settings.QUERY_BUDGET_DEFAULT if it has
+    none of its own.
+    """
+    return settings.QUERY_BUDGETS.get(view_name, settings.QUERY_BUDGET_DEFAULT)
+
+
+def normalize_statement(sql):
+    """
+    sql with its placeholder lists collapsed, so queries differing only in how
+    many values they're given count as the same statement.
+    """
+    return PLACEHOLDER_LIST.sub("(%s, ...)", sql)
+
+
+def repeated_queries(statements, limit=3):
+    """
+    The statements run more than once, most repeated first, which is where an
+    N+1 pattern shows up.
+    """
+    return [
+        {"sql": sql, "count": count}
+        for sql, count in statements.most_common(limit)
+        if count > 1
+    ]
+
+
+def report_over_budget(request, view_name, budget, recorder):
+    logger.warning(
+        json.dumps(
+            {
+                "event": "query_budget_exceeded",
+                "view": view_name,
+                "method": request.method,
+                "path": request.path,
+                "queries": recorder.count,
+                "budget": budget,
+                "repeated": repeated_queries(recorder.statements),
+            }
+        )
+    )
+
+
+class QueryRecorder:
+    """
+    A database execute wrapper counting the queries run through it, by
+    normalized statement. A request repeating one query keeps a single entry.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.statements = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        self.statements[normalize_statement(sql)] += 1
+        return execute(sql, params, many, context)
+
+
+@contextmanager
+def recording_queries(request):
+    """
+    Record the queries run while handling request. Every middleware asking
+    for them shares the first one's recorder, so each query goes through a
+    single execute wrapper.
+    """
+    recorder = getattr(request, "query_recorder", None)
+    if recorder is not None:
+        yield recorder
+        return
+    recorder = QueryRecorder()
+    request.query_recorder = recorder
+    try:
+        with connection.execute_wrapper(recorder):
+            yield recorder
+    finally:
+        del request.query_recorder
+
+
+@contextmanager
+def assert_query_budget(view_name):
+    """
+    Fail if the enclosed block runs more queries than view_name's budget.
+    """
+    budget = query_budget(view_name)
+    recorder = QueryRecorder()
+    with connection.execute_wrapper(recorder):
+        yield recorder
+    if budget is not None and recorder.count > budget:
+        raise AssertionError(
+            f"{view_name} ran {recorder.count} queries, over its budget of {budget}. "
+            f"Most repeated: {json.dumps(repeated_queries(recorder.statements), indent=2)}"
+        )
@@ -1,15 +1,43 @@
 from django.conf import settings
+from celery.signals import task_postrun, task_prerun
 from django.contrib.auth import user_logged_in, user_logged_out
 from django.contrib.auth.models import Group
-from django.db.models.signals import post_save
+from django.db.models.signals import (
+    m2m_changed,
+    post_delete,
+    post_init,
+    post_save,
+    pre_delete,
+)
+from django.db.models import Subquery
 from django.dispatch import receiver
+from django.utils import timezone
 from rest_framework.authtoken.models import Token
 from app_mr.models import SupportTicket
 from app_mr.signals import ticket_activity
 from clinic_messages.models import Message
 
+from main.campaign_access import invalidate_campaign_access
+from main.csvio.formulary_export import invalidate_formulary
 from main.femr_admin_views import get_client_ip
-from main.models import Campaign, AuditEntry, fEMRUser
+from main.metrics import task_finished, task_started
+from main.models import (
+    Campaign,
+    AuditEntry,
+    Inventory,
+    InventoryEntry,
+    Patient,
+    PatientEncounter,
+    Treatment,
+    fEMRUser,
+)
+from main.patient_search import invalidate_patient_search
+from main.unread_messages import (
+    adjust_unread_message_count,
+    forget_unread_message_count,
+)
+from main.user_groups import invalidate_user_groups
+from main.vocabulary import VOCABULARIES, invalidate_vocabulary
 
 
 @receiver(user_logged_in)
@@ -80,3 +108,168 @@ def handle_ticket_activity(sender, ticket, **kwargs):
             sender=fEMRUser.objects.get(username="admin"),
             recipient=user,
         )
+
+
+@receiver(post_save, sender=InventoryEntry)
+@receiver(pre_delete, sender=InventoryEntry)
+def invalidate_entry_formularies(sender, instance, **kwargs):
+    """
+    Drop the cached formulary of every inventory holding the saved or
+    deleted entry.
+    """
+    for inventory_id in instance.inventory_set.values_list("pk", flat=True):
+        invalidate_formulary(inventory_id)
+
+
+@receiver(m2m_changed, sender=Inventory.entries.through)
+def invalidate_changed_formularies(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Drop the cached formulary of every inventory that gained or lost entries.
+    """
+    if not reverse and action in ("post_add", "post_remove", "post_clear"):
+        invalidate_formulary(instance.pk)
+    elif reverse and action in ("post_add", "post_remove"):
+        for inventory_id in pk_set:
+            invalidate_formulary(inventory_id)
+    elif reverse and action == "pre_clear":
+        invalidate_entry_formularies(sender, instance)
+
+
+@receiver(m2m_changed, sender=Treatment.medication.through)
+def touch_changed_treatments(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Move the timestamp of every treatment whose medications changed, so that
+    its encounter's cached export row is rendered again.
+    """
+    if not reverse and action in ("post_add", "post_remove", "post_clear"):
+        treatments = Treatment.objects.filter(pk=instance.pk)
+    elif reverse and action in ("post_add", "post_remove"):
+        treatments = Treatment.objects.filter(pk__in=pk_set)
+    elif reverse and action == "pre_clear":
+        treatments = instance.treatment_set.all()
+    else:
+        return
+    treatments.update(timestamp=timezone.now())
+
+
+@receiver(m2m_changed, sender=fEMRUser.groups.through)
+def invalidate_changed_user_groups(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Drop the cached group snapshot of every user whose groups changed.
+    """
+    if not reverse and action in ("post_add", "post_remove", "post_clear"):
+        invalidate_user_groups([instance.pk])
+    elif reverse and action in ("post_add", "post_remove"):
+        invalidate_user_groups(pk_set)
+    elif reverse and action == "pre_clear":
+        invalidate_user_groups(instance.user_set.values_list("pk", flat=True))
+
+
+@receiver(post_save, sender=Campaign)
+@receiver(post_delete, sender=Campaign)
+def invalidate_campaign_changes(sender, **kwargs):
+    """
+    Make every session refetch its active campaigns and campaign timezone after a
+    campaign changes.
+    """
+    invalidate_campaign_access()
+
+
+@receiver(m2m_changed, sender=fEMRUser.campaigns.through)
+def invalidate_changed_user_campaigns(sender, action, **kwargs):
+    if action in ("post_add", "post_remove", "post_clear"):
+        invalidate_campaign_access()
+
+
+@receiver(post_save, sender=Patient)
+@receiver(pre_delete, sender=Patient)
+def invalidate_patient_changes(sender, instance, **kwargs):
+    """
+    Rebuild the in-process search indexes of every campaign holding the saved
+    or deleted patient.
+    """
+    for campaign_id in instance.campaign.values_list("pk", flat=True):
+        invalidate_patient_search(campaign_id)
+
+
+@receiver(m2m_changed, sender=Patient.campaign.through)
+def invalidate_changed_patient_campaigns(
+    sender, instance, action, reverse, pk_set, **kwargs
+):
+    """
+    Rebuild the in-process search indexes of every campaign that gained or
+    lost patients.
+    """
+    if not reverse and action in ("post_add", "post_remove"):
+        for campaign_id in pk_set:
+            invalidate_patient_search(campaign_id)
+    elif not reverse and action == "pre_clear":
+        invalidate_patient_changes(sender, instance)
+    elif reverse and action in ("post_add", "post_remove", "post_clear"):
+        invalidate_patient_search(instance.pk)
+
+
+@receiver(post_save)
+@receiver(post_delete)
+def invalidate_vocabulary_changes(sender, **kwargs):
+    """
+    Rebuild in-process autocomplete vocabularies after one of their rows changes.
+    """
+    if sender in VOCABULARIES:
+        invalidate_vocabulary(sender)
+
+
+@receiver(post_delete, sender=PatientEncounter)
+def recalculate_last_encounter(sender, instance, **kwargs):
+    """
+    Move the patient's last_encounter_at back to its latest remaining encounter.
+    """
+    if instance.patient_id is not None:
+        Patient.objects.filter(pk=instance.patient_id).update(
+            last_encounter_at=Subquery(
+                PatientEncounter.objects.filter(patient_id=instance.patient_id)
+                .order_by("-timestamp")
+                .values("timestamp")[:1]
+            )
+        )
+
+
+@receiver(post_init, sender=Message)
+def remember_message_read_state(sender, instance, **kwargs):
+    """
+    Note whether a message was unread when it was loaded, so saving it needs no
+    query to tell whether it has just been read. Messages loaded without their
+    read field make their recipient's counter be recounted when they're saved.
+    """
+    if "read" in instance.__dict__:
+        instance._was_unread = instance.pk is not None and not instance.read
+
+
+@receiver(post_save, sender=Message)
+def count_unread_message_changes(sender, instance, created, **kwargs):
+    """
+    Keep the recipient's unread counter in step as messages are sent and read.
+    """
+    is_unread = not instance.read
+    was_unread = False if created else getattr(instance, "_was_unread", None)
+    if was_unread is None:
+        forget_unread_message_count(instance.recipient_id)
+    elif is_unread != was_unread:
+        adjust_unread_message_count(instance.recipient_id, 1 if is_unread else -1)
+    instance._was_unread = is_unread
+
+
+@receiver(post_delete, sender=Message)
+def count_deleted_unread_message(sender, instance, **kwargs):
+    if not instance.read:
+        adjust_unread_message_count(instance.recipient_id, -1)
+
+
+@receiver(task_prerun)
+def start_task_timer(sender, task_id, **kwargs):
+    task_started(task_id)
+
+
+@receiver(task_postrun)
+def record_task_duration(sender, task_id, task, **kwargs):
+    task_finished(task_id, task.name)
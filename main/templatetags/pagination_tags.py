@@ -0,0 +1,18 @@
+from django import template
+
+register = template.Library()
+
+
+@register.simple_tag(takes_context=True)
+def page_url(context, direction=None, cursor=None):
+    """
+    The current URL's query string with its page cursor swapped for cursor,
+    or dropped to link to the first page.
+    """
+    query = context["request"].GET.copy()
+    query.pop("after", None)
+    query.pop("before", None)
+    query.pop("page", None)
+    if direction is not None:
+        query[direction] = cursor
+    return f"?{query.urlencode()}"
@@ -97,7 +97,7 @@ def complaint_as_string(item):
 @register.filter("get_campaign_info")
 def get_campaign_info(item):
     result = ""
-    for element in item.campaign.all().iterator():
+    for element in item.campaign.all():
         result += str(element) + ", "
     return result
 
@@ -105,7 +105,7 @@ def get_campaign_info(item):
 @register.filter("get_medications")
 def get_medications(treatment):
     result = ""
-    for element in treatment.medication.all().iterator():
+    for element in treatment.medication.all():
         result += str(element)
     return result
 
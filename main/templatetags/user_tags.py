@@ -9,6 +9,7 @@ from django import template
 from main.background_tasks import check_admin_permission
 
 from main.models import Campaign, fEMRUser
+from main.user_groups import in_group, user_group_names
 
 # Stdlib imports
 
@@ -22,7 +23,7 @@ register = template.Library()
 
 @register.filter("has_group")
 def has_group(user: fEMRUser, group_name: str) -> bool:
-    return user.groups.filter(name=group_name).exists()
+    return in_group(user, group_name)
 
 
 @register.filter("has_campaign")
@@ -31,13 +32,15 @@ def has_campaign(user: fEMRUser, campaign_name: str) -> bool:
 
 
 @register.filter("campaign_active")
-def campaign_active(campaign_name: str) -> bool:
-    return Campaign.objects.get(name=campaign_name).active
+def campaign_active(campaign) -> bool:
+    if isinstance(campaign, Campaign):
+        return campaign.active
+    return Campaign.objects.get(name=campaign).active
 
 
 @register.filter("has_any_group")
 def has_any_group(user: fEMRUser) -> bool:
-    return user.groups.all().exists()
+    return bool(user_group_names(user))
 
 
 @register.filter("has_admin_group")
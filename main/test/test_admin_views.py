@@ -269,6 +269,50 @@ def test_filter_audit_logs_view():
     assert return_response.status_code == 200
 
 
+def test_audit_and_database_log_views_are_paginated():
+    u = fEMRUser.objects.create_user(
+        username="testlogpagination",
+        password="testingpassword",
+        email="testlogpagination@email.com",
+    )
+    u.change_password = False
+    Group.objects.get_or_create(name="fEMR Admin")[0].user_set.add(u)
+    c = baker.make("main.Campaign")
+    c.active = True
+    c.save()
+    u.campaigns.add(c)
+    u.save()
+    baker.make("main.AuditEntry", campaign=c, _quantity=60)
+    baker.make("main.DatabaseChangeLog", campaign=c, model="Patient", _quantity=60)
+    client = Client()
+    client.post(
+        "/login_view/",
+        {"username": "testlogpagination", "password": "testingpassword"},
+    )
+    filters = {
+        "filter_list": "6",
+        "date_filter_day": "",
+        "date_filter_start": "",
+        "date_filter_end": "",
+    }
+    for path, name in (
+        ("/filter_audit_logs_view/", "log"),
+        ("/search_audit_logs_view/", "log"),
+        ("/filter_database_logs_view/", "list_view"),
+        ("/search_database_logs_view/", "list_view"),
+    ):
+        page = client.get(path, filters).context[name]
+        assert len(page) == 50
+        assert page.has_next()
+        # The login's own audit entry, and failed logins left by other tests,
+        # are listed too.
+        rest = client.get(path, {**filters, "after": page.next_cursor}).context[name]
+        assert len(rest) >= 10
+        assert not {row.pk for row in page} & {row.pk for row in rest}
+    u.delete()
+    c.delete()
+
+
 def test_add_users_to_campaign_view():
     u = fEMRUser.objects.create_user(
         username="testadduserstocampainview",
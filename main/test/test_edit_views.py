@@ -3,6 +3,7 @@ from django.test.client import Client
 from model_bakery import baker
 
 from main.models import fEMRUser
+from main.query_budget import assert_query_budget
 
 
 def test_new_diagnosis_view():
@@ -65,3 +66,41 @@ def test_new_diagnosis_view():
     a.delete()
     m.delete()
     assert return_response.status_code == 200
+
+
+def test_encounter_edit_form_query_budget():
+    u = fEMRUser.objects.create_user(
+        username="testencounterbudget",
+        password="testingpassword",
+        email="testencounterbudget@email.com",
+    )
+    u.change_password = False
+    c = baker.make("main.Campaign")
+    u.campaigns.add(c)
+    u.save()
+    p = baker.make("main.Patient")
+    e = baker.make("main.PatientEncounter", patient=p, campaign=c)
+    baker.make("main.Vitals", encounter=e, _quantity=3)
+    medications = baker.make("main.InventoryEntry", _quantity=2)
+    # Enough treatments that a query for each one's relations shows as overrun.
+    for treatment in baker.make(
+        "main.Treatment",
+        encounter=e,
+        prescriber=u,
+        _fill_optional=["diagnosis", "administration_schedule"],
+        _quantity=10,
+    ):
+        treatment.medication.set(medications)
+    client = Client()
+    client.post(
+        "/login_view/",
+        {"username": "testencounterbudget", "password": "testingpassword"},
+    )
+    with assert_query_budget("main:encounter_edit_form_view"):
+        return_response = client.get(f"/encounter_edit_form_view/{p.id}/{e.id}")
+    assert return_response.status_code == 200
+    u.delete()
+    p.delete()
+    c.delete()
+    for medication in medications:
+        medication.delete()
@@ -0,0 +1,17 @@
+from main.management.commands.explainqueries import sequential_scans
+
+
+def test_sequential_scans():
+    postgres_plan = (
+        "Sort  (cost=10.1..10.2 rows=1 width=8)\n"
+        "  ->  Seq Scan on main_auditentry  (cost=0.00..10.0 rows=1 width=8)\n"
+        "  ->  Index Scan using encounter_patient_ts_idx on main_patientencounter"
+    )
+    assert sequential_scans(postgres_plan, "postgresql") == ["main_auditentry"]
+    sqlite_plan = (
+        "3 0 0 SCAN main_databasechangelog\n"
+        "5 0 0 SCAN main_patient USING INDEX patient_timestamp_idx\n"
+        "7 0 0 SEARCH main_patientencounter USING INDEX encounter_active_ts_idx"
+    )
+    assert sequential_scans(sqlite_plan, "sqlite") == ["main_databasechangelog"]
+    assert sequential_scans(sqlite_plan, "mysql") == []
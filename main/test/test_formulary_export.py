@@ -0,0 +1,32 @@
+from django.core.cache import cache
+from django.test.utils import override_settings
+
+from main.csvio.formulary_export import (
+    formulary_cache_key,
+    formulary_version_key,
+    invalidate_formulary,
+)
+
+
+@override_settings(
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+)
+def test_formulary_version_restarts_from_the_clock():
+    first = formulary_cache_key(1)
+    assert formulary_cache_key(1) == first
+    invalidate_formulary(1)
+    assert formulary_cache_key(1) != first
+    # A counter evicted after reaching 2 must not restart at 1 or 2, where
+    # formularies may still be cached.
+    cache.set(formulary_version_key(1), 2, None)
+    cache.delete(formulary_version_key(1))
+    invalidate_formulary(1)
+    assert formulary_cache_key(1) not in (
+        "formulary-export-1-1",
+        "formulary-export-1-2",
+    )
+    cache.delete(formulary_version_key(1))
+    assert formulary_cache_key(1) not in (
+        "formulary-export-1-1",
+        "formulary-export-1-2",
+    )
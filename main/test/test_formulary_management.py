@@ -100,3 +100,32 @@ def test_post_edit_supply_view():
     assert return_response.status_code == 200
     u.delete()
     c.delete()
+
+
+def test_csv_export_view():
+    fEMRUser.objects.all().delete()
+    u = fEMRUser.objects.create_user(
+        username="test",
+        password="testingpassword",
+        email="logintestinguseremail@email.com",
+    )
+    u.change_password = False
+    Group.objects.get_or_create(name="fEMR Admin")[0].user_set.add(u)
+    c = baker.make("main.Campaign")
+    c.active = True
+    c.save()
+    u.campaigns.add(c)
+    u.save()
+    item = baker.make("main.InventoryEntry", _fill_optional=["category"])
+    c.inventory.entries.add(item)
+    client = Client()
+    return_response = client.post(
+        "/login_view/", {"username": "test", "password": "testingpassword"}
+    )
+    return_response = client.get("/csv_export_view/")
+    assert return_response.status_code == 200
+    rows = b"".join(return_response.streaming_content).decode("utf-8").splitlines()
+    assert rows[0].startswith("Category,Medication,Form")
+    assert rows[1].startswith(f"{item.category},{item.medication},{item.form}")
+    u.delete()
+    c.delete()
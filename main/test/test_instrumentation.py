@@ -0,0 +1,31 @@
+from django.test.utils import override_settings
+
+from main.instrumentation import instrument, span
+from main.metrics import metrics_buffer, render_histograms
+
+
+@override_settings(
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}},
+    INSTRUMENTATION_DEFAULT_SAMPLE_RATE=1.0,
+    INSTRUMENTATION_SAMPLE_RATES={"never-sampled": 0.0},
+    INSTRUMENTATION_EXPORTERS=["main.instrumentation.PrometheusExporter"],
+)
+def test_instrumented_spans_are_exported():
+    @instrument("test-span")
+    def add(first, second):
+        return first + second
+
+    @instrument("never-sampled")
+    def noop():
+        return None
+
+    assert add.__name__ == "add"
+    assert add(1, 2) == 3
+    with span("test-span"):
+        pass
+    noop()
+    metrics_buffer.flush()
+    text = "\n".join(render_histograms())
+    assert 'femr_span_duration_seconds_count{span="test-span"} 2' in text
+    assert 'femr_span_duration_seconds_bucket{span="test-span",le="+Inf"} 2' in text
+    assert "never-sampled" not in text
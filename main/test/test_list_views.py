@@ -1,6 +1,7 @@
 from django.test.client import Client
 from model_bakery import baker
 from main.models import fEMRUser
+from main.query_budget import assert_query_budget
 
 
 def test_patient_list_view():
@@ -20,3 +21,48 @@ def test_patient_list_view():
     return_response = client.post("/patient_list_view/")
     u.delete()
     assert return_response.status_code == 200
+
+
+def test_patient_list_query_budgets():
+    u = fEMRUser.objects.create_user(
+        username="testlistbudget",
+        password="testingpassword",
+        email="testlistbudget@email.com",
+    )
+    u.change_password = False
+    c = baker.make("main.Campaign")
+    c.active = True
+    c.save()
+    u.campaigns.add(c)
+    u.save()
+    # More than a page of patients, so a query per patient shows as overrun.
+    patients = baker.make("main.Patient", first_name="Budget", _quantity=25)
+    for patient in patients:
+        patient.campaign.add(c)
+        baker.make("main.PatientEncounter", patient=patient, campaign=c)
+    client = Client()
+    client.post(
+        "/login_view/", {"username": "testlistbudget", "password": "testingpassword"}
+    )
+    with assert_query_budget("main:patient_list_view"):
+        assert client.get("/patient_list_view/").status_code == 200
+    with assert_query_budget("main:filter_patient_list_view"):
+        return_response = client.get(
+            "/filter_patient_list_view/",
+            {
+                "filter_list": "6",
+                "date_filter_day": "",
+                "date_filter_start": "",
+                "date_filter_end": "",
+            },
+        )
+        assert return_response.status_code == 200
+    with assert_query_budget("main:search_patient_list_view"):
+        return_response = client.get(
+            "/search_patient_list_view/", {"name_search": "Budget"}
+        )
+        assert return_response.status_code == 200
+    for patient in patients:
+        patient.delete()
+    u.delete()
+    c.delete()
@@ -0,0 +1,325 @@
+import logging
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.contrib.sessions.backends.db import SessionStore
+from django.db import connection
+from django.test.client import Client, RequestFactory
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import resolve
+from django.utils import timezone
+from model_bakery import baker
+
+from main.middleware import (
+    CampaignActivityCheckMiddleware,
+    CheckForSessionInvalidatedMiddleware,
+    ClinicMessageMiddleware,
+    CurrentCampaignMiddleware,
+    MetricsMiddleware,
+    QueryBudgetMiddleware,
+    TimezoneMiddleware,
+    attach_campaign,
+)
+from main.models import Campaign, UserSession, fEMRUser
+from main.query_budget import QueryRecorder, assert_query_budget
+
+
+def test_current_campaign_middleware_loads_campaign_once():
+    campaign = Campaign.objects.select_related("inventory", "instance").get(
+        pk=baker.make("main.Campaign").pk
+    )
+    other_campaign = baker.make("main.Campaign")
+    u = fEMRUser.objects.create_user(
+        username="testcurrentcampaign",
+        password="testingpassword",
+        email="testcurrentcampaign@email.com",
+    )
+    u.current_campaign = campaign.name
+    request = RequestFactory().get("/")
+    request.user = u
+
+    def get_response(request):
+        with CaptureQueriesContext(connection) as queries:
+            assert request.campaign == campaign
+            assert request.campaign.inventory == campaign.inventory
+            assert request.campaign.instance == campaign.instance
+        assert len(queries) == 1
+        request.user.current_campaign = other_campaign.name
+        attach_campaign(request)
+        assert request.campaign == other_campaign
+        return "response"
+
+    assert CurrentCampaignMiddleware(get_response)(request) == "response"
+    u.delete()
+    campaign.delete()
+    other_campaign.delete()
+
+
+def test_session_invalidated_middleware_coalesces_writes():
+    u = fEMRUser.objects.create_user(
+        username="testsessionwrites",
+        password="testingpassword",
+        email="testsessionwrites@email.com",
+    )
+    request = RequestFactory().get("/")
+    request.user = u
+    request.session = SessionStore()
+    request.session.create()
+    middleware = CheckForSessionInvalidatedMiddleware(lambda request: "response")
+    middleware(request)
+    assert UserSession.objects.get(user=u).session_key == request.session.session_key
+    with CaptureQueriesContext(connection) as queries:
+        middleware(request)
+    assert len(queries) == 1
+    assert queries[0]["sql"].lstrip().upper().startswith("SELECT")
+    request.session.cycle_key()
+    middleware(request)
+    assert UserSession.objects.get(user=u).session_key == request.session.session_key
+    u.delete()
+
+
+def test_session_invalidated_middleware_recreates_deleted_user_session():
+    u = fEMRUser.objects.create_user(
+        username="testsessiondeleted",
+        password="testingpassword",
+        email="testsessiondeleted@email.com",
+    )
+    request = RequestFactory().get("/")
+    request.user = u
+    request.session = SessionStore()
+    request.session.create()
+    middleware = CheckForSessionInvalidatedMiddleware(lambda request: "response")
+    middleware(request)
+    UserSession.objects.filter(user=u).delete()
+    middleware(request)
+    assert UserSession.objects.get(user=u).session_key == request.session.session_key
+    u.delete()
+
+
+def test_fast_path_requests_skip_message_count():
+    u = fEMRUser.objects.create_user(
+        username="testfastpath",
+        password="testingpassword",
+        email="testfastpath@email.com",
+    )
+    middleware = ClinicMessageMiddleware(lambda request: "response")
+    for path in ("/healthcheck/", "/api/patients/", "/race-autocomplete/"):
+        request = RequestFactory().get(path)
+        request.user = u
+        with CaptureQueriesContext(connection) as queries:
+            middleware(request)
+        assert len(queries) == 0
+        assert not hasattr(request, "message_number")
+    request = RequestFactory().get("/home/")
+    request.user = u
+    middleware(request)
+    assert request.message_number == 0
+    u.delete()
+
+
+@override_settings(
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+)
+def test_campaign_activity_check_caches_active_campaigns():
+    campaign = baker.make("main.Campaign", active=True)
+    other_campaign = baker.make("main.Campaign", active=True)
+    u = fEMRUser.objects.create_user(
+        username="testcampaignactivity",
+        password="testingpassword",
+        email="testcampaignactivity@email.com",
+    )
+    u.campaigns.add(campaign, other_campaign)
+    u.current_campaign = campaign.name
+    u.save()
+    request = RequestFactory().get("/home/")
+    request.user = u
+    request.session = SessionStore()
+    attach_campaign(request)
+    middleware = CampaignActivityCheckMiddleware(lambda request: "response")
+    with CaptureQueriesContext(connection) as queries:
+        assert middleware(request) == "response"
+    assert len(queries) == 1
+    with CaptureQueriesContext(connection) as queries:
+        assert middleware(request) == "response"
+    assert len(queries) == 0
+    campaign.active = False
+    campaign.save()
+    assert middleware(request) == "response"
+    assert u.current_campaign == other_campaign.name
+    assert request.campaign == other_campaign
+    u.delete()
+    campaign.delete()
+    other_campaign.delete()
+
+
+@override_settings(
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+)
+def test_timezone_middleware_caches_campaign_timezone():
+    campaign = baker.make("main.Campaign", timezone="America/Chicago")
+    u = fEMRUser.objects.create_user(
+        username="testtimezonecache",
+        password="testingpassword",
+        email="testtimezonecache@email.com",
+    )
+    u.current_campaign = campaign.name
+    request = RequestFactory().get("/home/")
+    request.user = u
+    request.session = SessionStore()
+    middleware = TimezoneMiddleware(
+        lambda request: timezone.get_current_timezone_name()
+    )
+    attach_campaign(request)
+    assert middleware(request) == "America/Chicago"
+    attach_campaign(request)
+    with CaptureQueriesContext(connection) as queries:
+        assert middleware(request) == "America/Chicago"
+    assert len(queries) == 0
+    campaign.timezone = "Africa/Nairobi"
+    campaign.save()
+    attach_campaign(request)
+    assert middleware(request) == "Africa/Nairobi"
+    timezone.deactivate()
+    u.delete()
+    campaign.delete()
+
+
+@override_settings(
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+)
+def test_timezone_middleware_follows_campaign_changes():
+    campaign = baker.make("main.Campaign", timezone="America/Chicago")
+    other_campaign = baker.make("main.Campaign", timezone="Asia/Tokyo")
+    u = fEMRUser.objects.create_user(
+        username="testtimezonecampaign",
+        password="testingpassword",
+        email="testtimezonecampaign@email.com",
+    )
+    u.current_campaign = campaign.name
+    request = RequestFactory().get("/home/")
+    request.user = u
+    request.session = SessionStore()
+    request.session["django_timezone"] = "Europe/Paris"
+    middleware = TimezoneMiddleware(
+        lambda request: timezone.get_current_timezone_name()
+    )
+    attach_campaign(request)
+    assert middleware(request) == "America/Chicago"
+    u.current_campaign = other_campaign.name
+    attach_campaign(request)
+    assert middleware(request) == "Asia/Tokyo"
+    timezone.deactivate()
+    u.delete()
+    campaign.delete()
+    other_campaign.delete()
+
+
+@override_settings(
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+)
+def test_timezone_middleware_falls_back_to_session_timezone():
+    u = fEMRUser.objects.create_user(
+        username="testtimezonefallback",
+        password="testingpassword",
+        email="testtimezonefallback@email.com",
+    )
+    middleware = TimezoneMiddleware(
+        lambda request: timezone.get_current_timezone_name()
+    )
+
+    def make_request(user, current_campaign=None, session_timezone=None):
+        user.current_campaign = current_campaign
+        request = RequestFactory().get("/home/")
+        request.user = user
+        request.session = SessionStore()
+        if session_timezone is not None:
+            request.session["django_timezone"] = session_timezone
+        attach_campaign(request)
+        return request
+
+    assert (
+        middleware(make_request(AnonymousUser(), session_timezone="Europe/Paris"))
+        == "Europe/Paris"
+    )
+    assert (
+        middleware(make_request(u, "RECOVERY MODE", "Europe/Paris")) == "Europe/Paris"
+    )
+    assert (
+        middleware(make_request(u, "No such campaign", "Australia/Sydney"))
+        == "Australia/Sydney"
+    )
+    assert middleware(make_request(u, "")) == settings.TIME_ZONE
+    timezone.deactivate()
+    u.delete()
+
+
+class RecordingHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+@override_settings(QUERY_BUDGETS={"main:home": 1})
+def test_query_budget_middleware_reports_overruns():
+    def get_response(request):
+        request.resolver_match = resolve("/home/")
+        for _ in range(3):
+            fEMRUser.objects.filter(username="testquerybudget").exists()
+        return "response"
+
+    handler = RecordingHandler()
+    logger = logging.getLogger("femr.query_budget")
+    logger.addHandler(handler)
+    try:
+        QueryBudgetMiddleware(get_response)(RequestFactory().get("/home/"))
+    finally:
+        logger.removeHandler(handler)
+    assert len(handler.records) == 1
+    message = handler.records[0].getMessage()
+    assert '"view": "main:home"' in message
+    assert '"queries": 3' in message
+    assert '"budget": 1' in message
+
+
+@override_settings(
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}},
+    QUERY_BUDGETS={"main:home": 1},
+)
+def test_metrics_and_query_budget_share_one_recorder():
+    def get_response(request):
+        request.resolver_match = resolve("/home/")
+        wrappers.append(list(connection.execute_wrappers))
+        for _ in range(3):
+            fEMRUser.objects.filter(username="testsharedrecorder").exists()
+        return "response"
+
+    wrappers = []
+    handler = RecordingHandler()
+    logger = logging.getLogger("femr.query_budget")
+    logger.addHandler(handler)
+    try:
+        middleware = MetricsMiddleware(QueryBudgetMiddleware(get_response))
+        assert middleware(RequestFactory().get("/home/")) == "response"
+    finally:
+        logger.removeHandler(handler)
+    assert len(wrappers[0]) == 1
+    assert '"queries": 3' in handler.records[0].getMessage()
+    assert connection.execute_wrappers == []
+
+
+def test_query_recorder_counts_normalized_statements():
+    recorder = QueryRecorder()
+    with connection.execute_wrapper(recorder):
+        for count in range(1, 4):
+            list(fEMRUser.objects.filter(pk__in=range(count + 1)))
+    assert recorder.count == 3
+    assert len(recorder.statements) == 1
+    assert list(recorder.statements.values()) == [3]
+
+
+def test_healthcheck_query_budget():
+    with assert_query_budget("main:healthcheck"):
+        assert Client().get("/healthcheck/").status_code == 200
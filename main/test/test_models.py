@@ -45,3 +45,21 @@ def test_get_test_org():
     o = get_test_org()
     org = Organization.objects.get(pk=o)
     assert org.name == "Test"
+
+
+def test_encounters_maintain_last_encounter_at():
+    campaign = baker.make("main.Campaign")
+    patient = baker.make("main.Patient", campaign=[campaign])
+    first = baker.make("main.PatientEncounter", patient=patient, campaign=campaign)
+    second = baker.make("main.PatientEncounter", patient=patient, campaign=campaign)
+    patient.refresh_from_db()
+    assert patient.last_encounter_at == second.timestamp
+    assert patient.timestamp >= second.timestamp
+    second.delete()
+    patient.refresh_from_db()
+    assert patient.last_encounter_at == first.timestamp
+    first.delete()
+    patient.refresh_from_db()
+    assert patient.last_encounter_at is None
+    patient.delete()
+    campaign.delete()
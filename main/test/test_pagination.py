@@ -0,0 +1,58 @@
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from model_bakery import baker
+
+from main.models import AuditEntry
+from main.pagination import KeysetPaginator, PrimaryKeyList
+
+
+def test_keyset_paginator_pages_through_a_queryset():
+    campaign = baker.make("main.Campaign")
+    entries = baker.make("main.AuditEntry", campaign=campaign, _quantity=25)
+    AuditEntry.objects.filter(pk__in=[entry.pk for entry in entries[:5]]).update(
+        timestamp=entries[0].timestamp
+    )
+    expected = list(
+        AuditEntry.objects.filter(campaign=campaign).order_by("-timestamp", "-id")
+    )
+    paginator = KeysetPaginator(
+        AuditEntry.objects.filter(campaign=campaign).order_by("-timestamp"), 10
+    )
+    first = paginator.get_page()
+    second = paginator.get_page(after=first.next_cursor)
+    with CaptureQueriesContext(connection) as queries:
+        third = paginator.get_page(after=second.next_cursor)
+    assert len(queries) == 1
+    assert list(first) + list(second) + list(third) == expected
+    assert not first.has_previous() and first.has_next()
+    assert second.has_previous() and second.has_next()
+    assert third.has_previous() and not third.has_next()
+    assert list(paginator.get_page(before=third.previous_cursor)) == list(second)
+    assert list(paginator.get_page(before=second.previous_cursor)) == list(first)
+    assert list(paginator.get_page(after="not a cursor")) == list(first)
+    AuditEntry.objects.filter(campaign=campaign).delete()
+    campaign.delete()
+
+
+def test_keyset_paginator_fetches_one_page_of_a_primary_key_list():
+    campaign = baker.make("main.Campaign")
+    entries = baker.make("main.AuditEntry", campaign=campaign, _quantity=25)
+    ranked = [entry.pk for entry in reversed(entries)]
+    paginator = KeysetPaginator(PrimaryKeyList(AuditEntry, ranked), 10)
+    parameters = []
+
+    def record_parameters(execute, sql, params, many, context):
+        parameters.append(params)
+        return execute(sql, params, many, context)
+
+    with connection.execute_wrapper(record_parameters):
+        first = paginator.get_page()
+    # One query, for the page and the row telling whether there's a next one.
+    assert [len(params) for params in parameters] == [11]
+    second = paginator.get_page(after=first.next_cursor)
+    third = paginator.get_page(after=second.next_cursor)
+    assert [entry.pk for entry in list(first) + list(second) + list(third)] == ranked
+    assert not third.has_next()
+    assert list(paginator.get_page(before=third.previous_cursor)) == list(second)
+    AuditEntry.objects.filter(campaign=campaign).delete()
+    campaign.delete()
@@ -1,15 +1,54 @@
+import csv
+import gzip
+from datetime import datetime, timedelta
+from io import StringIO
+
+from pytz import timezone as pytz_timezone
+
 from django.contrib.auth.models import Group
-from django.test.client import Client
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection
+from django.test.client import Client, RequestFactory
+from django.test.utils import override_settings
+from django.utils import timezone
 
 from clinic_messages.models import Message
 from model_bakery import baker
 
 from main.csvio.patient_csv_export import (
-    csv_export_handler,
-    dict_builder,
+    export_column_widths,
+    claim_export_dispatch,
+    claim_export_shard,
+    csv_export_shard,
+    encounter_cache_key,
+    export_checkpoints,
+    export_file_response,
+    generate_patient_rows,
+    merge_csv_export_shards,
+    parse_byte_range,
     patient_processing_loop,
+    resume_stalled_exports,
+    shard_boundaries,
+    write_result_file,
+)
+from main.csvio.patient_export_data import (
+    export_encounter_queryset,
+    export_patient_data,
+    export_row_count,
+    last_export_timestamp,
+)
+from main.models import (
+    CSVExport,
+    HistoryOfPresentIllness,
+    Patient,
+    PatientEncounter,
+    Treatment,
+    Vitals,
+    fEMRUser,
 )
-from main.models import Patient, fEMRUser
+from main.query_budget import QueryRecorder, assert_query_budget
 
 
 def test_patient_processing_loop():
@@ -18,47 +57,427 @@ def test_patient_processing_loop():
     baker.make("main.PatientEncounter", patient=patient, campaign=campaign)
     patient_data = Patient.objects.filter(campaign=campaign)
     patient_rows = []
-    vitals_dict = {}
-    treatments_dict = {}
-    hpis_dict = {}
-    max_treatments, max_hpis, max_vitals = dict_builder(
-        patient_data, vitals_dict, treatments_dict, hpis_dict
-    )
+    max_treatments, max_hpis, max_vitals = export_column_widths(patient_data)
     result = patient_processing_loop(
         patient_data,
         patient_rows,
         campaign,
-        vitals_dict,
         max_vitals,
-        treatments_dict,
         max_treatments,
-        hpis_dict,
         max_hpis,
     )
-    print(result)
     assert result == 1
 
 
-def test_csv_export_handler():
+def test_sharded_export_clips_children_added_after_planning():
     admin_user = fEMRUser.objects.create_user(
         username="admin",
         password="testingpassword",
         email="admin@email.com",
     )
     user = fEMRUser.objects.create_user(
-        username="testcsvexporthandler",
+        username="testexportclipping",
         password="testingpassword",
-        email="testcsvexporthandler@email.com",
+        email="testexportclipping@email.com",
+    )
+    campaign = baker.make("main.Campaign")
+    patient = baker.make("main.Patient", campaign=[campaign])
+    encounter = baker.make("main.PatientEncounter", patient=patient, campaign=campaign)
+    baker.make("main.Vitals", encounter=encounter)
+    patient_data, checkpoints = export_checkpoints(campaign, 1, None, 10)
+    export = CSVExport.objects.create(
+        user=user,
+        campaign=campaign,
+        rows_total=export_row_count(patient_data),
+        checkpoints=checkpoints,
+    )
+    baker.make("main.Vitals", encounter=encounter)
+    csv_export_shard(export.pk, 0)
+    merge_csv_export_shards(export.pk)
+    export.refresh_from_db()
+    with export.file.open("rb") as export_file:
+        rows = list(
+            csv.reader(StringIO(gzip.decompress(export_file.read()).decode("utf-8")))
+        )
+    assert len(rows) == 2
+    assert len(rows[1]) == len(rows[0])
+    export.file.delete()
+    export.delete()
+    patient.delete()
+    campaign.delete()
+    user.delete()
+    admin_user.delete()
+
+
+def test_write_result_file_streams_in_chunks():
+    output = StringIO()
+    writer = csv.writer(output)
+    rows = ([i, f"row {i}"] for i in range(7))
+    write_result_file(writer, ["Patient", "Name"], rows, chunk_size=3)
+    result = list(csv.reader(StringIO(output.getvalue())))
+    assert result[0] == ["Patient", "Name"]
+    assert len(result) == 8
+    assert result[-1] == ["6", "row 6"]
+
+
+@override_settings(
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+)
+def test_export_query_budget():
+    # Mirrors the campaign built by the scaledata command, with vitals, a
+    # treatment and an HPI on every encounter.
+    campaign = baker.make("main.Campaign")
+    diagnosis = baker.make("main.Diagnosis")
+    chief_complaint = baker.make("main.ChiefComplaint")
+    medications = baker.make("main.InventoryEntry", _quantity=2)
+    patients = baker.make("main.Patient", campaign=[campaign], _quantity=1000)
+    PatientEncounter.objects.bulk_create(
+        encounter
+        for patient in patients
+        for encounter in baker.prepare(
+            "main.PatientEncounter",
+            patient=patient,
+            campaign=campaign,
+            timestamp=timezone.now(),
+            _quantity=10,
+        )
+    )
+    encounters = list(PatientEncounter.objects.filter(campaign=campaign))
+    Vitals.objects.bulk_create(
+        Vitals(encounter=encounter, body_temperature=37.0)
+        for encounter in encounters
+        for _ in range(2)
+    )
+    Treatment.objects.bulk_create(
+        Treatment(encounter=encounter, diagnosis=diagnosis, days=5)
+        for encounter in encounters
+    )
+    Treatment.medication.through.objects.bulk_create(
+        Treatment.medication.through(treatment=treatment, inventoryentry=medication)
+        for treatment in Treatment.objects.filter(encounter__campaign=campaign)
+        for medication in medications
     )
-    user.change_password = False
+    HistoryOfPresentIllness.objects.bulk_create(
+        HistoryOfPresentIllness(encounter=encounter, chief_complaint=chief_complaint)
+        for encounter in encounters
+    )
+    patient_data = Patient.objects.filter(campaign=campaign)
+    # Counted with an execute wrapper rather than connection.queries, so only
+    # the queries run here are seen, whatever ran before this test.
+    queries = QueryRecorder()
+    with connection.execute_wrapper(queries):
+        max_treatments, max_hpis, max_vitals = export_column_widths(patient_data)
+        row_count = sum(
+            1
+            for _ in generate_patient_rows(
+                patient_data, campaign, max_vitals, max_treatments, max_hpis
+            )
+        )
+    assert (max_treatments, max_hpis, max_vitals) == (1, 1, 2)
+    assert row_count == 10000
+    # Per chunk of 500 patients: the patients, their encounters, and their
+    # vitals, treatments, medications and HPIs.
+    assert queries.count <= 15
+    patient_data.delete()
+    for instance in (campaign, diagnosis, chief_complaint, *medications):
+        instance.delete()
+
+
+def test_export_column_widths():
     campaign = baker.make("main.Campaign")
-    campaign.active = True
-    campaign.save()
-    user.campaigns.add(campaign)
-    user.save()
     patient = baker.make("main.Patient", campaign=[campaign])
+    encounter = baker.make("main.PatientEncounter", patient=patient, campaign=campaign)
     baker.make("main.PatientEncounter", patient=patient, campaign=campaign)
-    csv_export_handler(user.id, campaign.id, 1)
+    baker.make("main.Vitals", encounter=encounter, _quantity=3)
+    baker.make("main.Treatment", encounter=encounter, _quantity=2)
+    patient_data = Patient.objects.filter(campaign=campaign)
+    assert export_column_widths(patient_data) == (2, 0, 3)
+    patient.delete()
+    campaign.delete()
+
+
+def test_sharded_export_keeps_patient_numbering():
+    admin_user = fEMRUser.objects.create_user(
+        username="admin",
+        password="testingpassword",
+        email="admin@email.com",
+    )
+    user = fEMRUser.objects.create_user(
+        username="testshardedexport",
+        password="testingpassword",
+        email="testshardedexport@email.com",
+    )
+    campaign = baker.make("main.Campaign")
+    for patient in baker.make("main.Patient", campaign=[campaign], _quantity=5):
+        baker.make("main.PatientEncounter", patient=patient, campaign=campaign)
+    patient_data = Patient.objects.filter(campaign=campaign)
+    boundaries = shard_boundaries(patient_data, 2)
+    assert len(boundaries) == 3
+    patient_data, checkpoints = export_checkpoints(campaign, 1, None, 2)
+    export = CSVExport.objects.create(
+        user=user,
+        campaign=campaign,
+        rows_total=export_row_count(patient_data),
+        checkpoints=checkpoints,
+    )
+    for index in range(len(boundaries)):
+        csv_export_shard(export.pk, index)
+    merge_csv_export_shards(export.pk)
+    export = CSVExport.objects.filter(user=user).first()
+    with export.file.open("rb") as export_file:
+        rows = list(
+            csv.reader(StringIO(gzip.decompress(export_file.read()).decode("utf-8")))
+        )
+    assert [row[0] for row in rows] == ["Patient", "1", "2", "3", "4", "5"]
+    assert Message.objects.filter(recipient=user).count() == 1
+    patient_data.delete()
+    user.delete()
+    admin_user.delete()
+
+
+def test_sharded_export_checkpoints_progress():
+    campaign = baker.make("main.Campaign")
+    for patient in baker.make("main.Patient", campaign=[campaign], _quantity=4):
+        baker.make("main.PatientEncounter", patient=patient, campaign=campaign)
+    patient_data, checkpoints = export_checkpoints(campaign, 1, None, 2)
+    export = CSVExport.objects.create(
+        campaign=campaign,
+        rows_total=export_row_count(patient_data),
+        checkpoints=checkpoints,
+    )
+    shard_name = csv_export_shard(export.pk, 0)
+    export.refresh_from_db()
+    assert export.rows_total == 4
+    assert export.rows_done == 2
+    assert not export.finished
+    assert export.checkpoints["shards"][0]["file"] == shard_name
+    assert export.checkpoints["shards"][1]["file"] is None
+    assert csv_export_shard(export.pk, 0) == shard_name
+    export.refresh_from_db()
+    assert export.rows_done == 2
+    default_storage.delete(shard_name)
+    export.delete()
+    patient_data.delete()
+    campaign.delete()
+
+
+def test_resume_leaves_queued_export_to_its_original_chord():
+    admin_user = fEMRUser.objects.create_user(
+        username="admin",
+        password="testingpassword",
+        email="admin@email.com",
+    )
+    user = fEMRUser.objects.create_user(
+        username="testresumeexport",
+        password="testingpassword",
+        email="testresumeexport@email.com",
+    )
+    campaign = baker.make("main.Campaign")
+    for patient in baker.make("main.Patient", campaign=[campaign], _quantity=4):
+        baker.make("main.PatientEncounter", patient=patient, campaign=campaign)
+    patient_data, checkpoints = export_checkpoints(campaign, 1, None, 2)
+    export = CSVExport.objects.create(
+        user=user,
+        campaign=campaign,
+        rows_total=export_row_count(patient_data),
+        checkpoints=checkpoints,
+    )
+    # The original chord is queued, then sits behind other work for longer
+    # than an export is given to make progress.
+    assert claim_export_dispatch(export.pk) == ([0, 1], False)
+    CSVExport.objects.filter(pk=export.pk).update(
+        timestamp=timezone.now() - timedelta(minutes=20)
+    )
+    queued = CSVExport.objects.get(pk=export.pk).checkpoints
+    resume_stalled_exports()
+    assert CSVExport.objects.get(pk=export.pk).checkpoints == queued
+    # Its shards then run, with a second worker picking up shard 1 while the
+    # first is still rendering it.
+    csv_export_shard(export.pk, 0)
+    assert claim_export_shard(export.pk, 1) is not None
+    assert csv_export_shard(export.pk, 1) is None
+    merge_csv_export_shards(export.pk)
+    assert not CSVExport.objects.get(pk=export.pk).finished
+    export.refresh_from_db()
+    export.checkpoints["shards"][1]["leased_at"] = None
+    export.save()
+    csv_export_shard(export.pk, 1)
+    merge_csv_export_shards(export.pk)
+    merge_csv_export_shards(export.pk)
+    export.refresh_from_db()
+    assert export.finished
+    assert export.rows_done == 4
     assert Message.objects.filter(recipient=user).count() == 1
+    export.file.delete()
+    patient_data.delete()
+    campaign.delete()
     user.delete()
     admin_user.delete()
+
+
+def test_encounter_cache_key_changes_with_children():
+    campaign = baker.make("main.Campaign")
+    patient = baker.make("main.Patient", campaign=[campaign])
+    encounter = baker.make("main.PatientEncounter", patient=patient, campaign=campaign)
+    before = encounter_cache_key(
+        campaign, patient, export_encounter_queryset().get(pk=encounter.pk), "UTC"
+    )
+    assert before == encounter_cache_key(
+        campaign, patient, export_encounter_queryset().get(pk=encounter.pk), "UTC"
+    )
+    baker.make("main.Vitals", encounter=encounter)
+    after = encounter_cache_key(
+        campaign, patient, export_encounter_queryset().get(pk=encounter.pk), "UTC"
+    )
+    assert before != after
+    treatment = baker.make("main.Treatment", encounter=encounter)
+    before = encounter_cache_key(
+        campaign, patient, export_encounter_queryset().get(pk=encounter.pk), "UTC"
+    )
+    treatment.medication.add(baker.make("main.InventoryEntry"))
+    after = encounter_cache_key(
+        campaign, patient, export_encounter_queryset().get(pk=encounter.pk), "UTC"
+    )
+    assert before != after
+    patient.delete()
+    campaign.delete()
+
+
+@override_settings(
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+)
+def test_export_rerenders_only_changed_encounters():
+    campaign = baker.make("main.Campaign")
+    edited, untouched = baker.make("main.Patient", campaign=[campaign], _quantity=2)
+    baker.make(
+        "main.PatientEncounter", patient=edited, campaign=campaign, procedure="before"
+    )
+    encounter = baker.make(
+        "main.PatientEncounter", patient=untouched, campaign=campaign, procedure="same"
+    )
+    patient_data = Patient.objects.filter(campaign=campaign)
+    max_treatments, max_hpis, max_vitals = export_column_widths(patient_data)
+
+    def export_procedures():
+        rows = generate_patient_rows(
+            patient_data, campaign, max_vitals, max_treatments, max_hpis
+        )
+        return sorted(row[14] for row in rows)
+
+    assert export_procedures() == ["before", "same"]
+    # Mark the untouched encounter's cached cells, to tell whether the next
+    # export serves them from the cache or renders them again.
+    key = encounter_cache_key(
+        campaign,
+        Patient.objects.get(pk=untouched.pk),
+        export_encounter_queryset().get(pk=encounter.pk),
+        datetime.now(tz=pytz_timezone(campaign.timezone)).strftime("%Z%z"),
+    )
+    cells = cache.get(key)
+    cells[0][13] = "cached"
+    cache.set(key, cells)
+    edited_encounter = PatientEncounter.objects.get(patient=edited)
+    edited_encounter.procedure = "after"
+    edited_encounter.save()
+    assert export_procedures() == ["after", "cached"]
+    patient_data.delete()
+    campaign.delete()
+
+
+def test_last_export_timestamp_is_the_export_cutoff():
+    user = fEMRUser.objects.create_user(
+        username="testlastexport",
+        password="testingpassword",
+        email="testlastexport@email.com",
+    )
+    campaign = baker.make("main.Campaign")
+    cutoff = timezone.now()
+    CSVExport.objects.create(
+        user=user,
+        campaign=campaign,
+        finished=True,
+        checkpoints={"timestamp_to": cutoff.isoformat()},
+    )
+    assert last_export_timestamp(user, campaign) == cutoff
+    assert last_export_timestamp(user, campaign, "parquet") is None
+    user.delete()
+    campaign.delete()
+
+
+def test_export_patient_data_changed_since():
+    campaign = baker.make("main.Campaign")
+    old_patient = baker.make("main.Patient", campaign=[campaign])
+    edited_patient = baker.make("main.Patient", campaign=[campaign])
+    encounter = baker.make(
+        "main.PatientEncounter", patient=edited_patient, campaign=campaign
+    )
+    vitals = baker.make("main.Vitals", encounter=encounter, _quantity=2)
+    since = timezone.now()
+    new_patient = baker.make("main.Patient", campaign=[campaign])
+    # Updated without signals, so only the vitals' own timestamps show it.
+    Vitals.objects.filter(pk__in=[v.pk for v in vitals]).update(
+        timestamp=timezone.now()
+    )
+    patient_data = export_patient_data(campaign, 4, timestamp_from=since)
+    assert sorted(patient.pk for patient in patient_data) == sorted(
+        [edited_patient.pk, new_patient.pk]
+    )
+    assert export_patient_data(campaign, 4).count() == 3
+    edited_patient.delete()
+    old_patient.delete()
+    new_patient.delete()
+    campaign.delete()
+
+
+def test_parse_byte_range():
+    assert parse_byte_range(None, 100) is None
+    assert parse_byte_range("bytes=0-9", 100) == (0, 9)
+    assert parse_byte_range("bytes=90-", 100) == (90, 99)
+    assert parse_byte_range("bytes=-10", 100) == (90, 99)
+    assert parse_byte_range("bytes=0-1,5-6", 100) is None
+    assert parse_byte_range("bytes=200-300", 100) is False
+
+
+def test_export_file_response():
+    export = CSVExport()
+    export.file.save(
+        "test-export.csv.gz", ContentFile(gzip.compress(b"Patient\r\n1\r\n"))
+    )
+    factory = RequestFactory()
+    response = export_file_response(
+        factory.get("/", HTTP_ACCEPT_ENCODING="gzip, deflate"), export
+    )
+    assert response["Content-Encoding"] == "gzip"
+    assert gzip.decompress(b"".join(response.streaming_content)) == b"Patient\r\n1\r\n"
+    response = export_file_response(factory.get("/"), export)
+    assert not response.has_header("Content-Encoding")
+    assert b"".join(response.streaming_content) == b"Patient\r\n1\r\n"
+    response = export_file_response(
+        factory.get("/", HTTP_ACCEPT_ENCODING="gzip", HTTP_RANGE="bytes=0-1"), export
+    )
+    assert response.status_code == 206
+    assert len(b"".join(response.streaming_content)) == 2
+    export.file.delete()
+
+
+def test_csv_export_list_query_budget():
+    u = fEMRUser.objects.create_user(
+        username="testexportlistbudget",
+        password="testingpassword",
+        email="testexportlistbudget@email.com",
+    )
+    u.change_password = False
+    u.save()
+    Group.objects.get_or_create(name="fEMR Admin")[0].user_set.add(u)
+    c = baker.make("main.Campaign")
+    u.campaigns.add(c)
+    baker.make("main.CSVExport", user=u, campaign=c, _quantity=15)
+    client = Client()
+    client.post(
+        "/login_view/",
+        {"username": "testexportlistbudget", "password": "testingpassword"},
+    )
+    with assert_query_budget("main:csv_export_list"):
+        assert client.get("/csv_export_list/").status_code == 200
+    u.delete()
+    c.delete()
@@ -0,0 +1,148 @@
+import io
+import tempfile
+import zipfile
+from datetime import datetime
+from decimal import Decimal
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+from model_bakery import baker
+
+from main.csvio.patient_csv_export import export_checkpoints
+from main.csvio.patient_export_data import last_export_timestamp
+from main.csvio.patient_parquet_export import (
+    ENCOUNTER_SCHEMA,
+    VITALS_SCHEMA,
+    encounter_record,
+    parquet_export_handler,
+    vitals_record,
+    write_parquet_tables,
+)
+from main.models import CSVExport, Patient, PatientEncounter, Vitals, fEMRUser
+
+
+def test_write_parquet_tables():
+    campaign = baker.make("main.Campaign")
+    patient = baker.make("main.Patient", campaign=[campaign])
+    encounter = baker.make("main.PatientEncounter", patient=patient, campaign=campaign)
+    baker.make("main.Vitals", encounter=encounter, _quantity=2)
+    patient_data = Patient.objects.filter(campaign=campaign)
+    with tempfile.TemporaryDirectory() as directory:
+        encounters, vitals, treatments, hpis = [
+            pq.read_table(path)
+            for path in write_parquet_tables(directory, patient_data)
+        ]
+    assert encounters.num_rows == 1
+    assert encounters.column("patient").to_pylist() == [1]
+    assert vitals.num_rows == 2
+    assert vitals.column("encounter").to_pylist() == [1, 1]
+    assert treatments.num_rows == 0
+    assert hpis.num_rows == 0
+    patient.delete()
+    campaign.delete()
+
+
+def test_decimal_measurements_round_trip_as_float64():
+    patient = Patient(sex_assigned_at_birth="f", age=30, city="Testville")
+    encounter = PatientEncounter(
+        body_height_secondary=Decimal("12.5"),
+        body_weight=Decimal("70.25"),
+        body_mass_index=Decimal("22.4"),
+    )
+    vital = Vitals(
+        mean_arterial_pressure=Decimal("93.3"),
+        body_temperature=Decimal("37.1"),
+        glucose_level=Decimal("5.4"),
+    )
+    encounters = pa.Table.from_pylist(
+        [encounter_record(1, 1, patient, encounter)], schema=ENCOUNTER_SCHEMA
+    )
+    vitals = pa.Table.from_pylist([vitals_record(1, vital)], schema=VITALS_SCHEMA)
+    buffer = io.BytesIO()
+    pq.write_table(encounters, buffer)
+    buffer.seek(0)
+    row = pq.read_table(buffer).to_pylist()[0]
+    assert (row["height_cm"], row["weight_kg"], row["bmi"]) == (12.5, 70.25, 22.4)
+    assert vitals.to_pylist()[0]["body_temperature_c"] == 37.1
+    assert vitals.schema.field("glucose_level").type == pa.float64()
+
+
+def test_parquet_export_handler_tracks_progress():
+    admin_user = fEMRUser.objects.create_user(
+        username="admin",
+        password="testingpassword",
+        email="admin@email.com",
+    )
+    user = fEMRUser.objects.create_user(
+        username="testparquetexport",
+        password="testingpassword",
+        email="testparquetexport@email.com",
+    )
+    campaign = baker.make("main.Campaign")
+    for patient in baker.make("main.Patient", campaign=[campaign], _quantity=3):
+        baker.make("main.PatientEncounter", patient=patient, campaign=campaign)
+    parquet_export_handler(user.pk, campaign.pk, 1)
+    export = CSVExport.objects.get(user=user)
+    assert export.finished
+    assert export.rows_total == export.rows_done == 3
+    assert "timestamp_to" in export.checkpoints
+    with export.file.open("rb") as export_file:
+        with zipfile.ZipFile(io.BytesIO(export_file.read())) as archive:
+            assert sorted(archive.namelist()) == [
+                "encounters.parquet",
+                "hpis.parquet",
+                "treatments.parquet",
+                "vitals.parquet",
+            ]
+    export.file.delete()
+    Patient.objects.filter(campaign=campaign).delete()
+    campaign.delete()
+    user.delete()
+    admin_user.delete()
+
+
+def test_csv_and_parquet_exports_keep_their_own_cutoffs():
+    admin_user = fEMRUser.objects.create_user(
+        username="admin",
+        password="testingpassword",
+        email="admin@email.com",
+    )
+    user = fEMRUser.objects.create_user(
+        username="testexportformats",
+        password="testingpassword",
+        email="testexportformats@email.com",
+    )
+    campaign = baker.make("main.Campaign")
+    patient = baker.make("main.Patient", campaign=[campaign])
+    baker.make("main.PatientEncounter", patient=patient, campaign=campaign)
+    parquet_export_handler(user.pk, campaign.pk, 4)
+    parquet_export = CSVExport.objects.get(user=user)
+    assert parquet_export.checkpoints["format"] == "parquet"
+    # The Parquet export doesn't hold back the first CSV "since my last
+    # export", which still covers every patient.
+    assert last_export_timestamp(user, campaign, "csv") is None
+    patient_data, checkpoints = export_checkpoints(
+        campaign, 4, last_export_timestamp(user, campaign, "csv"), 2000
+    )
+    assert list(patient_data) == [patient]
+    CSVExport.objects.create(
+        user=user, campaign=campaign, finished=True, checkpoints=checkpoints
+    )
+    assert last_export_timestamp(user, campaign, "csv") == datetime.fromisoformat(
+        checkpoints["timestamp_to"]
+    )
+    # Nor does the CSV export hold back the next Parquet one.
+    new_patient = baker.make("main.Patient", campaign=[campaign])
+    baker.make("main.PatientEncounter", patient=new_patient, campaign=campaign)
+    assert last_export_timestamp(user, campaign, "parquet") == datetime.fromisoformat(
+        parquet_export.checkpoints["timestamp_to"]
+    )
+    parquet_export_handler(user.pk, campaign.pk, 4)
+    second_export = CSVExport.objects.filter(user=user).order_by("-id").first()
+    assert second_export.rows_total == 1
+    for export in CSVExport.objects.filter(user=user):
+        export.file.delete()
+    Patient.objects.filter(campaign=campaign).delete()
+    campaign.delete()
+    user.delete()
+    admin_user.delete()
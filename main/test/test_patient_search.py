@@ -0,0 +1,83 @@
+from django.test.utils import override_settings
+from model_bakery import baker
+
+from main.patient_search import ngram_patient_search, search_patients, similarity
+
+
+def test_similarity_matches_pg_trgm():
+    assert similarity("word", "two words") == 4 / 11
+    assert similarity("Smith", "smith") == 1.0
+    assert similarity("", "smith") == 0.0
+
+
+@override_settings(
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+)
+def test_search_patients():
+    campaign = baker.make("main.Campaign")
+    other_campaign = baker.make("main.Campaign")
+    smith = baker.make(
+        "main.Patient",
+        campaign=[campaign],
+        first_name="John",
+        last_name="Smith",
+        phone_number="(555)123-4567",
+        email_address="jsmith@example.com",
+        campaign_key=4321,
+    )
+    smithson = baker.make(
+        "main.Patient",
+        campaign=[campaign],
+        first_name="Jane",
+        last_name="Smithson",
+        phone_number=None,
+        email_address=None,
+        campaign_key=None,
+    )
+    other = baker.make(
+        "main.Patient", campaign=[other_campaign], first_name="John", last_name="Smith"
+    )
+    assert list(search_patients(campaign, "smith")) == [smith, smithson]
+    assert list(search_patients(campaign, "SMITHSON")) == [smithson]
+    assert list(search_patients(campaign, "5551234567")) == [smith]
+    assert list(search_patients(campaign, "jsmith@example.com")) == [smith]
+    assert list(search_patients(campaign, "432")) == [smith]
+    assert list(search_patients(campaign, "Jane Doe")) == [smithson]
+    assert list(search_patients(campaign, "nobody")) == []
+    smithson.last_name = "Jones"
+    smithson.save()
+    assert list(search_patients(campaign, "smith")) == [smith]
+    for patient in (smith, smithson, other):
+        patient.delete()
+    campaign.delete()
+    other_campaign.delete()
+
+
+@override_settings(
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+)
+def test_patient_changes_rebuild_only_their_campaigns_index():
+    campaign = baker.make("main.Campaign")
+    other_campaign = baker.make("main.Campaign")
+    patient = baker.make("main.Patient", campaign=[campaign], last_name="Smith")
+    other = baker.make("main.Patient", campaign=[other_campaign], last_name="Smith")
+    ngram_patient_search.search(campaign, "smith")
+    assert list(ngram_patient_search.search(other_campaign, "smith")) == [other]
+    other_index = ngram_patient_search.get_index(other_campaign)
+    patient.last_name = "Smithers"
+    patient.save()
+    assert list(ngram_patient_search.search(campaign, "smithers")) == [patient]
+    assert ngram_patient_search.get_index(other_campaign) is other_index
+    patient.campaign.add(other_campaign)
+    assert ngram_patient_search.get_index(other_campaign) is not other_index
+    assert list(ngram_patient_search.search(other_campaign, "smith")) == [
+        other,
+        patient,
+    ]
+    other_campaign.patient_set.clear()
+    assert list(ngram_patient_search.search(other_campaign, "smith")) == []
+    patient.delete()
+    assert list(ngram_patient_search.search(campaign, "smith")) == []
+    other.delete()
+    campaign.delete()
+    other_campaign.delete()
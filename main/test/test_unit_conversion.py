@@ -0,0 +1,28 @@
+from model_bakery import baker
+
+from main.csvio.patient_csv_export import calc_height
+from main.csvio.unit_conversion import (
+    fahrenheit_temperatures,
+    imperial_heights,
+    imperial_weights,
+)
+
+
+def test_imperial_heights_match_calc_height():
+    encounters = [
+        baker.prepare(
+            "main.PatientEncounter",
+            body_height_primary=primary,
+            body_height_secondary=secondary,
+        )
+        for primary, secondary in ((1, 80.0), (2, 0.0), (1, 52.5), (0, 99.9))
+    ]
+    assert imperial_heights(
+        [encounter.body_height_primary for encounter in encounters],
+        [encounter.body_height_secondary for encounter in encounters],
+    ) == [calc_height(encounter) for encounter in encounters]
+
+
+def test_imperial_weights_and_temperatures():
+    assert imperial_weights([70.0, None]) == [154.32, 0.0]
+    assert fahrenheit_temperatures([37.0, 38.5, None]) == [98.6, 101.3, 32.0]
@@ -0,0 +1,58 @@
+from clinic_messages.models import Message
+from django.core.cache import cache
+from django.test.utils import override_settings
+
+from main.models import fEMRUser
+from main.unread_messages import unread_message_count, unread_messages_cache_key
+
+
+@override_settings(
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+)
+def test_unread_message_count():
+    u = fEMRUser.objects.create_user(
+        username="testunreadmessages",
+        password="testingpassword",
+        email="testunreadmessages@email.com",
+    )
+    assert unread_message_count(u) == 0
+    message = Message.objects.create(
+        subject="Test", content="Test", sender=u, recipient=u
+    )
+    other = Message.objects.create(
+        subject="Test", content="Test", sender=u, recipient=u
+    )
+    assert unread_message_count(u) == 2
+    message.read = True
+    message.save()
+    assert unread_message_count(u) == 1
+    message.save()
+    assert unread_message_count(u) == 1
+    message = Message.objects.get(pk=message.pk)
+    message.read = False
+    message.save()
+    assert unread_message_count(u) == 2
+    other.delete()
+    assert unread_message_count(u) == 1
+    message.delete()
+    assert unread_message_count(u) == 0
+    u.delete()
+
+
+@override_settings(
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+)
+def test_unread_message_count_recounts_after_deferred_save():
+    u = fEMRUser.objects.create_user(
+        username="testunreaddeferred",
+        password="testingpassword",
+        email="testunreaddeferred@email.com",
+    )
+    Message.objects.create(subject="Test", content="Test", sender=u, recipient=u)
+    assert unread_message_count(u) == 1
+    message = Message.objects.defer("read").get(recipient=u)
+    message.read = True
+    message.save()
+    assert cache.get(unread_messages_cache_key(u.pk)) is None
+    assert unread_message_count(u) == 0
+    u.delete()
@@ -0,0 +1,20 @@
+from django.contrib.auth.models import AnonymousUser, Group
+
+from main.user_groups import in_group, user_group_names
+from main.models import fEMRUser
+
+
+def test_user_group_names_follow_group_changes():
+    u = fEMRUser.objects.create_user(
+        username="testusergroups",
+        password="testingpassword",
+        email="testusergroups@email.com",
+    )
+    group = Group.objects.get_or_create(name="Campaign Manager")[0]
+    assert user_group_names(u) == frozenset()
+    group.user_set.add(u)
+    assert in_group(u, "Campaign Manager", "fEMR Admin")
+    u.groups.remove(group)
+    assert not in_group(u, "Campaign Manager")
+    assert user_group_names(AnonymousUser()) == frozenset()
+    u.delete()
@@ -1,9 +1,12 @@
 from django.contrib.auth.models import Group
 from django.test.client import Client, RequestFactory
+from django.test.utils import override_settings
+from django.urls import resolve
 from model_bakery import baker
 from main.models import Campaign, fEMRUser
 
-from main.views import healthcheck
+from main.middleware import MetricsMiddleware
+from main.views import healthcheck, metrics
 
 
 def test_healthcheck():
@@ -13,6 +16,49 @@ def test_healthcheck():
     assert return_response.status_code, 200
 
 
+@override_settings(
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}},
+    METRICS_TOKEN="testmetricstoken",
+)
+def test_metrics():
+    factory = RequestFactory()
+
+    def get_response(request):
+        request.resolver_match = resolve("/metrics")
+        return "response"
+
+    MetricsMiddleware(get_response)(factory.get("/metrics"))
+    assert metrics(factory.get("/metrics")).status_code == 403
+    return_response = metrics(
+        factory.get("/metrics", HTTP_AUTHORIZATION="Bearer testmetricstoken")
+    )
+    assert return_response.status_code == 200
+    text = return_response.content.decode()
+    assert 'femr_view_duration_seconds_count{view="main:metrics"} 1' in text
+    assert 'femr_view_queries_bucket{view="main:metrics",le="0"} 1' in text
+    assert "femr_active_sessions " in text
+
+
+@override_settings(
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}},
+    METRICS_TOKEN=None,
+    METRICS_ALLOWED_IPS=["10.0.0.5"],
+    METRICS_PUBLIC=False,
+)
+def test_metrics_closed_without_token():
+    factory = RequestFactory()
+    assert metrics(factory.get("/metrics")).status_code == 403
+    assert metrics(factory.get("/metrics", REMOTE_ADDR="10.0.0.5")).status_code == 200
+    forwarded = factory.get(
+        "/metrics", REMOTE_ADDR="10.0.0.5", HTTP_X_FORWARDED_FOR="203.0.113.7"
+    )
+    assert metrics(forwarded).status_code == 403
+    with override_settings(METRICS_PUBLIC=True):
+        assert metrics(factory.get("/metrics")).status_code == 200
+    with override_settings(METRICS_TOKEN="testmetricstoken", METRICS_PUBLIC=True):
+        assert metrics(factory.get("/metrics")).status_code == 403
+
+
 def test_home_view():
     u = fEMRUser.objects.create_user(
         username="testhomeview",
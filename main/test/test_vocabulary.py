@@ -0,0 +1,39 @@
+from django.test.utils import override_settings
+from model_bakery import baker
+
+from main.models import ChiefComplaint, Diagnosis
+from main.vocabulary import VocabularyIndex, search_vocabulary
+
+
+def test_vocabulary_index_ranks_prefixes_first():
+    entries = [
+        Diagnosis(pk=1, text="Acute Sinusitis"),
+        Diagnosis(pk=2, text="Sinus Infection"),
+        Diagnosis(pk=3, text="Pansinusitis"),
+        Diagnosis(pk=4, text="Headache"),
+    ]
+    index = VocabularyIndex(entries, "text")
+    assert [entry.pk for entry in index.search("sinus")] == [2, 1, 3]
+    assert [entry.pk for entry in index.search("")] == [1, 2, 3, 4]
+    assert index.search("fever") == []
+
+
+@override_settings(
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+)
+def test_search_vocabulary_follows_changes():
+    fever = baker.make("main.ChiefComplaint", text="Fever")
+    duplicate = baker.make("main.ChiefComplaint", text="Fever")
+    inactive = baker.make("main.ChiefComplaint", text="Fever of unknown origin")
+    inactive.active = False
+    inactive.save()
+    assert search_vocabulary(ChiefComplaint, "fever") == [fever]
+    renamed = baker.make("main.ChiefComplaint", text="Cough")
+    assert search_vocabulary(ChiefComplaint, "fever") == [fever]
+    renamed.text = "Fevered cough"
+    renamed.save()
+    assert search_vocabulary(ChiefComplaint, "fever") == [fever, renamed]
+    fever.delete()
+    assert search_vocabulary(ChiefComplaint, "fever") == [duplicate, renamed]
+    for complaint in (duplicate, inactive, renamed):
+        complaint.delete()
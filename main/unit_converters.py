@@ -1,8 +1,9 @@
 import math
-from silk.profiling.profiler import silk_profile
 
+from main.instrumentation import instrument
 
-@silk_profile("history_view_imperial")
+
+@instrument("history_view_imperial")
 def history_view_imperial(form, encounter):
     form.initial = {
         "body_mass_index": encounter.body_mass_index,
@@ -36,7 +37,7 @@ def history_view_imperial(form, encounter):
     }
 
 
-@silk_profile("new-vitals-imperial")
+@instrument("new-vitals-imperial")
 def new_vitals_imperial(form, encounter):
     form.initial = {
         "body_mass_index": encounter.body_mass_index,
@@ -69,7 +70,7 @@ def new_vitals_imperial(form, encounter):
     }
 
 
-@silk_profile("new_diagnosis_imperial")
+@instrument("new_diagnosis_imperial")
 def new_diagnosis_imperial(form, encounter):
     form.initial = {
         "body_mass_index": encounter.body_mass_index,
@@ -103,7 +104,7 @@ def new_diagnosis_imperial(form, encounter):
     }
 
 
-@silk_profile("update-form-initial-imperial")
+@instrument("update-form-initial-imperial")
 def encounter_update_form_initial_imperial(form, encounter):
     form.initial = {
         "body_mass_index": encounter.body_mass_index,
@@ -162,7 +163,7 @@ def encounter_update_form_initial_imperial(form, encounter):
     }
 
 
-@silk_profile("new_treatment_imperial")
+@instrument("new_treatment_imperial")
 def new_treatment_imperial(form, encounter):
     form.initial = {
         "body_mass_index": encounter.body_mass_index,
@@ -195,7 +196,7 @@ def new_treatment_imperial(form, encounter):
     }
 
 
-@silk_profile("aux-form-imperial")
+@instrument("aux-form-imperial")
 def aux_form_imperial(form, encounter):
     form.initial = {
         "body_mass_index": encounter.body_mass_index,
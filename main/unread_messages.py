@@ -0,0 +1,50 @@
+"""
+A cached per-user count of unread clinic messages, kept up to date as messages
+are sent, read and deleted, so the inbox badge doesn't need a query.
+"""
+from django.core.cache import cache
+
+from clinic_messages.models import Message
+
+# Bulk updates made with QuerySet.update() send no signals, so the counter is
+# also recounted from the database at least this often.
+UNREAD_MESSAGES_CACHE_TIMEOUT = 60 * 5
+
+
+def unread_messages_cache_key(user_id):
+    return f"unread-messages-{user_id}"
+
+
+def unread_message_count(user):
+    """
+    How many unread messages user has, counted in the database only when the
+    cached counter is missing.
+    """
+    key = unread_messages_cache_key(user.pk)
+    count = cache.get(key)
+    if count is None:
+        count = Message.objects.filter(recipient=user, read=False).count()
+        cache.add(key, count, UNREAD_MESSAGES_CACHE_TIMEOUT)
+    return count
+
+
+def adjust_unread_message_count(user_id, delta):
+    """
+    Move a user's cached counter by delta. A counter that isn't cached is left
+    for the next request to count.
+    """
+    key = unread_messages_cache_key(user_id)
+    try:
+        if delta > 0:
+            cache.incr(key, delta)
+        elif delta < 0:
+            cache.decr(key, -delta)
+    except ValueError:
+        pass
+
+
+def forget_unread_message_count(user_id):
+    """
+    Drop a user's cached counter, for the next request to count.
+    """
+    cache.delete(unread_messages_cache_key(user_id))
@@ -158,7 +158,17 @@ from .small_forms_views import (
     medication_form_view,
     treatment_form_view,
 )
-from .views import begin_stress_test_view, forgot_username, index, home, faqs, healthcheck, help_messages_off, request_stress_test_view
+from .views import (
+    begin_stress_test_view,
+    forgot_username,
+    index,
+    home,
+    faqs,
+    healthcheck,
+    help_messages_off,
+    metrics,
+    request_stress_test_view,
+)
 
 # pylint: disable=C0103
 app_name = "main"
@@ -216,6 +226,7 @@ urlpatterns = [
     url(r"^permission_denied/$", permission_denied, name="permission_denied"),
     url(r"^all_locked/$", all_locked, name="all_locked"),
     url(r"^healthcheck/$", healthcheck, name="healthcheck"),
+    url(r"^metrics$", metrics, name="metrics"),
     url(r"^patient_form_view/$", patient_form_view, name="patient_form_view"),
 
     path(r"request_stress_test_view/", request_stress_test_view, name="request_stress_test_view"),
@@ -0,0 +1,48 @@
+"""
+A cached snapshot of each user's group names, so that role checks in views,
+decorators, template tags and middleware are set lookups rather than queries.
+"""
+from django.core.cache import cache
+
+USER_GROUPS_CACHE_TIMEOUT = 60 * 60
+
+# Bumped whenever group membership changes in this process, so that snapshots
+# already held on user objects are refetched rather than trusted.
+_generation = 0
+
+
+def user_groups_cache_key(user_id):
+    return f"user-groups-{user_id}"
+
+
+def user_group_names(user):
+    """
+    The names of the groups user belongs to. The snapshot is kept on the user
+    object for the rest of the request, and in the cache across requests and
+    sessions until the user's groups change.
+    """
+    if not user.is_authenticated:
+        return frozenset()
+    snapshot = getattr(user, "_group_names", None)
+    if snapshot is not None and snapshot[0] == _generation:
+        return snapshot[1]
+    key = user_groups_cache_key(user.pk)
+    names = cache.get(key)
+    if names is None:
+        names = frozenset(user.groups.values_list("name", flat=True))
+        cache.set(key, names, USER_GROUPS_CACHE_TIMEOUT)
+    user._group_names = (_generation, names)
+    return names
+
+
+def in_group(user, *group_names):
+    """
+    Whether user belongs to any of group_names.
+    """
+    return not user_group_names(user).isdisjoint(group_names)
+
+
+def invalidate_user_groups(user_ids):
+    global _generation  # pylint: disable=W0603
+    _generation += 1
+    cache.delete_many([user_groups_cache_key(user_id) for user_id in user_ids])
@@ -7,15 +7,20 @@ If one is not found, they will direct to the appropriate error page.
 import json
 import pytz
 from django.core.exceptions import ObjectDoesNotExist
-from django.http import HttpResponse
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
 from django.shortcuts import render, redirect
 from django.utils import timezone
+from django.utils.crypto import constant_time_compare
 from django.core.mail import send_mail
+
 from main.background_tasks import start_stress_test
-from silk.profiling.profiler import silk_profile
+from main.campaign_timezone import forget_campaign_timezone
 from main.decorators import is_admin, is_authenticated, is_femr_admin
 from main.forms import ForgotUsernameForm
-from main.models import Campaign, MessageOfTheDay, fEMRUser
+from main.instrumentation import instrument
+from main.metrics import render_metrics
+from main.models import MessageOfTheDay, fEMRUser
 
 
 # noinspection PyUnusedLocal
@@ -30,7 +35,7 @@ def index(request):
 
 
 @is_authenticated
-@silk_profile("home")
+@instrument("home")
 def home(request):
     """
     The landing page for the authenticated user.
@@ -79,14 +84,49 @@ def healthcheck(request):
     return HttpResponse("Working.")
 
 
+def metrics_allowed(request):
+    """
+    Whether request may read /metrics: with settings.METRICS_TOKEN set, only if it
+    gives the token as a bearer token, otherwise if metrics are public or the
+    request comes straight from one of settings.METRICS_ALLOWED_IPS. Requests
+    through nginx carry an X-Forwarded-For header and are never matched by address.
+    """
+    token = settings.METRICS_TOKEN
+    if token:
+        return constant_time_compare(
+            request.headers.get("Authorization", ""), f"Bearer {token}"
+        )
+    if settings.METRICS_PUBLIC:
+        return True
+    return (
+        "HTTP_X_FORWARDED_FOR" not in request.META
+        and request.META.get("REMOTE_ADDR") in settings.METRICS_ALLOWED_IPS
+    )
+
+
+def metrics(request):
+    """
+    Returns request, task, cache and session metrics in the Prometheus text format,
+    to the requests metrics_allowed lets through.
+    """
+    if not metrics_allowed(request):
+        return_response = HttpResponseForbidden()
+    else:
+        return_response = HttpResponse(
+            render_metrics(), content_type="text/plain; version=0.0.4; charset=utf-8"
+        )
+    return return_response
+
+
 @is_admin
 @is_authenticated
 def set_timezone(request):
-    campaign = Campaign.objects.get(name=request.user.current_campaign)
+    campaign = request.campaign
     if request.method == "POST":
         request.session["django_timezone"] = request.POST["timezone"]
         campaign.timezone = request.POST["timezone"]
         campaign.save()
+        forget_campaign_timezone(request)
         return_response = redirect("main:index")
     else:
         selected_time_zone = campaign.timezone
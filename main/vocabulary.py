@@ -0,0 +1,180 @@
+"""
+Reference vocabularies behind the autocompletes, such as diagnoses, medications,
+chief complaints and states, searched from memory.
+
+These change rarely, so each process keeps an index of every vocabulary it has
+served. It rebuilds a vocabulary when the version counter kept for it in the
+cache moves on, which happens whenever one of its rows is saved or deleted.
+"""
+import time
+from bisect import bisect_left
+
+from django.core.cache import cache
+
+from main.models import (
+    AdministrationSchedule,
+    ChiefComplaint,
+    Diagnosis,
+    Ethnicity,
+    InventoryCategory,
+    InventoryForm,
+    Manufacturer,
+    Medication,
+    Race,
+    State,
+    Test,
+)
+
+
+class Vocabulary:
+    """
+    The rows a model's autocomplete offers and the field they're searched by.
+    With distinct, only the first row of each text is offered.
+    """
+
+    def __init__(self, model, field, ordering=("pk",), distinct=False, **filters):
+        self.model = model
+        self.field = field
+        self.ordering = ordering
+        self.distinct = distinct
+        self.filters = filters
+
+    def entries(self):
+        rows = self.model.objects.filter(**self.filters).order_by(*self.ordering)
+        if not self.distinct:
+            return list(rows)
+        entries = {}
+        for row in rows:
+            entries.setdefault(getattr(row, self.field), row)
+        return list(entries.values())
+
+
+VOCABULARIES = {
+    vocabulary.model: vocabulary
+    for vocabulary in (
+        Vocabulary(AdministrationSchedule, "text"),
+        Vocabulary(
+            ChiefComplaint,
+            "text",
+            ordering=("text", "pk"),
+            distinct=True,
+            active=True,
+        ),
+        Vocabulary(Diagnosis, "text"),
+        Vocabulary(Ethnicity, "name"),
+        Vocabulary(InventoryCategory, "name"),
+        Vocabulary(InventoryForm, "name"),
+        Vocabulary(Manufacturer, "name"),
+        Vocabulary(Medication, "text"),
+        Vocabulary(Race, "name"),
+        Vocabulary(State, "name"),
+        Vocabulary(Test, "text"),
+    )
+}
+
+
+def vocabulary_version_key(model):
+    return f"vocabulary-version-{model._meta.label_lower}"
+
+
+def new_vocabulary_version():
+    """
+    A starting version for a counter that's missing from the cache, unlikely to
+    match one a process has kept from before the counter was evicted.
+    """
+    return int(time.time() * 1000)
+
+
+def invalidate_vocabulary(model):
+    key = vocabulary_version_key(model)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, new_vocabulary_version(), None)
+
+
+class VocabularyIndex:
+    """
+    A vocabulary's entries with their lowercased texts sorted twice over: whole,
+    to find the texts starting with a search by bisection, and word by word, to
+    find the texts with a later word starting with it. Any other texts
+    containing the search are found by a scan.
+    """
+
+    def __init__(self, entries, field):
+        self.entries = entries
+        self.texts = [
+            "" if value is None else str(value).lower()
+            for value in (getattr(entry, field) for entry in entries)
+        ]
+        self.prefixes = sorted(
+            (text, position) for position, text in enumerate(self.texts)
+        )
+        self.word_prefixes = sorted(
+            (word, position)
+            for position, text in enumerate(self.texts)
+            for word in text.split()[1:]
+        )
+
+    @staticmethod
+    def starting_with(keys, query):
+        start = end = bisect_left(keys, (query,))
+        while end < len(keys) and keys[end][0].startswith(query):
+            end += 1
+        return [position for _, position in keys[start:end]]
+
+    def search(self, query):
+        """
+        The entries containing query: those starting with it alphabetically,
+        then those with a word starting with it, then the rest.
+        """
+        query = query.lower()
+        if not query:
+            return list(self.entries)
+        ranked = self.starting_with(self.prefixes, query)
+        seen = set(ranked)
+        words = set(self.starting_with(self.word_prefixes, query)) - seen
+        ranked += sorted(words)
+        seen |= words
+        ranked += [
+            position
+            for position, text in enumerate(self.texts)
+            if query in text and position not in seen
+        ]
+        return [self.entries[position] for position in ranked]
+
+
+class VocabularyCache:
+    """
+    The indexes of the vocabularies this process has searched, with the
+    version each was built at.
+    """
+
+    def __init__(self):
+        self.indexes = {}
+
+    def get_index(self, model):
+        key = vocabulary_version_key(model)
+        version = cache.get(key)
+        if version is None:
+            cache.add(key, new_vocabulary_version(), None)
+            version = cache.get(key)
+        cached = self.indexes.get(model)
+        if version is not None and cached is not None and cached[0] == version:
+            return cached[1]
+        vocabulary = VOCABULARIES[model]
+        index = VocabularyIndex(vocabulary.entries(), vocabulary.field)
+        if version is not None:
+            self.indexes[model] = (version, index)
+        return index
+
+
+vocabulary_cache = VocabularyCache()
+
+
+def search_vocabulary(model, query):
+    """
+    The rows of model's vocabulary containing query, ignoring case, best match
+    first.
+    """
+    return vocabulary_cache.get_index(model).search(query or "")